@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+账户事件推送
+
+资金、持仓、委托的变化（交易回调的增量更新和后台对账）以及成交回报发布到账户的事件中心，
+每个推送连接（SSE）订阅一个有界缓冲。发布方只做追加，不等待消费；某个连接消费过慢、
+缓冲溢出时丢弃它缓冲中的增量并标记为需要重新同步，由连接重发一次完整快照后继续推送增量。
+"""
+import itertools
+import threading
+import time
+from collections import deque
+
+from logger_config import get_logger
+
+log = get_logger(__name__)
+
+EVENT_ASSET = 'asset'
+EVENT_POSITION = 'position'
+EVENT_POSITION_REMOVED = 'position_removed'
+EVENT_ORDER = 'order'
+EVENT_TRADE = 'trade'
+
+RESYNC = object()  # EventSubscriber.get的返回值：缓冲曾溢出，需要重发快照
+
+
+class AccountEvent:
+    __slots__ = ('seq', 'kind', 'data', 'ts')
+
+    def __init__(self, seq, kind, data):
+        self.seq = seq
+        self.kind = kind
+        self.data = data
+        self.ts = time.time()
+
+
+class EventSubscriber:
+    """单个推送连接的有界事件缓冲"""
+
+    def __init__(self, buffer_size):
+        self.buffer_size = buffer_size
+        self._cond = threading.Condition()
+        self._events = deque()
+        self._overflowed = False
+        self.overflows = 0
+
+    def put(self, event):
+        with self._cond:
+            if self._overflowed:
+                return
+            if len(self._events) >= self.buffer_size:
+                self._events.clear()
+                self._overflowed = True
+                self.overflows += 1
+            else:
+                self._events.append(event)
+            self._cond.notify()
+
+    def get(self, timeout):
+        """等待并取出缓冲中的全部事件；超时返回空列表，缓冲曾溢出时返回RESYNC"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._events or self._overflowed, timeout)
+            if self._overflowed:
+                self._overflowed = False
+                return RESYNC
+            events = list(self._events)
+            self._events.clear()
+            return events
+
+
+class AccountEventHub:
+    """单个账户的事件中心"""
+
+    def __init__(self, account_id, buffer_size=256):
+        self.account_id = account_id
+        self.buffer_size = buffer_size
+        self._lock = threading.Lock()
+        self._seq = itertools.count(1)
+        self._subscribers = set()
+        self._published = 0
+        self._resyncs = 0
+
+    def subscribe(self):
+        subscriber = EventSubscriber(self.buffer_size)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+            self._resyncs += subscriber.overflows
+
+    def publish(self, kind, data):
+        """发布事件，没有订阅者时直接返回"""
+        with self._lock:
+            if not self._subscribers:
+                return
+            event = AccountEvent(next(self._seq), kind, data)
+            subscribers = list(self._subscribers)
+            self._published += 1
+        for subscriber in subscribers:
+            subscriber.put(event)
+
+    def stats(self):
+        with self._lock:
+            subscribers = list(self._subscribers)
+            return {
+                'subscribers': len(subscribers),
+                'published': self._published,
+                'resyncs': self._resyncs + sum(s.overflows for s in subscribers),
+            }
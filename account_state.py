@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+"""
+账户状态缓存
+
+资金和持仓由交易回调（on_stock_order/on_stock_trade/on_stock_asset/on_stock_position）
+增量维护，后台线程定期用柜台实时查询对账；回调触发的对账按最小间隔合并，密集成交时不反复查询柜台。
+仓位计算和查询接口直接读取内存快照，
+快照超过陈旧上限时由调用方显式回退到实时查询。快照的每次实际变化通知给监听者（账户事件推送）。
+"""
+import threading
+import time
+from dataclasses import dataclass, fields, replace
+
+from xtquant import xtconstant
+from logger_config import get_logger
+from position_table import PositionTable
+from account_events import EVENT_ASSET, EVENT_POSITION, EVENT_POSITION_REMOVED
+
+log = get_logger(__name__)
+
+# 仍在途的委托状态（未报/待报/已报/已报待撤/部成待撤/部成）
+ACTIVE_ORDER_STATUS = {48, 49, 50, 51, 52, 55}
+# 终态中需要释放剩余冻结资金的状态（部撤/已撤/废单）
+RELEASE_ORDER_STATUS = {53, 54, 57}
+
+
+def _get_field(obj, name, default=None):
+    """兼容xt对象和字典两种格式读取字段"""
+    if isinstance(obj, dict):
+        return obj.get(name, default)
+    return getattr(obj, name, default)
+
+
+@dataclass
+class AssetSnapshot:
+    """资金快照，字段与XtAsset一致"""
+    account_type: int = 0
+    account_id: str = ''
+    cash: float = 0.0
+    frozen_cash: float = 0.0
+    market_value: float = 0.0
+    total_asset: float = 0.0
+
+    @classmethod
+    def from_xt(cls, asset):
+        return cls(**{f.name: _get_field(asset, f.name, f.default) for f in fields(cls)})
+
+
+@dataclass
+class PositionSnapshot:
+    """持仓快照，字段与XtPosition一致"""
+    account_type: int = 0
+    account_id: str = ''
+    stock_code: str = ''
+    volume: int = 0
+    can_use_volume: int = 0
+    open_price: float = 0.0
+    market_value: float = 0.0
+    frozen_volume: int = 0
+    on_road_volume: int = 0
+    yesterday_volume: int = 0
+    avg_price: float = 0.0
+    direction: int = 0
+
+    @classmethod
+    def from_xt(cls, position):
+        return cls(**{f.name: _get_field(position, f.name, f.default) for f in fields(cls)})
+
+
+class AccountState:
+    """单个账户的资金/持仓内存快照"""
+
+    def __init__(self, account_id):
+        self.account_id = account_id
+        self._lock = threading.Lock()
+        self._asset = None
+        self._positions = {}
+        self._asset_ts = 0.0  # 最近一次权威更新（查询或柜台推送）的时间
+        self._positions_ts = 0.0
+        self._positions_version = 0  # 持仓每次变化加1，用于判断列式快照是否需要重建
+        self._position_table = (-1, None)
+        self._order_frozen = {}  # order_id -> 本地估算的买单冻结资金
+        self._seen_orders = set()  # 已处理过冻结估算的在途委托，对账后不重复冻结；委托到达终态时移除
+        self._last_reconcile_ts = 0.0
+        self.reconciles = 0
+        self._reconcile_event = threading.Event()
+        self._reconcile_thread = None
+        self._stopped = threading.Event()
+        self._listeners = []
+
+    def add_listener(self, listener):
+        """注册变化监听 listener(kind, data)：资金变化为(asset, AssetSnapshot)，
+        持仓变化为(position, PositionSnapshot)，持仓消失为(position_removed, 股票代码)"""
+        self._listeners.append(listener)
+
+    def _notify(self, changes):
+        """在锁外通知监听者，监听者异常不影响状态更新"""
+        for kind, data in changes:
+            for listener in self._listeners:
+                try:
+                    listener(kind, data)
+                except Exception as e:
+                    log.error(f"{self.account_id} 账户状态变化通知失败 {kind}: {e}")
+
+    # ---------- 读取 ----------
+
+    def get_asset(self, max_age):
+        """返回资金快照，超过max_age秒未对账则返回None"""
+        with self._lock:
+            if self._asset is None or time.time() - self._asset_ts > max_age:
+                return None
+            return self._asset
+
+    def get_positions(self, max_age):
+        """返回持仓快照 {stock_code: PositionSnapshot}，超过max_age秒未对账则返回None"""
+        with self._lock:
+            if not self._positions_ts or time.time() - self._positions_ts > max_age:
+                return None
+            return dict(self._positions)
+
+    def get_position_table(self, max_age):
+        """返回列式持仓快照PositionTable，超过max_age秒未对账则返回None；持仓未变化时复用上次构建的结果"""
+        with self._lock:
+            if not self._positions_ts or time.time() - self._positions_ts > max_age:
+                return None
+            version, table = self._position_table
+            if version == self._positions_version:
+                return table
+            version = self._positions_version
+            positions = list(self._positions.values())
+        table = PositionTable.from_positions(positions)
+        with self._lock:
+            if self._positions_version == version:
+                self._position_table = (version, table)
+        return table
+
+    def age(self):
+        """资金和持仓快照距上次对账的秒数"""
+        now = time.time()
+        with self._lock:
+            return {
+                'asset': now - self._asset_ts if self._asset_ts else None,
+                'positions': now - self._positions_ts if self._positions_ts else None,
+            }
+
+    # ---------- 全量替换（实时查询结果） ----------
+
+    def replace_asset(self, asset):
+        snapshot = AssetSnapshot.from_xt(asset)
+        with self._lock:
+            changed = snapshot != self._asset
+            self._asset = snapshot
+            self._asset_ts = time.time()
+            self._order_frozen.clear()
+        if changed:
+            self._notify([(EVENT_ASSET, snapshot)])
+        return snapshot
+
+    def replace_positions(self, positions):
+        snapshot = {}
+        for position in positions:
+            pos = PositionSnapshot.from_xt(position)
+            snapshot[pos.stock_code] = pos
+        with self._lock:
+            old = self._positions
+            self._positions = snapshot
+            self._positions_ts = time.time()
+            self._positions_version += 1
+        changes = [(EVENT_POSITION, pos) for code, pos in snapshot.items() if old.get(code) != pos]
+        changes += [(EVENT_POSITION_REMOVED, code) for code in old if code not in snapshot]
+        self._notify(changes)
+        return dict(snapshot)
+
+    # ---------- 回调增量更新 ----------
+
+    def on_asset(self, asset):
+        """资金推送，直接覆盖"""
+        self.replace_asset(asset)
+
+    def on_position(self, position):
+        """持仓推送，覆盖单只股票"""
+        pos = PositionSnapshot.from_xt(position)
+        with self._lock:
+            self._positions[pos.stock_code] = pos
+            self._positions_version += 1
+        self._notify([(EVENT_POSITION, pos)])
+
+    def on_order(self, order):
+        """委托推送：新买单估算冻结资金，撤单/废单释放剩余冻结"""
+        order_id = order.order_id
+        status = order.order_status
+        with self._lock:
+            asset = self._asset
+            if self._asset is not None and order.order_type == xtconstant.STOCK_BUY:
+                if order_id not in self._seen_orders and status in ACTIVE_ORDER_STATUS:
+                    self._seen_orders.add(order_id)
+                    frozen = order.price * (order.order_volume - order.traded_volume)
+                    if frozen > 0:
+                        self._order_frozen[order_id] = frozen
+                        self._asset = replace(self._asset, cash=self._asset.cash - frozen,
+                                              frozen_cash=self._asset.frozen_cash + frozen)
+                elif order_id in self._order_frozen and status in RELEASE_ORDER_STATUS:
+                    released = self._order_frozen.pop(order_id)
+                    self._asset = replace(self._asset, cash=self._asset.cash + released,
+                                          frozen_cash=max(self._asset.frozen_cash - released, 0.0))
+            if status not in ACTIVE_ORDER_STATUS:
+                self._seen_orders.discard(order_id)
+                self._order_frozen.pop(order_id, None)
+            changes = [(EVENT_ASSET, self._asset)] if self._asset is not asset else []
+        self._notify(changes)
+        self.request_reconcile()
+
+    def on_trade(self, trade):
+        """成交推送：按成交量和成交金额调整持仓与资金"""
+        code = trade.stock_code
+        volume = trade.traded_volume
+        amount = trade.traded_amount
+        with self._lock:
+            asset = self._asset
+            pos = self._positions.get(code) or PositionSnapshot(account_id=self.account_id, stock_code=code)
+            if trade.order_type == xtconstant.STOCK_BUY:
+                self._positions[code] = replace(pos, volume=pos.volume + volume,
+                                                market_value=pos.market_value + amount)
+                if self._asset is not None:
+                    # 成交金额优先从冻结资金中扣除（本地估算的或对账时柜台已冻结的），不足部分扣可用资金
+                    frozen = self._order_frozen.get(trade.order_id)
+                    if frozen is not None:
+                        self._order_frozen[trade.order_id] = max(frozen - amount, 0.0)
+                    used = min(self._asset.frozen_cash, amount)
+                    self._asset = replace(self._asset, frozen_cash=self._asset.frozen_cash - used,
+                                          cash=self._asset.cash - (amount - used))
+            elif trade.order_type == xtconstant.STOCK_SELL:
+                self._positions[code] = replace(pos, volume=max(pos.volume - volume, 0),
+                                                can_use_volume=max(pos.can_use_volume - volume, 0),
+                                                market_value=max(pos.market_value - amount, 0.0))
+                if self._asset is not None:
+                    self._asset = replace(self._asset, cash=self._asset.cash + amount)
+            self._positions_version += 1
+            changes = [(EVENT_POSITION, self._positions[code])] if code in self._positions else []
+            if self._asset is not asset:
+                changes.append((EVENT_ASSET, self._asset))
+        self._notify(changes)
+        self.request_reconcile()
+
+    # ---------- 后台对账 ----------
+
+    def request_reconcile(self):
+        """唤醒对账线程尽快与柜台同步，距上次对账不足最小间隔时推迟到间隔结束"""
+        self._reconcile_event.set()
+
+    def start_reconciler(self, query_asset, query_positions, interval, extra_syncs=(), min_interval=5.0):
+        """启动后台对账线程
+
+        query_asset/query_positions: 实时查询函数，返回XtAsset和XtPosition列表
+        interval: 定期对账间隔（秒），回调触发的对账会提前唤醒
+        extra_syncs: 每轮对账后依次调用的其他同步函数（如委托簿同步）
+        min_interval: 两次对账的最小间隔（秒），期间的回调触发合并为一次
+        """
+        if self._reconcile_thread is not None:
+            return
+
+        def _loop():
+            while not self._stopped.is_set():
+                self._reconcile_event.wait(interval)
+                if self._stopped.is_set():
+                    break
+                # 合并连续的回调触发，两次对账至少间隔min_interval
+                self._stopped.wait(max(0.2, self._last_reconcile_ts + min_interval - time.time()))
+                if self._stopped.is_set():
+                    break
+                self._reconcile_event.clear()
+                self._last_reconcile_ts = time.time()
+                self.reconciles += 1
+                try:
+                    asset = query_asset()
+                    if asset is not None:
+                        self.replace_asset(asset)
+                    positions = query_positions()
+                    if positions is not None:
+                        self.replace_positions(positions)
+                    for sync in extra_syncs:
+                        sync()
+                except Exception as e:
+                    log.info(f"{self.account_id} 账户状态对账失败: {e}")
+
+        self._reconcile_thread = threading.Thread(target=_loop, name=f"state-{self.account_id}", daemon=True)
+        self._reconcile_thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._reconcile_event.set()
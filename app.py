@@ -6,6 +6,9 @@ from data_routes import data_bp
 from logger_config import setup_logging, get_logger
 from config import get_config
 from authentication import api_signature_required
+from quote_service import get_quote_service
+from instrument_cache import get_instrument_cache
+from bar_store import get_bar_store
 
 # 获取配置
 config = get_config()
@@ -38,6 +41,20 @@ for trader_config in config.get_enabled_traders():
     traders.append(trader)
     log.info(f"初始化交易账户: {trader_config.account_name} ({trader_config.account_id})")
 
+# 后台加载合约信息缓存，每个交易日开盘前刷新
+get_instrument_cache()
+
+# 收盘后追加本地K线库
+bar_store = get_bar_store()
+if bar_store is not None and config.data.bar_store_sync_time:
+    bar_store.start_daily_sync(config.data.bar_store_sync_time)
+
+# 内存行情表订阅各账户持仓
+quote_service = get_quote_service()
+if quote_service is not None:
+    for trader in traders:
+        quote_service.add_source(trader.held_symbols)
+
 # 注册交易路由蓝图
 app.register_blueprint(trade_bp)
 app.register_blueprint(data_bp)
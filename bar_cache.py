@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+历史K线缓存
+
+按 (股票代码, 周期, 复权方式, 是否补全) 缓存截止到上一交易日的已完成K线，按列存为NumPy数组，
+请求区间在缓存范围内时直接切片返回。当日K线仍在变化，不进缓存，每次单独读取。
+除权除息会改变前复权的历史价格，缓存只在加载当天有效，跨日后整体失效。
+缓存按字节数上限做LRU淘汰。
+"""
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+import numpy as np
+
+from logger_config import get_logger
+from config import get_config
+
+log = get_logger(__name__)
+
+_INDEX_ITEM_BYTES = 64  # 索引字符串对象的估算占用
+
+
+def to_epoch_ms(time_str, end=False):
+    """YYYYMMDD或YYYYMMDDHHMMSS转为毫秒时间戳，end=True时只有日期的取当天最后一刻"""
+    if len(time_str) <= 8:
+        time_str = time_str + ('235959' if end else '000000')
+    return int(datetime.strptime(time_str[:14], '%Y%m%d%H%M%S').timestamp() * 1000) + (999 if end else 0)
+
+
+class BarSeries:
+    """一只股票的已完成K线，columns为 {字段名: NumPy数组}，按time升序"""
+
+    def __init__(self, index, columns, start_ms, trade_date):
+        """
+        :param index: K线索引标签数组（与DataFrame的index一致）
+        :param columns: {字段名: NumPy数组}，必须包含time列
+        :param start_ms: 加载时请求的起始时间，早于它的区间不在缓存内
+        :param trade_date: 加载日期，跨日后失效
+        """
+        self.index = index
+        self.columns = columns
+        self.start_ms = start_ms
+        self.trade_date = trade_date
+        self.nbytes = sum(col.nbytes for col in columns.values()) + len(index) * _INDEX_ITEM_BYTES
+
+    def __len__(self):
+        return len(self.index)
+
+    def covers(self, start_ms):
+        return self.start_ms <= start_ms
+
+    def slice(self, start_ms, end_ms):
+        """返回 [start_ms, end_ms] 区间的 (index, columns)，数组为视图不复制"""
+        times = self.columns['time']
+        lo = np.searchsorted(times, start_ms, side='left')
+        hi = np.searchsorted(times, end_ms, side='right')
+        return self.index[lo:hi], {name: col[lo:hi] for name, col in self.columns.items()}
+
+
+class BarCache:
+    """按字节数上限做LRU淘汰的K线缓存"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expired = 0
+
+    def get(self, key, start_ms):
+        """返回覆盖start_ms起区间的当日缓存，否则返回None"""
+        today = time.strftime('%Y%m%d')
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.trade_date != today:
+                self._remove(key)
+                self._expired += 1
+                entry = None
+            if entry is None or not entry.covers(start_ms):
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry
+
+    def put(self, key, entry):
+        if entry.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self._bytes += entry.nbytes
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._evictions += 1
+
+    def _remove(self, key):
+        self._bytes -= self._entries.pop(key).nbytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': round(self._hits / lookups, 4) if lookups else None,
+                'evictions': self._evictions,
+                'expired': self._expired,
+            }
+
+
+_bar_cache = None
+_bar_cache_lock = threading.Lock()
+
+
+def get_bar_cache():
+    """返回全局K线缓存，BAR_CACHE_MAX_MB为0时不缓存"""
+    global _bar_cache
+    with _bar_cache_lock:
+        if _bar_cache is None:
+            _bar_cache = BarCache(int(get_config().data.bar_cache_max_mb * 1024 * 1024))
+        return _bar_cache
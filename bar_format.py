@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+K线输出格式转换
+
+把 (index, {字段名: NumPy数组}) 转为get_market_data_ex的两种返回格式，按列整体转换：
+timeFmt由整列时间戳一次向量化计算，各列一次tolist后再按行拼装，不逐行调用datetime。
+数值类型与原先df.values.tolist()的结果一致。
+"""
+from datetime import datetime
+
+import numpy as np
+
+_MS_PER_DAY = 86400 * 1000
+
+
+def _local_offset_ms():
+    """本地时区相对UTC的偏移（毫秒），A股所在时区没有夏令时，取当前偏移即可"""
+    return int(datetime.now().astimezone().utcoffset().total_seconds() * 1000)
+
+
+def time_fmt(times):
+    """毫秒时间戳数组转为本地日期字符串数组（YYYYMMDD），非正数为空字符串
+
+    分钟K线同一天的行很多，只对不重复的日期做格式化，再按下标展开。
+    """
+    times = np.asarray(times)
+    day_no = (times.astype(np.int64) + _local_offset_ms()) // _MS_PER_DAY
+    unique_days, inverse = np.unique(day_no, return_inverse=True)
+    days = unique_days.astype('datetime64[D]')
+    year = days.astype('datetime64[Y]').astype(np.int64) + 1970
+    month = days.astype('datetime64[M]').astype(np.int64) % 12 + 1
+    day = (days - days.astype('datetime64[M]')).astype(np.int64) + 1
+    text = (year * 10000 + month * 100 + day).astype(str).astype(object)[inverse.reshape(-1)]
+    text[~(times > 0)] = ''
+    return text
+
+
+def select(index, columns, field_list=None, count=-1):
+    """按字段和条数截取：count>0时取最后count根，field_list为空时保留全部字段"""
+    if count > 0:
+        index = index[-count:]
+        columns = {name: col[-count:] for name, col in columns.items()}
+    if field_list:
+        columns = {name: columns[name] for name in field_list if name in columns}
+    return index, columns
+
+
+def format_bars(index, columns, as_json=False):
+    """转为输出格式
+
+    as_json=False: {'columns': [...], 'index': [...], 'data': [[...], ...]}
+    as_json=True: [{字段名: 值, ...}, ...]
+    有time列时追加timeFmt列。
+    """
+    if not len(index) or not columns:
+        return [] if as_json else {'columns': [], 'index': [], 'data': []}
+    names = list(columns)
+    # 与DataFrame.values一致：全为数值列时统一提升为公共类型（如含浮点列时volume、time也输出为浮点数）
+    dtypes = [col.dtype for col in columns.values()]
+    common = np.result_type(*dtypes) if all(dtype.kind in 'iuf' for dtype in dtypes) else None
+    values = [(col if common is None else col.astype(common, copy=False)).tolist() for col in columns.values()]
+    if 'time' in columns:
+        names.append('timeFmt')
+        values.append(time_fmt(columns['time']).tolist())
+
+    if as_json:
+        return [dict(zip(names, row)) for row in zip(*values)]
+    return {
+        'columns': names,
+        'index': np.asarray(index).astype(str).tolist(),
+        'data': list(map(list, zip(*values))),
+    }
@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+"""
+本地列式K线库
+
+每只股票的每个周期/复权方式一个目录，字段按列存为定长二进制文件，meta.json记录字段类型、行数、
+起始时间和已完成到的日期：
+
+    {root}/{period}/{dividend_type}/{symbol}/meta.json
+    {root}/{period}/{dividend_type}/{symbol}/{field}.{generation}.bin
+
+读取时按meta用np.memmap映射各列，在time列上二分查找区间，只复制命中的行。
+收盘后先让终端下载新K线再增量追加；重叠的那根K线与库中不一致（除权除息后前复权价格整体变化）时按新一代文件重写。
+meta中的through只推进到下载成功的结束日期或实际写入的最后一根K线，不会声称覆盖库中没有的数据。
+meta.json最后原子替换，其他进程只依赖numpy即可读取，不需要QMT终端：
+
+    from bar_store import BarStore
+    index, columns = BarStore('data/bars').read('000001.SZ', '1d', 'none')
+
+服务端只对不复权（SERVED_DIVIDEND_TYPES）的请求读库：复权价格在除权除息当天整体变化，
+库要到收盘同步时才重写，期间拼上xtdata当天的K线会出现价格跳变。
+
+命令行补数：
+    python bar_store.py backfill --symbols 000001,600000 --period 1d --dividend none --start 20200101
+    python bar_store.py backfill --sector 沪深ETF --period 1d
+    python bar_store.py sync
+"""
+import argparse
+import glob
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from logger_config import get_logger
+from config import get_config
+from bar_cache import to_epoch_ms
+
+log = get_logger(__name__)
+
+SESSION_CLOSE = '15:30'  # 晚于该时间当天的K线视为已完成
+INDEX_FIELD = 'index'  # K线索引标签列，存为定长ASCII
+INDEX_DTYPE = 'S14'
+META_FILE = 'meta.json'
+SERVED_DIVIDEND_TYPES = ('none',)  # 服务端读库的复权方式，复权数据在除权除息后整体变化
+
+
+def completed_date(now=None):
+    """已完成K线的最后日期：收盘后为当天，否则为前一天"""
+    now = now or datetime.now()
+    if now.strftime('%H:%M') >= SESSION_CLOSE:
+        return now.strftime('%Y%m%d')
+    return (now - timedelta(days=1)).strftime('%Y%m%d')
+
+
+def _verified_through(index, through, downloaded):
+    """可记录的完成日期：下载成功时为through，否则只到实际拿到的最后一根K线"""
+    if downloaded or not len(index):
+        return through if downloaded else ''
+    return min(through, str(index[-1])[:8])
+
+
+def _download(symbols, period, start_time, end_time):
+    """让终端下载区间内的K线并等待结束，返回是否全部成功"""
+    from download_manager import get_download_manager, STATUS_FAILED
+    job = get_download_manager().download(symbols, period, start_time, end_time)
+    failed = [j for j in job.depends + [job] if j.status == STATUS_FAILED]
+    for j in failed:
+        log.error(f"K线库同步下载失败 {period} {start_time}-{end_time}: {j.error}")
+    return not failed
+
+
+class BarStore:
+    """按列存放的本地K线库"""
+
+    def __init__(self, root):
+        self.root = root
+        self._write_lock = threading.Lock()
+
+    def _dir(self, symbol, period, dividend_type):
+        return os.path.join(self.root, period, dividend_type, symbol)
+
+    def meta(self, symbol, period, dividend_type):
+        try:
+            with open(os.path.join(self._dir(symbol, period, dividend_type), META_FILE), encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def covers(self, symbol, period, dividend_type, start_ms, through):
+        """库中是否有从start_ms到through（YYYYMMDD）的完整K线"""
+        meta = self.meta(symbol, period, dividend_type)
+        return meta is not None and meta['start_ms'] <= start_ms and meta['through'] >= through
+
+    def series(self):
+        """库中全部 (symbol, period, dividend_type)"""
+        pattern = os.path.join(self.root, '*', '*', '*', META_FILE)
+        for path in glob.glob(pattern):
+            directory = os.path.dirname(path)
+            dividend_dir = os.path.dirname(directory)
+            yield (os.path.basename(directory), os.path.basename(os.path.dirname(dividend_dir)),
+                   os.path.basename(dividend_dir))
+
+    # ---------- 读取 ----------
+
+    def _map(self, directory, meta, name):
+        if not meta['rows']:
+            return np.empty(0, dtype=meta['dtypes'][name])
+        path = os.path.join(directory, f"{name}.{meta['generation']}.bin")
+        return np.memmap(path, dtype=meta['dtypes'][name], mode='r', shape=(meta['rows'],))
+
+    def read(self, symbol, period, dividend_type, start_ms=None, end_ms=None, fields=None):
+        """读取 [start_ms, end_ms] 区间的K线，返回 (index数组, {字段名: NumPy数组})；库中没有时返回None"""
+        directory = self._dir(symbol, period, dividend_type)
+        meta = self.meta(symbol, period, dividend_type)
+        if meta is None:
+            return None
+        times = self._map(directory, meta, 'time')
+        lo = 0 if start_ms is None else int(np.searchsorted(times, start_ms, side='left'))
+        hi = len(times) if end_ms is None else int(np.searchsorted(times, end_ms, side='right'))
+        names = [name for name in meta['fields'] if fields is None or name in fields or name == 'time']
+        columns = {name: np.array(self._map(directory, meta, name)[lo:hi]) for name in names}
+        index = np.char.decode(self._map(directory, meta, INDEX_FIELD)[lo:hi], 'ascii').astype(object)
+        return index, columns
+
+    # ---------- 写入 ----------
+
+    @staticmethod
+    def _storable(columns):
+        """只保存数值列"""
+        return {name: np.ascontiguousarray(col) for name, col in columns.items() if col.dtype.kind in 'biuf'}
+
+    def _write_meta(self, directory, meta):
+        tmp_path = os.path.join(directory, META_FILE + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, os.path.join(directory, META_FILE))
+
+    def write(self, symbol, period, dividend_type, index, columns, start_ms, through):
+        """整体重写一只股票的K线，写入新一代文件后替换meta，旧文件随后删除"""
+        columns = self._storable(columns)
+        if 'time' not in columns:
+            raise ValueError(f"{symbol} K线缺少time列")
+        directory = self._dir(symbol, period, dividend_type)
+        with self._write_lock:
+            os.makedirs(directory, exist_ok=True)
+            old = self.meta(symbol, period, dividend_type)
+            generation = old['generation'] + 1 if old else 1
+            columns[INDEX_FIELD] = np.asarray(index, dtype=INDEX_DTYPE)
+            for name, col in columns.items():
+                col.tofile(os.path.join(directory, f"{name}.{generation}.bin"))
+            self._write_meta(directory, {
+                'symbol': symbol,
+                'period': period,
+                'dividend_type': dividend_type,
+                'fields': [name for name in columns if name != INDEX_FIELD],
+                'dtypes': {name: col.dtype.str for name, col in columns.items()},
+                'rows': len(index),
+                'generation': generation,
+                'start_ms': start_ms,
+                'through': through,
+                'updated': time.strftime('%Y-%m-%d %H:%M:%S'),
+            })
+            # 其他进程可能仍映射着旧文件（Windows下无法删除），留到下次重写再清理
+            for path in glob.glob(os.path.join(directory, '*.bin')):
+                if not path.endswith(f".{generation}.bin"):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+
+    def append(self, symbol, period, dividend_type, index, columns, through):
+        """在末尾追加K线，调用方保证time大于库中最后一根"""
+        directory = self._dir(symbol, period, dividend_type)
+        with self._write_lock:
+            meta = self.meta(symbol, period, dividend_type)
+            columns = self._storable(columns)
+            columns[INDEX_FIELD] = np.asarray(index, dtype=INDEX_DTYPE)
+            if set(columns) != set(meta['dtypes']):
+                raise ValueError(f"{symbol} 追加的字段与库中不一致")
+            for name, col in columns.items():
+                dtype = np.dtype(meta['dtypes'][name])
+                with open(os.path.join(directory, f"{name}.{meta['generation']}.bin"), 'r+b') as f:
+                    # 截掉上次追加中断时meta未记录的残留数据
+                    f.truncate(meta['rows'] * dtype.itemsize)
+                    f.seek(0, os.SEEK_END)
+                    col.astype(dtype, copy=False).tofile(f)
+            meta['rows'] += len(index)
+            meta['through'] = max(meta['through'], through)
+            meta['updated'] = time.strftime('%Y-%m-%d %H:%M:%S')
+            self._write_meta(directory, meta)
+
+    # ---------- 与xtdata同步 ----------
+
+    def sync(self, symbol, period, dividend_type, start_time=None, end_time=None, downloaded=None):
+        """从xtdata补齐一只股票的K线，返回写入的行数
+
+        库中没有或需要更早的起始时间时整体重写；否则从库中最后一根K线开始读取，
+        重叠的那根一致则只追加新K线，不一致（复权价格已变化）则整体重写。
+        读取前先让终端下载所需区间；downloaded为调用方已批量下载的结果（True/False），为None时在这里下载。
+        下载失败时through只推进到实际写入的最后一根K线。
+        """
+        from qmt_data import fetch_bars
+
+        through = end_time or completed_date()
+        meta = self.meta(symbol, period, dividend_type)
+        if meta is not None and start_time and to_epoch_ms(start_time) < meta['start_ms']:
+            meta = None
+        if meta is None:
+            if not start_time:
+                raise ValueError(f"{symbol} 不在库中，需要指定起始时间")
+            if downloaded is None:
+                downloaded = _download([symbol], period, start_time, through)
+            return self._rewrite(symbol, period, dividend_type, start_time, through, to_epoch_ms(start_time),
+                                 fetch_bars, downloaded)
+
+        if meta['through'] >= through:
+            return 0
+        start = datetime.fromtimestamp(meta['start_ms'] / 1000).strftime('%Y%m%d')
+        if not meta['rows']:
+            if downloaded is None:
+                downloaded = _download([symbol], period, start, through)
+            return self._rewrite(symbol, period, dividend_type, start, through, meta['start_ms'], fetch_bars,
+                                 downloaded)
+        last_time = int(self._map(self._dir(symbol, period, dividend_type), meta, 'time')[-1])
+        last_index, last_columns = self.read(symbol, period, dividend_type, start_ms=last_time)
+        if downloaded is None:
+            downloaded = _download([symbol], period, last_index[-1][:8], through)
+        index, columns = fetch_bars([symbol], period, last_index[-1][:8], through, dividend_type, True,
+                                    download=False)[symbol]
+        times = columns.get('time', np.empty(0, dtype=np.int64))
+        overlap = np.flatnonzero(times == last_time)
+        if not len(overlap) or any(
+                name in columns and not np.isclose(columns[name][overlap[0]], last_columns[name][-1], equal_nan=True)
+                for name in meta['fields']):
+            log.info(f"{symbol} {period} {dividend_type} 历史K线已变化，整体重写")
+            return self._rewrite(symbol, period, dividend_type, start, through, meta['start_ms'], fetch_bars,
+                                 downloaded)
+        new = times > last_time
+        verified = _verified_through(index, through, downloaded)
+        if not new.any() and verified <= meta['through']:
+            return 0
+        self.append(symbol, period, dividend_type, index[new], {name: col[new] for name, col in columns.items()},
+                    verified)
+        return int(new.sum())
+
+    def _rewrite(self, symbol, period, dividend_type, start_time, through, start_ms, fetch_bars, downloaded):
+        index, columns = fetch_bars([symbol], period, start_time, through, dividend_type, True,
+                                    download=False)[symbol]
+        if not len(index):
+            return 0
+        self.write(symbol, period, dividend_type, index, columns, start_ms,
+                   _verified_through(index, through, downloaded))
+        return len(index)
+
+    def sync_all(self):
+        """追加库中全部股票的新K线，每个周期先一次批量下载所需区间"""
+        through = completed_date()
+        groups = {}
+        for symbol, period, dividend_type in self.series():
+            meta = self.meta(symbol, period, dividend_type)
+            if meta is not None and meta['through'] < through:
+                groups.setdefault(period, []).append((symbol, dividend_type, meta['through']))
+        total, failed = 0, 0
+        for period, series in groups.items():
+            symbols = list(dict.fromkeys(symbol for symbol, _, _ in series))
+            downloaded = _download(symbols, period, min(start for _, _, start in series), through)
+            for symbol, dividend_type, _ in series:
+                try:
+                    total += self.sync(symbol, period, dividend_type, end_time=through, downloaded=downloaded)
+                except Exception as e:
+                    failed += 1
+                    log.error(f"K线库同步失败 {symbol} {period} {dividend_type}: {e}")
+        log.info(f"K线库同步完成: 写入{total}根K线，失败{failed}只")
+        return total
+
+    def start_daily_sync(self, sync_time, check_interval=60.0):
+        """每天sync_time（HH:MM）后追加一次当天已完成的K线"""
+        state = {'date': ''}
+
+        def _loop():
+            while True:
+                now = datetime.now()
+                today = now.strftime('%Y%m%d')
+                if state['date'] != today and now.strftime('%H:%M') >= sync_time:
+                    state['date'] = today
+                    self.sync_all()
+                time.sleep(check_interval)
+
+        threading.Thread(target=_loop, name="bar-store-sync", daemon=True).start()
+
+
+_bar_store = None
+_bar_store_lock = threading.Lock()
+
+
+def get_bar_store():
+    """返回全局K线库，BAR_STORE_DIR为空时返回None"""
+    global _bar_store
+    root = get_config().data.bar_store_dir
+    if not root:
+        return None
+    with _bar_store_lock:
+        if _bar_store is None:
+            _bar_store = BarStore(root)
+        return _bar_store
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地列式K线库补数/同步')
+    sub = parser.add_subparsers(dest='command', required=True)
+    backfill = sub.add_parser('backfill', help='从xtdata下载并写入K线，补齐库中缺少的区间')
+    backfill.add_argument('--symbols', default='', help='股票代码，逗号分隔')
+    backfill.add_argument('--sector', default='', help='板块名称，如 沪深A股、沪深ETF')
+    backfill.add_argument('--period', default='1d')
+    backfill.add_argument('--dividend', default='none', help='复权方式，服务端只对不复权请求读库')
+    backfill.add_argument('--start', default='20200101', help='起始日期 YYYYMMDD')
+    backfill.add_argument('--end', default='', help='结束日期 YYYYMMDD，默认最近一个已完成交易日')
+    sub.add_parser('sync', help='追加库中全部股票的新K线')
+    args = parser.parse_args()
+
+    store = get_bar_store()
+    if store is None:
+        parser.error('BAR_STORE_DIR 未配置')
+    if args.command == 'sync':
+        store.sync_all()
+        return
+
+    import symbol_util
+    from xtquant import xtdata
+    symbols = [symbol_util.get_stock_id_xt(s.strip()) for s in args.symbols.split(',') if s.strip()]
+    if args.sector:
+        symbols += xtdata.get_stock_list_in_sector(args.sector) or []
+    from download_manager import get_download_manager
+    symbols = list(dict.fromkeys(symbols))
+    through = args.end or completed_date()
+    job = get_download_manager().submit(symbols, args.period, args.start, through)
+    progress = job.to_dict()
+    while progress['status'] in ('pending', 'running'):
+        progress = job.wait_change(progress['version'], 10.0)
+        log.info(f"下载进度 {progress['finished']}/{progress['total']} {progress['message']}")
+    downloaded = progress['status'] != 'failed'
+    if not downloaded:
+        log.error(f"下载失败: {progress['error']}")
+    for i, symbol in enumerate(symbols, 1):
+        try:
+            rows = store.sync(symbol, args.period, args.dividend, args.start, through, downloaded=downloaded)
+            log.info(f"[{i}/{len(symbols)}] {symbol} 写入{rows}根K线")
+        except Exception as e:
+            log.error(f"[{i}/{len(symbols)}] {symbol} 补数失败: {e}")
+
+
+if __name__ == '__main__':
+    main()
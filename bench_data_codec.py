@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+行情数据格式基准
+
+对比get_market_data_ex的JSON与arrow/npz/msgpack二进制格式的响应大小、服务端编码和客户端解码耗时。
+使用合成的1分钟K线，不需要QMT终端；未安装pyarrow或msgpack时跳过对应格式：
+
+    python bench_data_codec.py --symbols 300 --bars 240
+"""
+import argparse
+import json
+import time
+from datetime import datetime
+
+import numpy as np
+
+import data_codec
+from bar_format import format_bars
+from order_helper import decode_columns
+
+FIELDS = ['time', 'open', 'high', 'low', 'close', 'volume', 'amount', 'settelementPrice', 'openInterest',
+          'preClose', 'suspendFlag']
+
+
+def make_bars(symbols, bars):
+    """生成symbols只股票、每只bars根的1分钟K线 {股票: (index, columns)}"""
+    start_ms = int(datetime(2026, 1, 5, 9, 31).timestamp() * 1000)
+    times = start_ms + np.arange(bars, dtype=np.int64) * 60000
+    index = np.array([datetime.fromtimestamp(t / 1000).strftime('%Y%m%d%H%M%S') for t in times], dtype=object)
+    rng = np.random.default_rng(0)
+    result = {}
+    for i in range(symbols):
+        close = 10 + rng.standard_normal(bars).cumsum() * 0.01
+        result[f"{i:06d}.SZ"] = (index, {
+            'time': times,
+            'open': close, 'high': close + 0.01, 'low': close - 0.01, 'close': close,
+            'volume': rng.integers(0, 100000, bars), 'amount': close * 1000,
+            'settelementPrice': np.zeros(bars), 'openInterest': np.zeros(bars, dtype=np.int64),
+            'preClose': close, 'suspendFlag': np.zeros(bars, dtype=np.int64),
+        })
+    return result
+
+
+def encode_json(bars):
+    data = {stock: format_bars(index, columns) for stock, (index, columns) in bars.items()}
+    return json.dumps({'status': 'success', 'data': data}).encode('utf-8')
+
+
+def best_of(repeat, func, *args):
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        start_ts = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start_ts)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='行情数据格式基准')
+    parser.add_argument('--symbols', type=int, default=300)
+    parser.add_argument('--bars', type=int, default=240, help='每只股票的K线根数（默认1个交易日的1分钟K线）')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    bars = make_bars(args.symbols, args.bars)
+    print(f"{args.symbols}只 x {args.bars}根 = {args.symbols * args.bars}行，取{args.repeat}次最优")
+
+    encode_ts, body = best_of(args.repeat, encode_json, bars)
+    decode_ts, _ = best_of(args.repeat, json.loads, body)
+    json_size = len(body)
+    print(f"{'json':8s} {json_size / 1024:9.0f}KB  编码 {encode_ts * 1000:7.1f}ms  解码 {decode_ts * 1000:7.1f}ms")
+
+    for fmt in (data_codec.FORMAT_ARROW, data_codec.FORMAT_NPZ, data_codec.FORMAT_MSGPACK):
+        try:
+            encode_ts, body = best_of(args.repeat, lambda: data_codec.encode(data_codec.bars_to_columns(bars), fmt)[0])
+            decode_ts, _ = best_of(args.repeat, decode_columns, body, fmt)
+        except (data_codec.UnsupportedFormatError, ImportError) as e:
+            print(f"{fmt:8s} 跳过: {e}")
+            continue
+        print(f"{fmt:8s} {len(body) / 1024:9.0f}KB  编码 {encode_ts * 1000:7.1f}ms  解码 {decode_ts * 1000:7.1f}ms"
+              f"  大小 {len(body) / json_size:.0%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+get_market_data_ex输出转换基准
+
+对比逐行转换（df.values.tolist + 每行datetime.fromtimestamp + 每行dict）与bar_format按列转换的
+单行耗时。使用合成的分钟K线，不需要QMT终端：
+
+    python bench_market_data.py --symbols 50 --bars 4800
+"""
+import argparse
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from bar_format import format_bars
+
+FIELDS = ['time', 'open', 'high', 'low', 'close', 'volume', 'amount', 'settelementPrice', 'openInterest',
+          'preClose', 'suspendFlag']
+
+
+def make_frames(symbols, bars):
+    """生成symbols只股票、每只bars根的分钟K线DataFrame"""
+    start_ms = int(datetime(2026, 1, 5, 9, 31).timestamp() * 1000)
+    times = start_ms + np.arange(bars, dtype=np.int64) * 60000
+    index = pd.Index(pd.to_datetime(times, unit='ms').strftime('%Y%m%d%H%M%S'))
+    rng = np.random.default_rng(0)
+    frames = {}
+    for i in range(symbols):
+        close = 10 + rng.standard_normal(bars).cumsum() * 0.01
+        frames[f"{i:06d}.SZ"] = pd.DataFrame({
+            'time': times,
+            'open': close, 'high': close + 0.01, 'low': close - 0.01, 'close': close,
+            'volume': rng.integers(0, 100000, bars), 'amount': close * 1000,
+            'settelementPrice': np.zeros(bars), 'openInterest': np.zeros(bars, dtype=np.int64),
+            'preClose': close, 'suspendFlag': np.zeros(bars, dtype=np.int64),
+        }, columns=FIELDS, index=index)
+    return frames
+
+
+def convert_rows(df, as_json):
+    """逐行转换（原实现）"""
+    columns = list(df.columns)
+    data = df.values.tolist()
+    if 'time' in columns:
+        time_idx = columns.index('time')
+        for row in data:
+            ts_ms = row[time_idx]
+            if ts_ms and ts_ms > 0:
+                row.append(datetime.fromtimestamp(ts_ms / 1000).strftime('%Y%m%d'))
+            else:
+                row.append('')
+        columns.append('timeFmt')
+    if as_json:
+        return [dict(zip(columns, row)) for row in data]
+    return {'columns': columns, 'index': [str(i) for i in df.index], 'data': data}
+
+
+def convert_columns(df, as_json):
+    """按列转换（bar_format）"""
+    index = df.index.astype(str).to_numpy(dtype=object)
+    return format_bars(index, {name: df[name].to_numpy() for name in df.columns}, as_json=as_json)
+
+
+def bench(frames, convert, as_json, repeat):
+    rows = sum(len(df) for df in frames.values())
+    best = float('inf')
+    for _ in range(repeat):
+        start_ts = time.perf_counter()
+        for df in frames.values():
+            convert(df, as_json)
+        best = min(best, time.perf_counter() - start_ts)
+    return best, best / rows * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description='get_market_data_ex输出转换基准')
+    parser.add_argument('--symbols', type=int, default=50)
+    parser.add_argument('--bars', type=int, default=4800, help='每只股票的K线根数（默认20个交易日的1分钟K线）')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    frames = make_frames(args.symbols, args.bars)
+    print(f"{args.symbols}只 x {args.bars}根 = {args.symbols * args.bars}行，取{args.repeat}次最优")
+    for as_json in (False, True):
+        label = 'json=1' if as_json else 'json=0'
+        row_total, row_ns = bench(frames, convert_rows, as_json, args.repeat)
+        col_total, col_ns = bench(frames, convert_columns, as_json, args.repeat)
+        print(f"{label}  逐行: {row_total * 1000:8.1f}ms {row_ns:7.0f}ns/行   "
+              f"按列: {col_total * 1000:8.1f}ms {col_ns:7.0f}ns/行   加速 {row_total / col_total:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
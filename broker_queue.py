@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+账户柜台调用队列
+
+每个账户一个有界优先级队列和一个工作线程，所有对XtQuantTrader的下单、撤单、查询调用
+都在该线程上串行执行。撤单优先于下单，下单优先于查询；队列满时立即拒绝而不是阻塞请求线程。
+"""
+import itertools
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+from logger_config import get_logger
+
+log = get_logger(__name__)
+
+PRIORITY_CANCEL = 0
+PRIORITY_ORDER = 1
+PRIORITY_QUERY = 2
+
+PRIORITY_NAMES = {
+    PRIORITY_CANCEL: 'cancel',
+    PRIORITY_ORDER: 'order',
+    PRIORITY_QUERY: 'query',
+}
+
+
+class TradeQueueFullError(Exception):
+    """账户柜台调用队列已满"""
+    pass
+
+
+class BrokerCallInFlightError(TimeoutError):
+    """等待超时时调用已在工作线程上执行，结果未知（委托可能已提交）"""
+    pass
+
+
+class BrokerQueue:
+    """单账户柜台调用队列"""
+
+    def __init__(self, name, maxsize=64, call_timeout=30.0):
+        """
+        :param name: 队列名称，通常为账户ID
+        :param maxsize: 队列最大长度，超过后新请求抛出TradeQueueFullError
+        :param call_timeout: 调用方等待结果的最长时间（秒）
+        """
+        self.name = name
+        self.maxsize = maxsize
+        self.call_timeout = call_timeout
+        self._queue = queue.PriorityQueue(maxsize)
+        self._counter = itertools.count()
+        self._stats_lock = threading.Lock()
+        self._wait_ms = deque(maxlen=1000)
+        self._service_ms = deque(maxlen=1000)
+        self._processed = 0
+        self._rejected = 0
+        self._failed = 0
+        self._worker = threading.Thread(target=self._run, name=f"broker-{name}", daemon=True)
+        self._worker.start()
+
+    def call(self, priority, fn, *args):
+        """在工作线程上执行fn(*args)并等待结果
+
+        :param priority: PRIORITY_CANCEL / PRIORITY_ORDER / PRIORITY_QUERY，数值越小越先执行
+        :raises TradeQueueFullError: 队列已满
+        :raises TimeoutError: 超过call_timeout仍在排队，已从队列中取消，不会再执行
+        :raises BrokerCallInFlightError: 超过call_timeout时已在执行，结果未知
+        """
+        if threading.current_thread() is self._worker:
+            return fn(*args)
+        future = Future()
+        try:
+            self._queue.put_nowait((priority, next(self._counter), time.perf_counter(), fn, args, future))
+        except queue.Full:
+            with self._stats_lock:
+                self._rejected += 1
+            raise TradeQueueFullError(f"账户{self.name}柜台请求队列已满({self.maxsize})，请稍后重试")
+        try:
+            return future.result(timeout=self.call_timeout)
+        except FutureTimeoutError:
+            name = PRIORITY_NAMES.get(priority, priority)
+            # 仍在排队的取消掉，工作线程取出时跳过，调用方收到的失败与实际一致
+            if future.cancel():
+                raise TimeoutError(f"账户{self.name}柜台请求{name}排队超过{self.call_timeout}秒，已取消")
+            raise BrokerCallInFlightError(f"账户{self.name}柜台请求{name}超过{self.call_timeout}秒仍在执行，结果未知")
+
+    def _run(self):
+        while True:
+            priority, _, enqueue_ts, fn, args, future = self._queue.get()
+            start_ts = time.perf_counter()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args))
+                failed = False
+            except BaseException as e:
+                future.set_exception(e)
+                failed = True
+            end_ts = time.perf_counter()
+            with self._stats_lock:
+                self._wait_ms.append((start_ts - enqueue_ts) * 1000)
+                self._service_ms.append((end_ts - start_ts) * 1000)
+                self._processed += 1
+                self._failed += failed
+
+    def stats(self):
+        """队列深度、排队时间和柜台处理时间（最近1000次调用）"""
+        with self._stats_lock:
+            wait_ms = sorted(self._wait_ms)
+            service_ms = sorted(self._service_ms)
+            return {
+                'name': self.name,
+                'depth': self._queue.qsize(),
+                'maxsize': self.maxsize,
+                'processed': self._processed,
+                'rejected': self._rejected,
+                'failed': self._failed,
+                'wait_ms': _summary(wait_ms),
+                'service_ms': _summary(service_ms),
+            }
+
+
+def _summary(samples):
+    if not samples:
+        return {'avg': 0, 'p50': 0, 'p99': 0, 'max': 0}
+    return {
+        'avg': round(sum(samples) / len(samples), 3),
+        'p50': round(samples[len(samples) // 2], 3),
+        'p99': round(samples[min(int(len(samples) * 0.99), len(samples) - 1)], 3),
+        'max': round(samples[-1], 3),
+    }
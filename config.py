@@ -149,11 +149,55 @@ class APIConfig:
         return self.client_secrets.get(client_id, '')
 
 
+@dataclass
+class TradeConfig:
+    """交易运行时配置"""
+    state_max_age: float = 60.0  # 账户状态快照最大陈旧时间（秒），超过后显式回退到实时查询
+    state_reconcile_interval: float = 10.0  # 账户状态后台对账间隔（秒）
+    state_reconcile_min_interval: float = 5.0  # 交易回调触发对账的最小间隔（秒）
+    fanout_max_workers: int = 8  # 多账户并发下单线程数
+    fanout_timeout: float = 30.0  # 多账户并发下单单账户超时（秒）
+    async_order_timeout: float = 5.0  # 异步下单等待委托回报的默认超时（秒）
+    broker_queue_size: int = 64  # 单账户柜台调用队列长度，队列满时拒绝新请求
+    broker_call_timeout: float = 30.0  # 柜台调用排队加执行的最长等待时间（秒）
+    reconnect_base_delay: float = 0.5  # 断线重连首次等待（秒），之后指数退避
+    reconnect_max_delay: float = 30.0  # 断线重连等待上限（秒）
+    journal_path: str = 'data/trade_journal.db'  # 交易事件日志SQLite文件，为空时不记录
+    journal_flush_interval: float = 0.05  # 交易事件日志合并提交的时间窗口（秒）
+    stream_buffer_size: int = 256  # 账户事件推送（SSE）每个连接的缓冲事件数，溢出时丢弃缓冲并重发快照
+    stream_heartbeat: float = 15.0  # 账户事件推送无事件时的心跳间隔（秒）
+
+
+@dataclass
+class DataConfig:
+    """行情数据运行时配置"""
+    quote_enabled: bool = True  # 是否启用订阅驱动的内存行情表
+    quote_max_age: float = 3.0  # 内存行情最大陈旧时间（秒），超过后回退到xtdata.get_full_tick拉取
+    quote_capacity: int = 4096  # 行情表预分配行数，不够时自动扩容
+    quote_recent_ttl: float = 600.0  # 查询过的标的保持订阅的时间（秒）
+    quote_refresh_interval: float = 5.0  # 重新计算订阅集合（持仓/自选/最近查询）的间隔（秒）
+    quote_resubscribe_interval: float = 60.0  # 只因最近查询的标的变化而重新订阅的最短间隔（秒）
+    quote_watchlist: str = ''  # 常驻订阅的自选标的，逗号分隔
+    instrument_sectors: str = '沪深A股,沪深ETF,沪深债券'  # 合约信息缓存加载的板块，逗号分隔
+    instrument_refresh_time: str = '09:00'  # 合约信息每个交易日的刷新时间（HH:MM），应早于开盘
+    bar_cache_max_mb: float = 256.0  # 历史K线缓存内存上限（MB），为0时不缓存
+    bar_store_dir: str = 'data/bars'  # 本地列式K线库目录，为空时不使用
+    bar_store_sync_time: str = '15:30'  # 每天追加K线库的时间（HH:MM），为空时不自动追加
+    download_workers: int = 1  # 历史数据批量下载并发任务数
+    download_wait_timeout: float = 30.0  # 行情请求等待缺失数据下载完成的最长时间（秒），超时后下载转入后台
+    stream_chunk_size: int = 50  # 流式返回历史行情时每批读取的股票数
+    tick_stream_max_symbols: int = 500  # 行情推送单个连接最多订阅的标的数
+    tick_stream_heartbeat: float = 15.0  # 行情推送无变化时的心跳间隔（秒）
+
+
 @dataclass
 class DingBotConfig:
     access_token: str = os.getenv('DINGTALK_ACCESS_TOKEN', '')
     secret: str = os.getenv('DINGTALK_SECRET', '')
     keyword: str = os.getenv('DINGTALK_KEYWORD', '')
+    queue_size: int = int(os.getenv('DINGTALK_QUEUE_SIZE', '256'))  # 后台通知队列长度，满时丢弃新消息
+    merge_window: float = float(os.getenv('DINGTALK_MERGE_WINDOW', '2'))  # 合并窗口（秒），窗口内的消息汇总为一条
+    rate_limit: int = int(os.getenv('DINGTALK_RATE_LIMIT', '20'))  # 每分钟最多发送条数，钉钉机器人限额为20
 
 
 class Config:
@@ -187,6 +231,12 @@ class Config:
         # 钉钉机器人配置
         self.dingtalk = DingBotConfig()
 
+        # 交易运行时配置
+        self.trade = TradeConfig()
+
+        # 行情数据运行时配置
+        self.data = DataConfig()
+
         # 从环境变量覆盖配置
         self._load_from_env()
     
@@ -221,6 +271,72 @@ class Config:
             self.api.client_secrets['qmt_client_001'] = os.getenv('QMT_CLIENT_001_SECRET')
         if os.getenv('OUTER_CLIENT_002_SECRET'):
             self.api.client_secrets['outer_client_002'] = os.getenv('OUTER_CLIENT_002_SECRET')
+
+        # 交易运行时配置
+        if os.getenv('STATE_MAX_AGE'):
+            self.trade.state_max_age = float(os.getenv('STATE_MAX_AGE'))
+        if os.getenv('STATE_RECONCILE_INTERVAL'):
+            self.trade.state_reconcile_interval = float(os.getenv('STATE_RECONCILE_INTERVAL'))
+        if os.getenv('STATE_RECONCILE_MIN_INTERVAL'):
+            self.trade.state_reconcile_min_interval = float(os.getenv('STATE_RECONCILE_MIN_INTERVAL'))
+        if os.getenv('FANOUT_MAX_WORKERS'):
+            self.trade.fanout_max_workers = int(os.getenv('FANOUT_MAX_WORKERS'))
+        if os.getenv('FANOUT_TIMEOUT'):
+            self.trade.fanout_timeout = float(os.getenv('FANOUT_TIMEOUT'))
+        if os.getenv('ASYNC_ORDER_TIMEOUT'):
+            self.trade.async_order_timeout = float(os.getenv('ASYNC_ORDER_TIMEOUT'))
+        if os.getenv('BROKER_QUEUE_SIZE'):
+            self.trade.broker_queue_size = int(os.getenv('BROKER_QUEUE_SIZE'))
+        if os.getenv('BROKER_CALL_TIMEOUT'):
+            self.trade.broker_call_timeout = float(os.getenv('BROKER_CALL_TIMEOUT'))
+        if os.getenv('RECONNECT_BASE_DELAY'):
+            self.trade.reconnect_base_delay = float(os.getenv('RECONNECT_BASE_DELAY'))
+        if os.getenv('RECONNECT_MAX_DELAY'):
+            self.trade.reconnect_max_delay = float(os.getenv('RECONNECT_MAX_DELAY'))
+        if os.getenv('JOURNAL_PATH') is not None:
+            self.trade.journal_path = os.getenv('JOURNAL_PATH')
+        if os.getenv('JOURNAL_FLUSH_INTERVAL'):
+            self.trade.journal_flush_interval = float(os.getenv('JOURNAL_FLUSH_INTERVAL'))
+        if os.getenv('TRADE_STREAM_BUFFER_SIZE'):
+            self.trade.stream_buffer_size = int(os.getenv('TRADE_STREAM_BUFFER_SIZE'))
+        if os.getenv('TRADE_STREAM_HEARTBEAT'):
+            self.trade.stream_heartbeat = float(os.getenv('TRADE_STREAM_HEARTBEAT'))
+
+        # 行情数据运行时配置
+        if os.getenv('QUOTE_SERVICE_ENABLED'):
+            self.data.quote_enabled = os.getenv('QUOTE_SERVICE_ENABLED').lower() == 'true'
+        if os.getenv('QUOTE_MAX_AGE'):
+            self.data.quote_max_age = float(os.getenv('QUOTE_MAX_AGE'))
+        if os.getenv('QUOTE_CAPACITY'):
+            self.data.quote_capacity = int(os.getenv('QUOTE_CAPACITY'))
+        if os.getenv('QUOTE_RECENT_TTL'):
+            self.data.quote_recent_ttl = float(os.getenv('QUOTE_RECENT_TTL'))
+        if os.getenv('QUOTE_REFRESH_INTERVAL'):
+            self.data.quote_refresh_interval = float(os.getenv('QUOTE_REFRESH_INTERVAL'))
+        if os.getenv('QUOTE_RESUBSCRIBE_INTERVAL'):
+            self.data.quote_resubscribe_interval = float(os.getenv('QUOTE_RESUBSCRIBE_INTERVAL'))
+        if os.getenv('QUOTE_WATCHLIST') is not None:
+            self.data.quote_watchlist = os.getenv('QUOTE_WATCHLIST')
+        if os.getenv('INSTRUMENT_SECTORS'):
+            self.data.instrument_sectors = os.getenv('INSTRUMENT_SECTORS')
+        if os.getenv('INSTRUMENT_REFRESH_TIME'):
+            self.data.instrument_refresh_time = os.getenv('INSTRUMENT_REFRESH_TIME')
+        if os.getenv('BAR_CACHE_MAX_MB'):
+            self.data.bar_cache_max_mb = float(os.getenv('BAR_CACHE_MAX_MB'))
+        if os.getenv('BAR_STORE_DIR') is not None:
+            self.data.bar_store_dir = os.getenv('BAR_STORE_DIR')
+        if os.getenv('BAR_STORE_SYNC_TIME') is not None:
+            self.data.bar_store_sync_time = os.getenv('BAR_STORE_SYNC_TIME')
+        if os.getenv('DOWNLOAD_WORKERS'):
+            self.data.download_workers = int(os.getenv('DOWNLOAD_WORKERS'))
+        if os.getenv('DOWNLOAD_WAIT_TIMEOUT'):
+            self.data.download_wait_timeout = float(os.getenv('DOWNLOAD_WAIT_TIMEOUT'))
+        if os.getenv('STREAM_CHUNK_SIZE'):
+            self.data.stream_chunk_size = int(os.getenv('STREAM_CHUNK_SIZE'))
+        if os.getenv('TICK_STREAM_MAX_SYMBOLS'):
+            self.data.tick_stream_max_symbols = int(os.getenv('TICK_STREAM_MAX_SYMBOLS'))
+        if os.getenv('TICK_STREAM_HEARTBEAT'):
+            self.data.tick_stream_heartbeat = float(os.getenv('TICK_STREAM_HEARTBEAT'))
     
     def get_flask_config(self) -> Dict[str, Any]:
         """获取Flask应用配置字典"""
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+交易连接守护
+
+每个账户一个守护线程，收到on_disconnected或异常的on_account_status后在后台按指数退避加随机抖动重连，
+请求处理线程只读取连接状态（O(1)），连接断开期间立即失败而不是在请求中重连等待。
+"""
+import random
+import threading
+import time
+
+from logger_config import get_logger
+
+log = get_logger(__name__)
+
+STATE_CONNECTED = 'connected'
+STATE_CONNECTING = 'connecting'
+STATE_DISCONNECTED = 'disconnected'
+
+# on_account_status 状态分类，状态含义见 MyXtQuantTraderCallback.on_account_status
+ACCOUNT_READY_STATUS = {0, 5, 6}  # 正常/数据刷新校正中/收盘后
+ACCOUNT_RECONNECT_STATUS = {-1, 3, 7}  # 无效/失败/穿透副链接断开，需要重建连接
+# 其余状态（连接中/登陆中/初始化中/停用）账号暂不可用，但重连无法恢复，等待柜台推送新状态
+
+
+class TradeConnectionError(Exception):
+    """交易接口连接失败"""
+    pass
+
+
+class ConnectionSupervisor:
+    """单账户连接守护"""
+
+    def __init__(self, name, connect, on_change=None, base_delay=0.5, max_delay=30.0):
+        """
+        :param name: 名称，通常为账户ID
+        :param connect: 建立连接的函数，失败时抛出异常
+        :param on_change: 连接状态变化时在守护线程上调用 on_change(state, message)
+        :param base_delay: 首次重连等待（秒）
+        :param max_delay: 重连等待上限（秒）
+        """
+        self.name = name
+        self._connect = connect
+        self._on_change = on_change
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.state = STATE_DISCONNECTED
+        self.account_ready = True
+        self.account_status = None
+        self.last_error = ''
+        self.reconnect_count = 0
+        self.state_since = time.time()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"supervisor-{name}", daemon=True)
+        self._thread.start()
+
+    @property
+    def is_available(self):
+        """连接正常且账号可用"""
+        return self.state == STATE_CONNECTED and self.account_ready
+
+    def ensure_available(self):
+        """连接不可用时立即抛出TradeConnectionError"""
+        if self.state != STATE_CONNECTED:
+            raise TradeConnectionError(f"账户{self.name}交易连接{self.state}，"
+                                       f"已持续{time.time() - self.state_since:.1f}秒: {self.last_error}")
+        if not self.account_ready:
+            raise TradeConnectionError(f"账户{self.name}账号状态不可用({self.account_status})")
+
+    def mark_connected(self):
+        self._set_state(STATE_CONNECTED)
+
+    def mark_disconnected(self, reason=''):
+        """标记连接断开并唤醒守护线程重连，可在回调线程中调用"""
+        self.last_error = reason
+        if self.state == STATE_CONNECTED:
+            self._set_state(STATE_DISCONNECTED)
+        self._wakeup.set()
+
+    def on_account_status(self, status):
+        """处理on_account_status推送的状态码"""
+        self.account_status = status
+        self.account_ready = status in ACCOUNT_READY_STATUS
+        if status in ACCOUNT_RECONNECT_STATUS:
+            self.mark_disconnected(f"账号状态{status}")
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+
+    def status(self):
+        return {
+            'state': self.state,
+            'account_ready': self.account_ready,
+            'account_status': self.account_status,
+            'since': self.state_since,
+            'last_error': self.last_error,
+            'reconnect_count': self.reconnect_count,
+        }
+
+    def _set_state(self, state):
+        if state != self.state:
+            self.state = state
+            self.state_since = time.time()
+
+    def backoff_delay(self, attempt):
+        """第attempt次（从0开始）重连失败后的等待秒数：指数退避加抖动，在 [d/2, d] 之间，d不超过max_delay"""
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def _notify(self, message):
+        log.info(message)
+        if self._on_change is not None:
+            try:
+                self._on_change(self.state, message)
+            except Exception as e:
+                log.error(f"连接状态通知失败: {e}")
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait()
+            self._wakeup.clear()
+            if self._stopped.is_set() or self.state == STATE_CONNECTED:
+                continue
+            self._notify(f"账户{self.name}交易连接断开，开始后台重连: {self.last_error}")
+            attempt = 0
+            while not self._stopped.is_set() and self.state != STATE_CONNECTED:
+                self._set_state(STATE_CONNECTING)
+                try:
+                    self._connect()
+                    self.reconnect_count += 1
+                    self._set_state(STATE_CONNECTED)
+                    self._notify(f"账户{self.name}交易连接已恢复，重试{attempt + 1}次")
+                    break
+                except Exception as e:
+                    self.last_error = str(e)
+                    self._set_state(STATE_DISCONNECTED)
+                    # 指数退避 + 抖动，避免多个账户同时冲击交易终端
+                    delay = self.backoff_delay(attempt)
+                    log.info(f"账户{self.name}第{attempt + 1}次重连失败: {e}，{delay:.2f}秒后重试")
+                    attempt += 1
+                    self._stopped.wait(delay)
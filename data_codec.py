@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+行情数据二进制编码
+
+行情接口除JSON外支持三种按列的二进制格式，由format参数或Accept头选择：
+
+    arrow    application/vnd.apache.arrow.stream  Arrow IPC流（需要pyarrow）
+    npz      application/x-npz                   NumPy .npz（不压缩）
+    msgpack  application/x-msgpack               msgpack，数值列为原始字节加dtype/shape（需要msgpack）
+
+多只股票拼成一张长表：symbol列标明所属股票，index列为K线索引标签，其余为各字段；
+盘口等定长数组字段是二维数组（Arrow中为FixedSizeList）。客户端解码见order_helper.decode_columns。
+
+历史行情还可以流式返回：ndjson（application/x-ndjson）每只股票一行，arrow每只股票一个record batch，
+按批读取、读一批发一批，不在内存中拼出完整结果。推送接口（账户事件、行情）使用Server-Sent Events，见sse_message。
+"""
+import io
+import json
+
+import numpy as np
+
+FORMAT_JSON = 'json'
+FORMAT_ARROW = 'arrow'
+FORMAT_NPZ = 'npz'
+FORMAT_MSGPACK = 'msgpack'
+FORMAT_NDJSON = 'ndjson'
+
+MIMETYPES = {
+    FORMAT_ARROW: 'application/vnd.apache.arrow.stream',
+    FORMAT_NPZ: 'application/x-npz',
+    FORMAT_MSGPACK: 'application/x-msgpack',
+    FORMAT_NDJSON: 'application/x-ndjson',
+    FORMAT_JSON: 'application/json',
+}
+STREAM_FORMATS = (FORMAT_NDJSON, FORMAT_ARROW)
+_ACCEPT_ALIASES = {
+    'application/msgpack': FORMAT_MSGPACK,
+    'application/vnd.msgpack': FORMAT_MSGPACK,
+}
+SYMBOL_FIELD = 'symbol'
+INDEX_FIELD = 'index'
+
+
+class UnsupportedFormatError(ValueError):
+    """请求的格式未知或服务端缺少对应依赖"""
+
+
+def negotiate(request):
+    """按format参数、再按Accept头选择返回格式，默认JSON"""
+    fmt = request.args.get('format', '').lower()
+    if fmt:
+        if fmt not in MIMETYPES:
+            raise UnsupportedFormatError(f"不支持的格式: {fmt}，可选 {', '.join(MIMETYPES)}")
+        return fmt
+    offered = [MIMETYPES[FORMAT_JSON]] + [MIMETYPES[f] for f in (FORMAT_ARROW, FORMAT_NPZ, FORMAT_MSGPACK,
+                                                                 FORMAT_NDJSON)] + list(_ACCEPT_ALIASES)
+    best = request.accept_mimetypes.best_match(offered, default=MIMETYPES[FORMAT_JSON])
+    if best in _ACCEPT_ALIASES:
+        return _ACCEPT_ALIASES[best]
+    return next(f for f, mimetype in MIMETYPES.items() if mimetype == best)
+
+
+# ---------- 长表 ----------
+
+def _missing_column(template, rows):
+    """某只股票缺少的字段：数值列填NaN（整数列随之提升为浮点），其他类型填空值"""
+    if template.dtype.kind in 'biuf':
+        return np.full(rows, np.nan, dtype=np.result_type(template.dtype, np.float64))
+    return np.zeros(rows, dtype=template.dtype)
+
+
+def bars_to_columns(bars):
+    """{股票: (index, {字段名: 数组})} 拼成长表 {字段名: 数组}，含symbol和index列
+
+    字段取各股票的并集，按首次出现的顺序；某只股票缺少的字段按_missing_column填充。
+    """
+    bars = {symbol: frame for symbol, frame in bars.items() if len(frame[0]) and frame[1]}
+    if not bars:
+        return {SYMBOL_FIELD: np.empty(0, dtype=str), INDEX_FIELD: np.empty(0, dtype=str)}
+    templates = {}
+    for _, frame in bars.values():
+        for name, col in frame.items():
+            templates.setdefault(name, col)
+    columns = {
+        SYMBOL_FIELD: np.repeat(np.array(list(bars), dtype=str), [len(index) for index, _ in bars.values()]),
+        INDEX_FIELD: np.concatenate([np.asarray(index).astype(str) for index, _ in bars.values()]),
+    }
+    for name, template in templates.items():
+        columns[name] = np.concatenate([frame[name] if name in frame else _missing_column(template, len(index))
+                                        for index, frame in bars.values()])
+    return columns
+
+
+def records_to_columns(records):
+    """{股票: {字段名: 值}}（如get_full_tick的结果）转为长表，列表字段转为二维数组"""
+    records = {symbol: record for symbol, record in records.items() if record}
+    columns = {SYMBOL_FIELD: np.array(list(records), dtype=str)}
+    if not records:
+        return columns
+    for name in next(iter(records.values())):
+        values = [record.get(name) for record in records.values()]
+        col = np.array(values, dtype=str) if isinstance(values[0], str) else np.array(values)
+        # 缺值、长度不一的列表等无法成为定长数值列，按字符串输出
+        columns[name] = col.astype(str) if col.dtype == object else col
+    return columns
+
+
+# ---------- 编码 ----------
+
+def _import_pyarrow():
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise UnsupportedFormatError("Arrow格式需要在服务端安装pyarrow: pip install pyarrow")
+    return pa
+
+
+def _arrow_arrays(pa, columns, dictionary=True):
+    arrays = {}
+    for name, col in columns.items():
+        if col.dtype.kind == 'U':
+            array = pa.array(col.tolist(), type=pa.string())
+            arrays[name] = array.dictionary_encode() if dictionary and name == SYMBOL_FIELD else array
+        elif col.ndim == 2:
+            arrays[name] = pa.FixedSizeListArray.from_arrays(pa.array(np.ascontiguousarray(col).ravel()),
+                                                             col.shape[1])
+        else:
+            arrays[name] = pa.array(col)
+    return arrays
+
+
+def encode_arrow(columns):
+    pa = _import_pyarrow()
+    table = pa.table(_arrow_arrays(pa, columns))
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def _ascii_bytes(col):
+    """纯ASCII的字符串列转为字节串（S），比定长Unicode（U，每字符4字节）小"""
+    if col.dtype.kind != 'U':
+        return col
+    try:
+        return col.astype(bytes)
+    except UnicodeEncodeError:
+        return col
+
+
+def encode_npz(columns):
+    buf = io.BytesIO()
+    np.savez(buf, **{name: _ascii_bytes(col) for name, col in columns.items()})
+    return buf.getvalue()
+
+
+def encode_msgpack(columns):
+    try:
+        import msgpack
+    except ImportError:
+        raise UnsupportedFormatError("msgpack格式需要在服务端安装msgpack: pip install msgpack")
+    payload = {}
+    for name, col in columns.items():
+        if col.dtype.kind == 'U':
+            payload[name] = col.tolist()
+        else:
+            col = np.ascontiguousarray(col)
+            payload[name] = {'dtype': col.dtype.str, 'shape': list(col.shape), 'data': col.tobytes()}
+    return msgpack.packb({'columns': payload}, use_bin_type=True)
+
+
+ENCODERS = {
+    FORMAT_ARROW: encode_arrow,
+    FORMAT_NPZ: encode_npz,
+    FORMAT_MSGPACK: encode_msgpack,
+}
+
+
+def encode(columns, fmt):
+    """把长表编码为 (bytes, mimetype)"""
+    return ENCODERS[fmt](columns), MIMETYPES[fmt]
+
+
+# ---------- 流式编码 ----------
+
+def stream_ndjson(frames, as_json=False):
+    """(股票, index, columns) 序列编码为NDJSON，每只股票一行 {"symbol": ..., "data": ...}
+
+    data与非流式get_market_data_ex中该股票的值相同；中途出错时输出一行 {"error": ...} 后结束。
+    """
+    from bar_format import format_bars
+    try:
+        for symbol, index, columns in frames:
+            line = {'symbol': symbol, 'data': format_bars(index, columns, as_json=as_json)}
+            yield json.dumps(line, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
+    except Exception as e:
+        yield json.dumps({'error': str(e)}, ensure_ascii=False).encode('utf-8') + b'\n'
+
+
+def stream_arrow(frames):
+    """(股票, index, columns) 序列编码为Arrow IPC流，每只股票一个record batch
+
+    schema取第一只有数据的股票，之后的batch强制转换为其类型（如整数列遇到浮点值会截断）；
+    symbol为普通字符串列（流格式不便替换字典）。
+    中途出错时不写流结束标记，客户端会读到不完整的流。
+    """
+    pa = _import_pyarrow()
+    buf = io.BytesIO()
+    writer = schema = None
+    for symbol, index, columns in frames:
+        if not len(index) or not columns:
+            continue
+        batch_columns = {SYMBOL_FIELD: np.full(len(index), symbol), INDEX_FIELD: np.asarray(index).astype(str)}
+        batch_columns.update(columns)
+        batch = pa.RecordBatch.from_pydict(_arrow_arrays(pa, batch_columns, dictionary=False))
+        if writer is None:
+            schema = batch.schema
+            writer = pa.ipc.new_stream(buf, schema)
+        elif batch.schema != schema:
+            batch = pa.Table.from_batches([batch]).select(schema.names).cast(schema, safe=False).to_batches()[0]
+        writer.write_batch(batch)
+        yield _take(buf)
+    if writer is None:
+        writer = pa.ipc.new_stream(buf, pa.schema([(SYMBOL_FIELD, pa.string()), (INDEX_FIELD, pa.string())]))
+    writer.close()
+    yield _take(buf)
+
+
+def _take(buf):
+    data = buf.getvalue()
+    buf.seek(0)
+    buf.truncate()
+    return data
+
+
+def sse_message(kind, data, event_id=None):
+    """编码一条Server-Sent Events消息，data为JSON"""
+    head = f"id: {event_id}\n" if event_id is not None else ''
+    return f"{head}event: {kind}\ndata: {json.dumps(data, ensure_ascii=False, separators=(',', ':'))}\n\n"
@@ -1,7 +1,19 @@
-from flask import Blueprint, jsonify, request
+import itertools
+import time
+
+from flask import Blueprint, Response, jsonify, request
 import qmt_data
+import data_codec
 from logger_config import get_logger
 from authentication import login_or_signature_required
+from config import get_config
+from quote_service import get_quote_service, TICK_FIELD_NAMES
+from instrument_cache import get_instrument_cache
+from bar_cache import get_bar_cache
+from download_manager import get_download_manager
+import symbol_util
+
+MAX_TICK_STREAM_INTERVAL = 60.0  # 行情推送最小推送间隔的上限（秒）
 
 
 def handle_exceptions(f):
@@ -36,7 +48,14 @@ def get_market_data_ex():
         dividend_type: 复权方式，默认 front
         fill_data: 是否补全数据，默认 true
         json: 设为1返回JSON对象数组格式，默认0返回DataFrame友好格式
+        format: json/arrow/npz/msgpack/ndjson，不传时按Accept头选择，默认json；二进制格式为按列长表，不含timeFmt
+        stream: 设为1时按批读取、逐只股票流式返回，格式为ndjson（默认，每行一只股票）或arrow（每只一个record batch）
     """
+    try:
+        fmt = data_codec.negotiate(request)
+    except data_codec.UnsupportedFormatError as e:
+        return jsonify({'error': str(e)}), 406
+
     stock_list = request.args.get('stock_list', '')
     if not stock_list:
         return jsonify({'error': '缺少必要参数: stock_list'}), 400
@@ -53,6 +72,22 @@ def get_market_data_ex():
     fill_data = request.args.get('fill_data', 'true').lower() == 'true'
     as_json = request.args.get('json', '0') == '1'
 
+    if request.args.get('stream', '0') == '1' or fmt == data_codec.FORMAT_NDJSON:
+        if fmt == data_codec.FORMAT_JSON:
+            fmt = data_codec.FORMAT_NDJSON
+        if fmt not in data_codec.STREAM_FORMATS:
+            return jsonify({'error': f"流式返回仅支持 {', '.join(data_codec.STREAM_FORMATS)}"}), 406
+        frames = _log_stream_errors(qmt_data.iter_bars(stock_list, field_list, period, start_time, end_time, count,
+                                                       dividend_type, fill_data))
+        if fmt == data_codec.FORMAT_NDJSON:
+            return _stream_response(data_codec.stream_ndjson(frames, as_json=as_json), fmt)
+        return _stream_response(data_codec.stream_arrow(frames), fmt)
+
+    if fmt != data_codec.FORMAT_JSON:
+        bars = qmt_data.get_bars(stock_list, field_list, period, start_time, end_time, count, dividend_type,
+                                 fill_data)
+        return _binary_response(data_codec.bars_to_columns(bars), fmt)
+
     result = qmt_data.get_market_data_ex(
         stock_list=stock_list,
         field_list=field_list,
@@ -76,7 +111,13 @@ def get_full_tick():
 
     参数（query string）:
         stock_list: 股票代码，多个用逗号分隔，如 510300,515050
+        format: json/arrow/npz/msgpack，不传时按Accept头选择，默认json
     """
+    try:
+        fmt = data_codec.negotiate(request)
+    except data_codec.UnsupportedFormatError as e:
+        return jsonify({'error': str(e)}), 406
+
     stock_list = request.args.get('stock_list', '')
     if not stock_list:
         return jsonify({'error': '缺少必要参数: stock_list'}), 400
@@ -84,6 +125,204 @@ def get_full_tick():
 
     result = qmt_data.get_full_tick(stock_list=stock_list)
 
+    if fmt != data_codec.FORMAT_JSON:
+        return _binary_response(data_codec.records_to_columns(result), fmt)
+    return jsonify({'status': 'success', 'data': result})
+
+
+def _binary_response(columns, fmt):
+    """长表编码为二进制响应，服务端缺少编码依赖时返回406"""
+    if fmt not in data_codec.ENCODERS:
+        return jsonify({'error': f'该接口不支持{fmt}格式'}), 406
+    try:
+        body, mimetype = data_codec.encode(columns, fmt)
+    except data_codec.UnsupportedFormatError as e:
+        return jsonify({'error': str(e)}), 406
+    return Response(body, mimetype=mimetype)
+
+
+def _stream_response(chunks, fmt):
+    """分块响应；先取第一块，参数错误、缺少编码依赖等在发送响应头前就能以JSON返回"""
+    try:
+        first = next(chunks, b'')
+    except data_codec.UnsupportedFormatError as e:
+        return jsonify({'error': str(e)}), 406
+    return Response(itertools.chain([first], chunks), mimetype=data_codec.MIMETYPES[fmt])
+
+
+def _log_stream_errors(frames):
+    """流式响应已开始后的异常无法再经handle_exceptions返回，在这里记录"""
+    try:
+        yield from frames
+    except Exception as e:
+        log.error(f"流式行情中断: {e}", exc_info=True)
+        raise
+
+
+@data_bp.route('/instruments', methods=['GET'])
+@login_or_signature_required
+@handle_exceptions
+def get_instruments():
+    """批量获取合约信息（名称、昨收、涨跌停价、最小变动价位、板块等）
+
+    参数（query string）:
+        stock_list: 股票代码，多个用逗号分隔（可选，默认返回全部已加载合约）
+        fields: 返回字段，多个用逗号分隔，如 InstrumentName,PreClose,UpStopPrice,DownStopPrice,PriceTick,Board（可选）
+        board: 板块筛选：主板/创业板/科创板/北交所/ETF/债券（可选）
+    """
+    stock_list = request.args.get('stock_list', '')
+    stock_list = [s.strip() for s in stock_list.split(',') if s.strip()]
+    fields = request.args.get('fields', '')
+    fields = [f.strip() for f in fields.split(',') if f.strip()]
+    board = request.args.get('board') or None
+
+    result = qmt_data.get_instruments(stock_list=stock_list, field_list=fields, board=board)
+
     return jsonify({'status': 'success', 'data': result})
 
 
+@data_bp.route('/download', methods=['POST'])
+@login_or_signature_required
+@handle_exceptions
+def submit_download():
+    """提交后台历史数据下载任务，立即返回任务编号
+
+    参数（JSON或query string）:
+        stock_list: 股票代码，多个用逗号分隔或数组
+        period: K线周期，默认 1d
+        start_time: 起始时间，格式 YYYYMMDD（可选）
+        end_time: 结束时间，格式 YYYYMMDD（可选）
+    """
+    data = request.get_json(silent=True) or request.args
+    stock_list = data.get('stock_list', '')
+    if isinstance(stock_list, str):
+        stock_list = stock_list.split(',')
+    stock_list = [symbol_util.get_stock_id_xt(s.strip()) for s in stock_list if s.strip()]
+    if not stock_list:
+        return jsonify({'error': '缺少必要参数: stock_list'}), 400
+
+    job = get_download_manager().submit(stock_list, data.get('period', '1d'),
+                                        data.get('start_time', ''), data.get('end_time', ''))
+    return jsonify({'status': 'success', 'data': job.to_dict()})
+
+
+@data_bp.route('/download/<int:job_id>', methods=['GET'])
+@login_or_signature_required
+@handle_exceptions
+def get_download(job_id):
+    """查询下载任务进度
+
+    参数（query string）:
+        wait: 长轮询等待秒数（最多60），进度变化或任务结束时立即返回，默认0
+        version: 上次返回的version，长轮询时只在其之后的变化返回
+    """
+    job = get_download_manager().get(job_id)
+    if job is None:
+        return jsonify({'error': f'下载任务不存在: {job_id}'}), 404
+    wait = min(float(request.args.get('wait', 0)), 60.0)
+    if wait > 0:
+        return jsonify({'status': 'success', 'data': job.wait_change(int(request.args.get('version', -1)), wait)})
+    return jsonify({'status': 'success', 'data': job.to_dict()})
+
+
+@data_bp.route('/stream/ticks', methods=['GET'])
+@login_or_signature_required
+@handle_exceptions
+def stream_ticks():
+    """行情推送（Server-Sent Events），替代循环调用get_full_tick
+
+    参数（query string）:
+        stock_list: 股票代码，多个用逗号分隔
+        fields: 推送的字段，多个用逗号分隔，字段名同get_full_tick，默认全部
+        interval: 最小推送间隔（秒），须大于0，超过60按60处理；不传时有变化即推送。间隔内同一标的的多次变化只推送最新一次
+
+    事件:
+        snapshot: 连接时各标的的当前行情 {股票代码: tick}
+        tick: 有变化的标的的最新行情 {股票代码: tick}，消费慢时合并为最新值
+    """
+    quotes = get_quote_service()
+    if quotes is None:
+        return jsonify({'error': '行情推送需要启用内存行情表（QUOTE_SERVICE_ENABLED=true）'}), 503
+
+    stock_list = request.args.get('stock_list', '')
+    stock_list = list(dict.fromkeys(symbol_util.get_stock_id_xt(s.strip()) for s in stock_list.split(',') if s.strip()))
+    if not stock_list:
+        return jsonify({'error': '缺少必要参数: stock_list'}), 400
+    data_config = get_config().data
+    if len(stock_list) > data_config.tick_stream_max_symbols:
+        return jsonify({'error': f'单个连接最多订阅{data_config.tick_stream_max_symbols}只标的'}), 400
+    fields = [f.strip() for f in request.args.get('fields', '').split(',') if f.strip()]
+    unknown = [f for f in fields if f not in TICK_FIELD_NAMES]
+    if unknown:
+        return jsonify({'error': f"未知字段: {','.join(unknown)}"}), 400
+    interval = 0.0
+    if request.args.get('interval'):
+        try:
+            interval = float(request.args['interval'])
+        except ValueError:
+            interval = float('nan')
+        if not interval > 0:  # 同时排除NaN
+            return jsonify({'error': f"interval 必须是大于0的秒数: {request.args['interval']}"}), 400
+        interval = min(interval, MAX_TICK_STREAM_INTERVAL)
+
+    subscriber = quotes.open_stream(stock_list, fields)
+    try:
+        snapshot = quotes.get_ticks(stock_list, fields=subscriber.fields)
+    except Exception:
+        quotes.close_stream(subscriber)
+        raise
+    heartbeat = data_config.tick_stream_heartbeat
+    log.info(f"行情推送连接建立: {len(stock_list)}只标的")
+
+    def generate():
+        try:
+            yield data_codec.sse_message('snapshot', snapshot)
+            while True:
+                symbols = subscriber.wait(heartbeat)
+                if not symbols:
+                    yield ': keepalive\n\n'
+                    continue
+                yield data_codec.sse_message('tick', quotes.read_ticks(sorted(symbols), subscriber.fields))
+                if interval > 0:
+                    time.sleep(interval)
+        finally:
+            quotes.close_stream(subscriber)
+            log.info(f"行情推送连接关闭: {len(stock_list)}只标的，合并{subscriber.conflated}次")
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@data_bp.route('/stats/quote', methods=['GET'])
+@login_or_signature_required
+@handle_exceptions
+def quote_stats():
+    """内存行情表的标的数、订阅数、命中/拉取/推送计数和推送连接数"""
+    quotes = get_quote_service()
+    if quotes is None:
+        return jsonify({'status': 'success', 'data': {'enabled': False}})
+    return jsonify({'status': 'success', 'data': dict(quotes.stats(), enabled=True)})
+
+
+@data_bp.route('/stats/instruments', methods=['GET'])
+@login_or_signature_required
+@handle_exceptions
+def instrument_stats():
+    """合约信息缓存的合约数、加载耗时和冷/热查询平均耗时"""
+    return jsonify({'status': 'success', 'data': get_instrument_cache().stats()})
+
+
+@data_bp.route('/stats/bars', methods=['GET'])
+@login_or_signature_required
+@handle_exceptions
+def bar_cache_stats():
+    """历史K线缓存的条目数、内存占用、命中率和淘汰次数"""
+    return jsonify({'status': 'success', 'data': get_bar_cache().stats()})
+
+
+@data_bp.route('/stats/download', methods=['GET'])
+@login_or_signature_required
+@handle_exceptions
+def download_stats():
+    """历史数据下载任务数、在途股票数和去重次数"""
+    return jsonify({'status': 'success', 'data': get_download_manager().stats()})
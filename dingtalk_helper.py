@@ -4,9 +4,14 @@ import time
 import hmac
 import hashlib
 import base64
+import http.client
+import threading
 import urllib.parse
 import urllib.request
 import json
+from collections import deque
+
+DINGTALK_HOST = "oapi.dingtalk.com"
 
 
 class DingTalkBot:
@@ -19,23 +24,37 @@ class DingTalkBot:
         self.status_code = -1
         self.errcode = 0
         self.errmsg = ""
+        # 复用的HTTPS长连接，避免每条消息重新握手
+        self._conn = None
+        self._conn_lock = threading.Lock()
         self.send_text("钉钉机器人初始化完成", at_all=False)
 
     def _post(self, url, template):
         data = json.dumps(template).encode('utf-8')
         headers = {'Content-Type': 'application/json'}
-        req = urllib.request.Request(url, data=data, headers=headers)
-        try:
-            with urllib.request.urlopen(req) as response:
-                rsp = response.read()
-                self.status_code = response.getcode()
-                return json.loads(rsp)
-        except urllib.error.HTTPError as e:
-            self.status_code = e.code
-            return {"errcode": e.code, "errmsg": e.reason}
-        except urllib.error.URLError as e:
-            self.status_code = -1
-            return {"errcode": -1, "errmsg": str(e.reason)}
+        parsed = urllib.parse.urlsplit(url)
+        path = f"{parsed.path}?{parsed.query}"
+        with self._conn_lock:
+            # 长连接可能已被服务端关闭，失败时重建连接再试一次
+            for attempt in range(2):
+                if self._conn is None:
+                    self._conn = http.client.HTTPSConnection(parsed.netloc, timeout=10)
+                try:
+                    self._conn.request("POST", path, body=data, headers=headers)
+                    response = self._conn.getresponse()
+                    rsp = response.read()
+                    self.status_code = response.status
+                    if response.status != 200:
+                        return {"errcode": response.status, "errmsg": response.reason}
+                    return json.loads(rsp)
+                except (http.client.HTTPException, OSError) as e:
+                    self._conn.close()
+                    self._conn = None
+                    if attempt == 1:
+                        self.status_code = -1
+                        return {"errcode": -1, "errmsg": str(e)}
+                except ValueError:
+                    return {"errcode": -1, "errmsg": "解析json失败"}
 
     def gen_post_url(self):
         timestamp = str(round(time.time() * 1000))
@@ -44,7 +63,7 @@ class DingTalkBot:
         string_to_sign_enc = string_to_sign.encode('utf-8')
         hmac_code = hmac.new(secret_enc, string_to_sign_enc, digestmod=hashlib.sha256).digest()
         sign = urllib.parse.quote_plus(base64.b64encode(hmac_code))
-        post_url = f"https://oapi.dingtalk.com/robot/send?access_token={self.access_token}&timestamp={timestamp}&sign={sign}"
+        post_url = f"https://{DINGTALK_HOST}/robot/send?access_token={self.access_token}&timestamp={timestamp}&sign={sign}"
         return post_url
 
     def send_pic(self, pic_url, addition_msg: str = "", at_all: bool = False):
@@ -74,7 +93,7 @@ class DingTalkBot:
                 "isAtAll": at_all
             }
         }
-        self.send(template)
+        return self.send(template)
 
     def send_text(self, msg: str, at_all: bool = False):
         if isinstance(msg, dict):
@@ -89,7 +108,7 @@ class DingTalkBot:
             },
             "msgtype": "text"
         }
-        self.send(template)
+        return self.send(template)
 
     def send(self, template):
         post_url = self.gen_post_url()
@@ -100,6 +119,7 @@ class DingTalkBot:
         except KeyError:
             self.errcode = -1
             self.errmsg = "解析json失败"
+        return self.errcode
 
     @property
     def send_success(self):
@@ -108,6 +128,204 @@ class DingTalkBot:
         return False
 
 
+# 通知优先级，数值越小越先发送
+PRIORITY_ERROR = 0  # 错误、连接断开告警
+PRIORITY_FILL = 1  # 委托/成交回报
+PRIORITY_INFO = 2  # 一般信息
+
+PRIORITY_TITLES = {
+    PRIORITY_ERROR: "告警",
+    PRIORITY_FILL: "交易",
+    PRIORITY_INFO: "信息",
+}
+
+# 钉钉限流错误码：发送速度太快
+RATE_LIMIT_ERRCODES = {130101, 660026}
+
+
+class TokenBucket:
+    """令牌桶：共capacity个令牌，取走的令牌在period秒后归还
+
+    令牌按取走时间逐个归还而不是匀速补充，任意period秒内取走的令牌不超过capacity，与钉钉“每分钟20条”的限额一致。
+    """
+
+    def __init__(self, capacity, period=60.0):
+        self.capacity = capacity
+        self.period = period
+        self._taken = deque()
+
+    def _expire(self):
+        now = time.monotonic()
+        while self._taken and now - self._taken[0] >= self.period:
+            self._taken.popleft()
+        return now
+
+    @property
+    def tokens(self):
+        self._expire()
+        return self.capacity - len(self._taken)
+
+    def wait_time(self):
+        """距离下一个令牌可用的秒数，0表示现在可用"""
+        now = self._expire()
+        if len(self._taken) < self.capacity:
+            return 0.0
+        return self._taken[0] + self.period - now
+
+    def take(self):
+        self._expire()
+        self._taken.append(time.monotonic())
+
+    def drain(self):
+        """服务端已限流时把剩余令牌全部标记为刚取走"""
+        self._expire()
+        now = time.monotonic()
+        while len(self._taken) < self.capacity:
+            self._taken.append(now)
+
+
+class DingTalkNotifier:
+    """后台钉钉通知
+
+    消息按优先级放入有界队列后立即返回，由工作线程发送。发送受令牌桶限制（默认每分钟20条，与钉钉机器人限额一致），
+    等待令牌期间到达的消息合并为一条按优先级分组的markdown汇总，错误告警排在最前。
+    队列已满时优先丢弃最旧的低优先级消息，丢弃数量附在下一条汇总中；被限流或网络失败的汇总放回队首重试。
+    """
+
+    def __init__(self, bot, maxsize=256, window=2.0, rate_limit=20, max_merge=50, max_retries=3):
+        """
+        :param bot: DingTalkBot
+        :param maxsize: 队列长度（所有优先级合计）
+        :param window: 合并窗口（秒），从窗口内第一条消息开始计时
+        :param rate_limit: 每分钟最多发送的条数
+        :param max_merge: 单条汇总最多合并的消息数
+        :param max_retries: 限流或网络失败时单条汇总的最多重试次数
+        """
+        self.bot = bot
+        self.maxsize = maxsize
+        self.window = window
+        self.max_merge = max_merge
+        self.max_retries = max_retries
+        self.bucket = TokenBucket(rate_limit)
+        self._queues = {priority: deque() for priority in PRIORITY_TITLES}
+        self._cond = threading.Condition()
+        self._dropped_pending = 0
+        self.sent = 0
+        self.merged = 0
+        self.dropped = 0
+        self.retried = 0
+        self.failed = 0
+        self._worker = threading.Thread(target=self._run, name="dingtalk-notifier", daemon=True)
+        self._worker.start()
+
+    def _size(self):
+        return sum(len(q) for q in self._queues.values())
+
+    def notify(self, msg, priority=PRIORITY_INFO):
+        """提交一条消息，不等待发送；队列已满且没有更低优先级的消息可丢弃时返回False"""
+        if isinstance(msg, dict):
+            msg = json.dumps(msg, ensure_ascii=False, indent=2)
+        with self._cond:
+            if self._size() >= self.maxsize:
+                # 丢弃最旧的、优先级不高于新消息的消息
+                victim = next((p for p in sorted(self._queues, reverse=True)
+                               if p >= priority and self._queues[p]), None)
+                self.dropped += 1
+                self._dropped_pending += 1
+                if victim is None:
+                    return False
+                self._queues[victim].popleft()
+            self._queues[priority].append((time.time(), priority, str(msg), 0))
+            self._cond.notify()
+        return True
+
+    def _take_batch(self):
+        """按优先级取出最多max_merge条消息"""
+        batch = []
+        for priority in sorted(self._queues):
+            q = self._queues[priority]
+            while q and len(batch) < self.max_merge:
+                batch.append(q.popleft())
+        return batch
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._size():
+                    self._cond.wait()
+            # 合并窗口，之后等待令牌，期间到达的消息一并汇总
+            time.sleep(self.window)
+            wait = self.bucket.wait_time()
+            while wait > 0:
+                time.sleep(wait)
+                wait = self.bucket.wait_time()
+            with self._cond:
+                batch = self._take_batch()
+                dropped, self._dropped_pending = self._dropped_pending, 0
+            if not batch:
+                continue
+            self.bucket.take()
+            try:
+                if len(batch) == 1 and not dropped:
+                    errcode = self.bot.send_text(batch[0][2], at_all=False)
+                else:
+                    title, text = self._digest(batch, dropped)
+                    errcode = self.bot.send_markdown(title, text)
+            except Exception as e:
+                errcode, self.bot.errmsg = -1, str(e)
+            if errcode == 0:
+                self.sent += 1
+                if len(batch) > 1:
+                    self.merged += len(batch)
+            elif errcode in RATE_LIMIT_ERRCODES or errcode == -1:
+                if errcode in RATE_LIMIT_ERRCODES:
+                    self.bucket.drain()
+                self._requeue(batch, dropped)
+            else:
+                self.failed += len(batch)
+
+    def _requeue(self, batch, dropped):
+        """把发送失败的消息放回各自队列的队首，超过重试次数的丢弃"""
+        with self._cond:
+            self._dropped_pending += dropped
+            for ts, priority, msg, retries in reversed(batch):
+                if retries >= self.max_retries:
+                    self.failed += 1
+                    continue
+                self._queues[priority].appendleft((ts, priority, msg, retries + 1))
+                self.retried += 1
+
+    @staticmethod
+    def _digest(batch, dropped):
+        title = f"通知汇总({len(batch)}条)"
+        lines = [f"#### {title}"]
+        current = None
+        for ts, priority, msg, _ in batch:
+            if priority != current:
+                current = priority
+                lines.append(f"##### {PRIORITY_TITLES[priority]}")
+            body = msg.replace("\n", "\n> ")
+            lines.append(f"- **{time.strftime('%H:%M:%S', time.localtime(ts))}**\n> {body}")
+        if dropped:
+            lines.append(f"\n另有{dropped}条消息因通知队列已满被丢弃")
+        return title, "\n\n".join(lines)
+
+    def stats(self):
+        with self._cond:
+            pending = {PRIORITY_TITLES[p]: len(q) for p, q in self._queues.items()}
+        return {
+            'pending': pending,
+            'tokens': self.bucket.tokens,
+            'sent': self.sent,
+            'merged': self.merged,
+            'dropped': self.dropped,
+            'retried': self.retried,
+            'failed': self.failed,
+            'last_errcode': self.bot.errcode,
+            'last_errmsg': self.bot.errmsg,
+        }
+
+
 if __name__ == '__main__':
     import config
 
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+历史数据下载管理
+
+缺失的K线用xtdata.download_history_data2一次批量下载，进度回调更新任务的完成数。
+同一周期、区间已覆盖的股票正在下载时，新请求直接等待该任务，不重复下载。
+请求线程按实际完成等待（有超时上限），长时间的下载可作为后台任务提交，通过任务编号轮询进度。
+"""
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from xtquant import xtdata
+
+from logger_config import get_logger
+from config import get_config
+
+log = get_logger(__name__)
+
+MAX_FINISHED_JOBS = 200  # 保留的已结束任务数，供轮询查询
+
+STATUS_PENDING = 'pending'
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+
+class DownloadJob:
+    """一次批量下载任务"""
+
+    def __init__(self, job_id, symbols, period, start_time, end_time, depends=()):
+        self.job_id = job_id
+        self.symbols = list(symbols)
+        self.period = period
+        self.start_time = start_time
+        self.end_time = end_time
+        self.depends = list(depends)  # 覆盖部分股票的在途任务，完成前本任务不算完成
+        self.status = STATUS_PENDING
+        self.finished = 0
+        self.total = len(self.symbols)
+        self.message = ''
+        self.error = ''
+        self.created_ts = time.time()
+        self.started_ts = None
+        self.finished_ts = None
+        self._cond = threading.Condition()
+        self._version = 0  # 每次进度变化加1，用于长轮询
+
+    @property
+    def done(self):
+        return self.status in (STATUS_DONE, STATUS_FAILED)
+
+    def _update(self, **fields):
+        with self._cond:
+            for name, value in fields.items():
+                setattr(self, name, value)
+            self._version += 1
+            self._cond.notify_all()
+
+    def on_progress(self, data):
+        """download_history_data2的进度回调：{'finished': n, 'total': m, 'stockcode': ..., 'message': ...}"""
+        self._update(finished=data.get('finished', self.finished), total=data.get('total', self.total),
+                     message=data.get('message', '') or data.get('stockcode', ''))
+
+    def wait(self, timeout=None):
+        """等待本任务和依赖任务全部结束，返回是否在超时前结束"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for job in self.depends + [self]:
+            with job._cond:
+                while not job.done:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    job._cond.wait(remaining)
+        return True
+
+    def wait_change(self, version, timeout):
+        """长轮询：等待进度版本号超过version或任务结束，返回当前状态；依赖其他任务时等待其结束"""
+        if self.depends and self.done:
+            self.wait(timeout)
+        else:
+            with self._cond:
+                self._cond.wait_for(lambda: self._version > version or self.done, timeout)
+        return self.to_dict()
+
+    def to_dict(self):
+        status = self.status
+        if self.done and not all(job.done for job in self.depends):
+            status = STATUS_RUNNING
+        with self._cond:
+            return {
+                'job_id': self.job_id,
+                'status': status,
+                'period': self.period,
+                'start_time': self.start_time,
+                'end_time': self.end_time,
+                'symbols': len(self.symbols),
+                'finished': self.finished,
+                'total': self.total,
+                'message': self.message,
+                'error': self.error,
+                'depends': [job.job_id for job in self.depends],
+                'version': self._version,
+                'elapsed': round((self.finished_ts or time.time()) - (self.started_ts or self.created_ts), 3),
+            }
+
+
+class DownloadManager:
+    """批量下载的调度与去重"""
+
+    def __init__(self, max_workers=1):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="history-download")
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._jobs = OrderedDict()  # job_id -> DownloadJob
+        self._inflight = {}  # (股票代码, 周期) -> 正在下载的DownloadJob
+        self._deduped = 0
+
+    def submit(self, symbols, period, start_time='', end_time=''):
+        """提交下载任务并立即返回；已在下载且区间覆盖本次请求的股票不重复下载"""
+        with self._lock:
+            own, depends = [], {}
+            for symbol in dict.fromkeys(symbols):
+                job = self._inflight.get((symbol, period))
+                if job is not None and job.start_time <= start_time and (
+                        not job.end_time or (end_time and job.end_time >= end_time)):
+                    depends[job.job_id] = job
+                    self._deduped += 1
+                else:
+                    own.append(symbol)
+            job = DownloadJob(next(self._ids), own, period, start_time, end_time, depends.values())
+            self._jobs[job.job_id] = job
+            for symbol in own:
+                self._inflight[(symbol, period)] = job
+            self._trim()
+        if own:
+            self._executor.submit(self._run, job)
+        else:
+            job._update(status=STATUS_DONE, finished_ts=time.time())
+        return job
+
+    def download(self, symbols, period, start_time='', end_time='', timeout=None):
+        """提交并等待完成，返回任务；超时后任务继续在后台执行"""
+        job = self.submit(symbols, period, start_time, end_time)
+        if not job.wait(timeout):
+            log.warning(f"下载任务{job.job_id}在{timeout}秒内未完成，转入后台继续")
+        return job
+
+    def _run(self, job):
+        job._update(status=STATUS_RUNNING, started_ts=time.time())
+        try:
+            if hasattr(xtdata, 'download_history_data2'):
+                xtdata.download_history_data2(job.symbols, job.period, job.start_time, job.end_time,
+                                              callback=job.on_progress)
+            else:
+                for i, symbol in enumerate(job.symbols, 1):
+                    xtdata.download_history_data(symbol, job.period, job.start_time, job.end_time)
+                    job.on_progress({'finished': i, 'total': job.total, 'stockcode': symbol})
+            job._update(status=STATUS_DONE, finished=job.total, finished_ts=time.time())
+            log.info(f"下载任务{job.job_id}完成: {job.total}只 {job.period} {job.start_time}-{job.end_time}，"
+                     f"耗时{job.finished_ts - job.started_ts:.1f}秒")
+        except Exception as e:
+            job._update(status=STATUS_FAILED, error=str(e), finished_ts=time.time())
+            log.error(f"下载任务{job.job_id}失败: {e}")
+        finally:
+            with self._lock:
+                for symbol in job.symbols:
+                    if self._inflight.get((symbol, job.period)) is job:
+                        del self._inflight[(symbol, job.period)]
+
+    def _trim(self):
+        """只保留最近的已结束任务，调用方需持有锁"""
+        finished = [job_id for job_id, job in self._jobs.items() if job.done]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+            inflight = len(self._inflight)
+        return {
+            'jobs': len(jobs),
+            'running': sum(job.status == STATUS_RUNNING for job in jobs),
+            'pending': sum(job.status == STATUS_PENDING for job in jobs),
+            'inflight_symbols': inflight,
+            'deduped': self._deduped,
+        }
+
+
+_download_manager = None
+_download_manager_lock = threading.Lock()
+
+
+def get_download_manager():
+    global _download_manager
+    with _download_manager_lock:
+        if _download_manager is None:
+            _download_manager = DownloadManager(get_config().data.download_workers)
+        return _download_manager
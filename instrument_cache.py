@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+合约基础信息缓存
+
+名称、昨收、涨跌停价、最小变动价位、板块等字段日内不变。每个交易日开盘前按板块把A股/ETF/债券
+全市场的get_instrument_detail批量加载到内存字典，按代码O(1)查询；未收录的代码在一次查询中批量回源并缓存，
+查不到的代码也记录下来，到下次刷新前不再回源。板块单独保存，get返回的合约信息与xtdata一致，
+批量接口get_many才附加Board字段。
+"""
+import threading
+import time
+from datetime import datetime
+
+from xtquant import xtdata
+
+from logger_config import get_logger
+from config import get_config
+
+log = get_logger(__name__)
+
+BOARD_FIELD = 'Board'  # 由代码和所属板块推导的板块名称，get_many结果中附加
+
+
+def get_board(code, sector=''):
+    """按所属板块和代码前缀推导板块：主板/创业板/科创板/北交所/ETF/债券"""
+    symbol, _, market = code.partition('.')
+    if 'ETF' in sector or (not sector and (symbol.startswith(('51', '56', '58')) and market == 'SH'
+                                           or symbol.startswith('159') and market == 'SZ')):
+        return 'ETF'
+    if '债' in sector or (not sector and (symbol.startswith('11') and market == 'SH'
+                                          or symbol.startswith('12') and market == 'SZ')):
+        return '债券'
+    if market == 'BJ':
+        return '北交所'
+    if symbol.startswith(('688', '689')):
+        return '科创板'
+    if symbol.startswith(('300', '301')):
+        return '创业板'
+    return '主板'
+
+
+class InstrumentCache:
+    """按交易日整体替换的合约信息字典"""
+
+    def __init__(self, sectors, refresh_time='09:00'):
+        """
+        :param sectors: 需要加载的板块名称，如 ['沪深A股', '沪深ETF', '沪深债券']
+        :param refresh_time: 每个交易日刷新的时间点（HH:MM），应早于开盘
+        """
+        self.sectors = list(sectors)
+        self.refresh_time = refresh_time
+        self._details = {}
+        self._boards = {}  # 代码 -> 板块
+        self._misses = set()  # 回源也查不到的代码，每次刷新时清空
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self.loaded_date = ''
+        self.load_ms = 0.0
+        # 命中缓存（热）和回源xtdata（冷）的查询次数及累计耗时
+        self._warm = [0, 0.0]
+        self._cold = [0, 0.0]
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def __len__(self):
+        return len(self._details)
+
+    def load(self):
+        """加载全部板块的合约信息，完成后整体替换"""
+        with self._load_lock:
+            start_ts = time.perf_counter()
+            details, boards = {}, {}
+            for sector in self.sectors:
+                codes = xtdata.get_stock_list_in_sector(sector) or []
+                for code in codes:
+                    if code in details:
+                        continue
+                    try:
+                        detail = xtdata.get_instrument_detail(code)
+                    except Exception as e:
+                        log.warning(f"获取合约信息失败 {code}: {e}")
+                        continue
+                    if detail:
+                        details[code] = dict(detail)
+                        boards[code] = get_board(code, sector)
+            with self._lock:
+                self._details = details
+                self._boards = boards
+                self._misses = set()
+            self.loaded_date = datetime.now().strftime('%Y%m%d')
+            self.load_ms = (time.perf_counter() - start_ts) * 1000
+            log.info(f"合约信息加载完成: {len(details)}个合约，耗时{self.load_ms:.0f}ms")
+
+    def _due(self):
+        now = datetime.now()
+        if not self.loaded_date:
+            return True
+        return self.loaded_date != now.strftime('%Y%m%d') and now.strftime('%H:%M') >= self.refresh_time
+
+    def start(self, check_interval=60.0):
+        """后台加载，之后每个交易日到refresh_time时刷新"""
+        if self._thread is not None:
+            return
+
+        def _loop():
+            while not self._stopped.is_set():
+                if self._due():
+                    try:
+                        self.load()
+                    except Exception as e:
+                        log.error(f"合约信息加载失败: {e}")
+                self._stopped.wait(check_interval)
+
+        self._thread = threading.Thread(target=_loop, name="instrument-cache", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _fetch(self, codes):
+        """未收录的代码批量回源xtdata并写入缓存，查不到的记为miss；查询出错可能是暂时的，不记为miss"""
+        if hasattr(xtdata, 'get_instrument_detail_list'):
+            try:
+                fetched = xtdata.get_instrument_detail_list(codes) or {}
+            except Exception as e:
+                log.warning(f"批量获取合约信息失败 {len(codes)}只: {e}")
+                return
+            failed = set()
+        else:
+            fetched, failed = {}, set()
+            for code in codes:
+                try:
+                    fetched[code] = xtdata.get_instrument_detail(code)
+                except Exception as e:
+                    log.warning(f"获取合约信息失败 {code}: {e}")
+                    failed.add(code)
+        with self._lock:
+            for code in codes:
+                detail = fetched.get(code)
+                if detail:
+                    self._details[code] = dict(detail)
+                    self._boards[code] = get_board(code)
+                elif code not in failed:
+                    self._misses.add(code)
+
+    def _lookup(self, codes):
+        """返回 {代码: (合约信息, 板块)}，未收录的代码批量回源一次；查不到的代码不在结果中"""
+        start_ts = time.perf_counter()
+        with self._lock:
+            missing = [code for code in dict.fromkeys(codes) if code not in self._details and code not in self._misses]
+        if missing:
+            self._fetch(missing)
+        with self._lock:
+            result = {code: (self._details[code], self._boards.get(code)) for code in codes if code in self._details}
+            elapsed = time.perf_counter() - start_ts
+            counter = self._cold if missing else self._warm
+            counter[0] += len(codes)
+            counter[1] += elapsed
+        return result
+
+    def get(self, code):
+        """按代码查询合约信息（与xtdata.get_instrument_detail字段一致），未收录时回源xtdata并缓存；查不到或查询出错返回None"""
+        found = self._lookup([code]).get(code)
+        return dict(found[0]) if found else None
+
+    def get_many(self, codes, fields=None, board=None):
+        """批量查询 {代码: 合约信息}，附加Board字段；fields为需要返回的字段，None表示全部字段；查不到或不属于board的代码不在结果中"""
+        result = {}
+        for code, (detail, code_board) in self._lookup(codes).items():
+            if board is not None and code_board != board:
+                continue
+            detail = dict(detail, **{BOARD_FIELD: code_board})
+            result[code] = detail if fields is None else {f: detail.get(f) for f in fields}
+        return result
+
+    def codes(self, board=None):
+        with self._lock:
+            if board is None:
+                return list(self._details)
+            return [code for code, code_board in self._boards.items() if code_board == board]
+
+    def stats(self):
+        def _avg_us(counter):
+            return round(counter[1] / counter[0] * 1e6, 2) if counter[0] else None
+
+        with self._lock:
+            warm, cold = list(self._warm), list(self._cold)
+        return {
+            'instruments': len(self._details),
+            'misses': len(self._misses),
+            'loaded_date': self.loaded_date,
+            'load_ms': round(self.load_ms, 1),
+            'warm_lookups': warm[0],
+            'warm_avg_us': _avg_us(warm),
+            'cold_lookups': cold[0],
+            'cold_avg_us': _avg_us(cold),
+        }
+
+
+_instrument_cache = None
+_instrument_cache_lock = threading.Lock()
+
+
+def get_instrument_cache():
+    """返回全局合约信息缓存，首次调用时启动后台加载"""
+    global _instrument_cache
+    with _instrument_cache_lock:
+        if _instrument_cache is None:
+            data_config = get_config().data
+            sectors = [s.strip() for s in data_config.instrument_sectors.split(',') if s.strip()]
+            _instrument_cache = InstrumentCache(sectors, data_config.instrument_refresh_time)
+            _instrument_cache.start()
+        return _instrument_cache
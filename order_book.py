@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""
+账户委托簿
+
+按order_id保存当日委托，并按股票代码、买卖方向、委托状态、策略名称建立索引。
+委托/成交回调实时更新，后台对账时用柜台查询结果增量同步（只更新有变化的委托）。
+委托查询和撤单筛选直接在内存中完成，不再每次查询柜台。委托的每次实际变化通知给监听者（账户事件推送）。
+"""
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass, asdict, replace
+
+from xtquant import xtconstant
+
+from logger_config import get_logger
+from account_events import EVENT_ORDER
+
+log = get_logger(__name__)
+
+ORDER_STATUS_MAP = {
+    48: "未报",
+    49: "待报",
+    50: "已报",
+    51: "已报待撤",
+    52: "部成待撤",
+    53: "部撤",
+    54: "已撤",
+    55: "部成",
+    56: "已成",
+    57: "废单",
+    255: "未知",
+}
+
+# 可撤委托状态（未报/待报/已报/部成），与query_stock_orders(cancelable_only=True)一致
+CANCELABLE_STATUS = {48, 49, 50, 55}
+# 终态（部撤/已撤/已成/废单），收到终态后不再被较早的推送覆盖
+FINAL_STATUS = {53, 54, 56, 57}
+
+
+@dataclass
+class OrderRecord:
+    """委托记录，字段与query_orders返回的字典一致"""
+    order_id: int
+    symbol: str
+    side: str
+    status: int
+    volume: int
+    time: int
+    price: float
+    price_type: int
+    traded_volume: int
+    traded_price: float
+    strategy_name: str
+    updated_ts: float = 0.0  # 本地最后一次更新的时间
+
+    @classmethod
+    def from_xt(cls, order):
+        return cls(
+            order_id=order.order_id,
+            symbol=order.stock_code,
+            side='buy' if order.order_type == xtconstant.STOCK_BUY else 'sell',
+            status=order.order_status,
+            volume=order.order_volume,
+            time=order.order_time,
+            price=order.price,
+            price_type=order.price_type,
+            traded_volume=order.traded_volume,
+            traded_price=order.traded_price,
+            strategy_name=order.strategy_name,
+            updated_ts=time.time(),
+        )
+
+    def to_dict(self):
+        data = asdict(self)
+        data.pop('updated_ts')
+        data['m_status'] = ORDER_STATUS_MAP.get(self.status)
+        return data
+
+    def same_state(self, other):
+        return (self.status, self.traded_volume, self.traded_price) == \
+               (other.status, other.traded_volume, other.traded_price)
+
+
+class OrderBook:
+    """单个账户的当日委托簿"""
+
+    def __init__(self, account_id):
+        self.account_id = account_id
+        self._lock = threading.Lock()
+        self._orders = {}
+        self._index = {
+            'symbol': defaultdict(set),
+            'side': defaultdict(set),
+            'status': defaultdict(set),
+            'strategy_name': defaultdict(set),
+        }
+        self._trade_fills = {}  # order_id -> {traded_id: 成交量}，成交推送先于委托推送时用于补全成交量
+        self.synced_ts = 0.0  # 最近一次与柜台全量同步的时间
+        self._listeners = []
+
+    def __len__(self):
+        return len(self._orders)
+
+    def add_listener(self, listener):
+        """注册变化监听 listener(kind, data)，委托状态或成交变化时为(order, 委托字典)"""
+        self._listeners.append(listener)
+
+    def _notify(self, changed):
+        for data in changed:
+            for listener in self._listeners:
+                try:
+                    listener(EVENT_ORDER, data)
+                except Exception as e:
+                    log.error(f"{self.account_id} 委托变化通知失败: {e}")
+
+    # ---------- 索引维护 ----------
+
+    def _add_index(self, record):
+        for key, index in self._index.items():
+            index[getattr(record, key)].add(record.order_id)
+
+    def _remove_index(self, record):
+        for key, index in self._index.items():
+            bucket = index.get(getattr(record, key))
+            if bucket is not None:
+                bucket.discard(record.order_id)
+                if not bucket:
+                    del index[getattr(record, key)]
+
+    def _upsert(self, record, authoritative=False):
+        """写入一条委托，返回是否有变化；非权威推送不会把终态委托改回非终态"""
+        old = self._orders.get(record.order_id)
+        if old is not None:
+            if not authoritative and old.status in FINAL_STATUS and record.status not in FINAL_STATUS:
+                return False
+            if old.same_state(record):
+                return False
+            self._remove_index(old)
+        fills = self._trade_fills.get(record.order_id)
+        if fills:
+            record.traded_volume = max(record.traded_volume, min(sum(fills.values()), record.volume))
+        self._orders[record.order_id] = record
+        self._add_index(record)
+        return True
+
+    # ---------- 回调更新 ----------
+
+    def on_order(self, order):
+        """委托推送"""
+        record = OrderRecord.from_xt(order)
+        with self._lock:
+            changed = [record.to_dict()] if self._upsert(record) else []
+        self._notify(changed)
+
+    def on_trade(self, trade):
+        """成交推送：累计成交量，委托推送到达前也能反映部分成交"""
+        changed = []
+        with self._lock:
+            fills = self._trade_fills.setdefault(trade.order_id, {})
+            fills[getattr(trade, 'traded_id', len(fills))] = trade.traded_volume
+            record = self._orders.get(trade.order_id)
+            if record is None:
+                return
+            traded_volume = min(sum(fills.values()), record.volume)
+            if traded_volume > record.traded_volume:
+                self._remove_index(record)
+                record.traded_volume = traded_volume
+                record.traded_price = getattr(trade, 'traded_price', record.traded_price)
+                if record.status not in FINAL_STATUS:
+                    record.status = xtconstant.ORDER_SUCCEEDED if traded_volume >= record.volume \
+                        else xtconstant.ORDER_PART_SUCC
+                record.updated_ts = time.time()
+                self._add_index(record)
+                changed.append(record.to_dict())
+        self._notify(changed)
+
+    # ---------- 对账同步 ----------
+
+    def sync(self, orders):
+        """用柜台查询的当日全部委托增量同步，返回变化的委托数量
+
+        柜台结果为准：状态或成交有变化的委托才更新索引，柜台已不存在的委托（如跨交易日）被移除。
+        """
+        changed = 0
+        updated = []
+        with self._lock:
+            seen = set()
+            for order in orders:
+                record = OrderRecord.from_xt(order)
+                seen.add(record.order_id)
+                if self._upsert(record, authoritative=True):
+                    changed += 1
+                    updated.append(record.to_dict())
+            for order_id in [oid for oid in self._orders if oid not in seen]:
+                self._remove_index(self._orders.pop(order_id))
+                self._trade_fills.pop(order_id, None)
+                changed += 1
+            self.synced_ts = time.time()
+        self._notify(updated)
+        return changed
+
+    def is_fresh(self, max_age):
+        return bool(self.synced_ts) and time.time() - self.synced_ts <= max_age
+
+    # ---------- 查询 ----------
+
+    def get(self, order_id):
+        """返回委托记录的副本，修改不影响委托簿和索引"""
+        with self._lock:
+            record = self._orders.get(order_id)
+            return replace(record) if record is not None else None
+
+    def query(self, symbol=None, side=None, status=None, strategy_name=None, cancelable_only=False):
+        """按索引筛选委托，条件之间为与关系，按委托时间排序，返回记录副本
+
+        symbol/side/strategy_name: 单个值
+        status: 单个状态码或状态码集合（int）
+        cancelable_only: 只返回可撤委托
+        """
+        with self._lock:
+            candidates = []
+            for key, value in (('symbol', symbol), ('side', side), ('strategy_name', strategy_name)):
+                if value is not None:
+                    candidates.append(self._index[key].get(value, set()))
+            statuses = None
+            if status is not None:
+                statuses = {int(status)} if isinstance(status, (int, str)) else {int(s) for s in status}
+            if cancelable_only:
+                statuses = CANCELABLE_STATUS if statuses is None else statuses & CANCELABLE_STATUS
+            if statuses is not None:
+                candidates.append(set().union(*(self._index['status'].get(s, set()) for s in statuses)))
+
+            if candidates:
+                candidates.sort(key=len)
+                ids = set(candidates[0]).intersection(*candidates[1:])
+            else:
+                ids = self._orders.keys()
+            records = [replace(self._orders[oid]) for oid in ids]
+        return sorted(records, key=lambda r: (r.time, r.order_id))
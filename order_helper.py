@@ -3,9 +3,19 @@ import hmac
 import hashlib
 import time
 import json
+import io
+from urllib.parse import urlencode
 
 import requests
 
+# 行情接口的二进制格式，与服务端data_codec一致
+DATA_MIMETYPES = {
+    'arrow': 'application/vnd.apache.arrow.stream',
+    'npz': 'application/x-npz',
+    'msgpack': 'application/x-msgpack',
+    'ndjson': 'application/x-ndjson',
+}
+
 
 def generate_signature(method, path, query_string, body, timestamp, client_id, secret_key):
     """生成HMAC-SHA256签名"""
@@ -59,6 +69,35 @@ def get_stock_id_xt(stock_code):
     return code
 
 
+def decode_columns(content, fmt):
+    """把行情接口的二进制长表解码为pandas DataFrame
+
+    数值列不逐值转换：msgpack和npz的数值数组不复制直接作为DataFrame的列（msgpack的列引用响应缓冲区，只读），
+    Arrow按列拆分block转换、转换后释放Arrow缓冲，不合并成二维block；盘口等定长数组字段解码为每行一个列表。
+    """
+    import numpy as np
+    import pandas as pd
+
+    if fmt == 'arrow':
+        import pyarrow as pa
+        return pa.ipc.open_stream(content).read_all().to_pandas(split_blocks=True, self_destruct=True)
+    if fmt == 'npz':
+        with np.load(io.BytesIO(content)) as npz:
+            columns = {name: npz[name].astype(str) if npz[name].dtype.kind == 'S' else npz[name]
+                       for name in npz.files}
+    elif fmt == 'msgpack':
+        import msgpack
+        columns = {}
+        for name, col in msgpack.unpackb(content, raw=False)['columns'].items():
+            if isinstance(col, dict):
+                col = np.frombuffer(col['data'], dtype=col['dtype']).reshape(col['shape'])
+            columns[name] = col
+    else:
+        raise ValueError(f"不支持的格式: {fmt}")
+    columns = {name: list(col) if getattr(col, 'ndim', 1) == 2 else col for name, col in columns.items()}
+    return pd.DataFrame(columns, copy=False)
+
+
 class PrivateQMTOrderHelper:
     def __init__(self, base_url, client_id, secret_key, trader_index=0, strategy_name="策略1"):
         self.base_url = base_url
@@ -100,16 +139,113 @@ class PrivateQMTOrderHelper:
         return self._post(path, data)
 
     def _get(self, path, query_string=""):
+        return self._get_raw(path, query_string).json()
+
+    def _get_raw(self, path, query_string="", accept='application/json', stream=False):
         timestamp = str(int(time.time()))
         signature = generate_signature('GET', path, query_string, "", timestamp, self.client_id, self.secret_key)
         headers = {
             'Content-Type': 'application/json',
+            'Accept': accept,
             'X-Client-ID': self.client_id,
             'X-Timestamp': timestamp,
             'X-Signature': signature
         }
-        response = requests.get(f"{self.base_url}{path}?{query_string}", headers=headers)
-        return response.json()
+        return requests.get(f"{self.base_url}{path}?{query_string}", headers=headers, stream=stream)
+
+    def _get_data(self, path, params, fmt):
+        """请求行情接口，fmt为arrow/npz/msgpack时返回解码后的长表DataFrame，为json时返回data字段"""
+        if fmt == 'json':
+            return self._get(path, urlencode(params))['data']
+        response = self._get_raw(path, urlencode(params), accept=DATA_MIMETYPES[fmt])
+        if response.headers.get('Content-Type', '').startswith('application/json'):
+            raise RuntimeError(response.json().get('error', response.text))
+        return decode_columns(response.content, fmt)
+
+    def get_market_data_ex(self, stock_list, period='1d', start_time='', end_time='', count=-1,
+                           field_list=None, dividend_type='front', fill_data=True, fmt='arrow'):
+        """获取历史行情
+
+        fmt为二进制格式时返回 {股票代码: DataFrame}，DataFrame以K线索引为index；
+        fmt='json'时返回服务端原始的DataFrame友好格式。
+        """
+        params = {'stock_list': ','.join(stock_list), 'period': period, 'start_time': start_time,
+                  'end_time': end_time, 'count': count, 'dividend_type': dividend_type,
+                  'fill_data': 'true' if fill_data else 'false'}
+        if field_list:
+            params['field_list'] = ','.join(field_list)
+        df = self._get_data("/qmt/data/api/get_market_data_ex", params, fmt)
+        if fmt == 'json':
+            return df
+        return {symbol: frame.drop(columns='symbol').set_index('index')
+                for symbol, frame in df.groupby('symbol', sort=False, observed=True)}
+
+    def iter_market_data_ex(self, stock_list, period='1d', start_time='', end_time='', count=-1,
+                            field_list=None, dividend_type='front', fill_data=True, fmt='ndjson'):
+        """流式获取历史行情，逐只产出 (股票代码, DataFrame)，服务端按批读取，收到一只处理一只
+
+        fmt: ndjson 或 arrow（需要pyarrow）
+        """
+        import pandas as pd
+
+        params = {'stock_list': ','.join(stock_list), 'period': period, 'start_time': start_time,
+                  'end_time': end_time, 'count': count, 'dividend_type': dividend_type,
+                  'fill_data': 'true' if fill_data else 'false', 'stream': 1}
+        if field_list:
+            params['field_list'] = ','.join(field_list)
+        response = self._get_raw("/qmt/data/api/get_market_data_ex", urlencode(params),
+                                 accept=DATA_MIMETYPES[fmt], stream=True)
+        with response:
+            if not response.headers.get('Content-Type', '').startswith(DATA_MIMETYPES[fmt]):
+                raise RuntimeError(response.json().get('error', response.text))
+            if fmt == 'arrow':
+                import pyarrow as pa
+                response.raw.decode_content = True
+                for batch in pa.ipc.open_stream(response.raw):
+                    df = batch.to_pandas()
+                    yield df['symbol'].iat[0], df.drop(columns='symbol').set_index('index')
+                return
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                item = json.loads(line)
+                if 'error' in item:
+                    raise RuntimeError(item['error'])
+                data = item['data']
+                yield item['symbol'], pd.DataFrame(data['data'], columns=data['columns'], index=data['index'])
+
+    def stream_ticks(self, stock_list, fields=None, interval=0):
+        """订阅行情推送，逐条产出 (事件类型, {股票代码: tick})
+
+        事件类型为snapshot（连接时的当前行情）或tick（有变化的标的的最新行情）；
+        fields为推送字段列表（默认全部），interval为最小推送间隔（秒），0表示有变化即推送。
+        """
+        params = {'stock_list': ','.join(stock_list)}
+        if interval:
+            params['interval'] = interval
+        if fields:
+            params['fields'] = ','.join(fields)
+        response = self._get_raw("/qmt/data/api/stream/ticks", urlencode(params), accept='text/event-stream',
+                                 stream=True)
+        with response:
+            if not response.headers.get('Content-Type', '').startswith('text/event-stream'):
+                raise RuntimeError(response.json().get('error', response.text))
+            kind, data = None, []
+            for line in response.iter_lines(decode_unicode=True):
+                if line:
+                    if line.startswith('event:'):
+                        kind = line[6:].strip()
+                    elif line.startswith('data:'):
+                        data.append(line[5:].strip())
+                    continue
+                if data:
+                    yield kind, json.loads('\n'.join(data))
+                kind, data = None, []
+
+    def get_full_tick(self, stock_list, fmt='arrow'):
+        """获取实时行情快照，二进制格式时返回以股票代码为index的DataFrame"""
+        df = self._get_data("/qmt/data/api/get_full_tick", {'stock_list': ','.join(stock_list)}, fmt)
+        return df if fmt == 'json' else df.set_index('symbol')
 
     def get_accounts(self):
         """获取账户列表"""
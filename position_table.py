@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+列式持仓快照
+
+一次遍历把持仓字段取出为按列存放的定型NumPy数组，DataFrame/JSON/Arrow视图都基于同一组数组构建，
+可用/板块筛选是数组上的向量化掩码，不需要再次查询柜台。
+"""
+import numpy as np
+import pandas as pd
+
+# 字段顺序与XtPosition一致
+POSITION_FIELDS = (
+    ('account_type', np.int32),
+    ('account_id', object),
+    ('stock_code', object),
+    ('volume', np.int64),
+    ('can_use_volume', np.int64),
+    ('open_price', np.float64),
+    ('market_value', np.float64),
+    ('frozen_volume', np.int64),
+    ('on_road_volume', np.int64),
+    ('yesterday_volume', np.int64),
+    ('avg_price', np.float64),
+    ('direction', np.int32),
+)
+POSITION_COLUMNS = [name for name, _ in POSITION_FIELDS]
+
+
+class PositionTable:
+    """持仓快照的列式表示，columns为 {字段名: NumPy数组}"""
+
+    def __init__(self, columns):
+        self.columns = columns
+
+    @classmethod
+    def from_positions(cls, positions):
+        """由PositionSnapshot/XtPosition/字典的可迭代对象构建，只遍历一次"""
+        positions = list(positions)
+        columns = {}
+        for name, dtype in POSITION_FIELDS:
+            values = [p.get(name) if isinstance(p, dict) else getattr(p, name, None) for p in positions]
+            if dtype is object:
+                columns[name] = np.array(['' if v is None else str(v) for v in values], dtype=object)
+            else:
+                columns[name] = np.array([0 if v is None else v for v in values], dtype=dtype)
+        return cls(columns)
+
+    def __len__(self):
+        return len(self.columns['stock_code'])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    # ---------- 掩码 ----------
+
+    def available_mask(self, available_type=-2):
+        """available_type: 1：旧持仓，可用量>0 0：新买的，不可卖出 -1：无论新旧持仓都算 -2：无论是否持仓都算"""
+        can_use = self.columns['can_use_volume']
+        volume = self.columns['volume']
+        if available_type == 1:
+            return can_use > 0
+        if available_type == 0:
+            return (can_use == 0) & (volume > 0)
+        if available_type == -1:
+            return volume > 0
+        if available_type == -2:
+            return np.ones(len(self), dtype=bool)
+        return np.zeros(len(self), dtype=bool)
+
+    def prefix_mask(self, prefixes):
+        """股票代码以prefixes中任一前缀开头"""
+        codes = self.columns['stock_code'].astype(str)
+        mask = np.zeros(len(self), dtype=bool)
+        for prefix in prefixes:
+            mask |= np.char.startswith(codes, prefix)
+        return mask
+
+    def select(self, mask):
+        return PositionTable({name: col[mask] for name, col in self.columns.items()})
+
+    def codes(self, mask=None):
+        codes = self.columns['stock_code'] if mask is None else self.columns['stock_code'][mask]
+        return codes.tolist()
+
+    # ---------- 估值 ----------
+
+    def valuation(self, last_prices):
+        """按最新价向量化计算市值、盈亏和盈亏比例
+
+        last_prices: {stock_code: 最新价}，缺失的代码按成本价估值
+        返回 {字段名: NumPy数组}，包含market_value/current_price/profit/profit_ratio
+        """
+        volume = self.columns['volume']
+        avg_price = self.columns['avg_price']
+        market_value = self.columns['market_value']
+        codes = self.columns['stock_code']
+        current_price = np.array([last_prices.get(code, np.nan) for code in codes], dtype=np.float64)
+        current_price = np.where(np.isnan(current_price), avg_price, current_price)
+
+        cost_value = np.where(avg_price > 0, volume * avg_price, 0.0)
+        # 柜台市值为0时用成本估算
+        market_value = np.where((market_value == 0) & (cost_value > 0), cost_value, market_value)
+        current_value = np.where(current_price > 0, volume * current_price, market_value)
+        has_cost = cost_value > 0
+        profit = np.where(has_cost, current_value - cost_value, 0.0)
+        profit_ratio = np.divide(profit * 100, cost_value, out=np.zeros(len(self)), where=has_cost)
+        return {
+            'market_value': market_value,
+            'current_price': current_price,
+            'profit': profit,
+            'profit_ratio': profit_ratio,
+        }
+
+    # ---------- 视图 ----------
+
+    def to_dataframe(self):
+        return pd.DataFrame(self.columns, columns=POSITION_COLUMNS, copy=False)
+
+    def to_records(self):
+        """JSON友好的字典列表"""
+        values = [self.columns[name].tolist() for name in POSITION_COLUMNS]
+        return [dict(zip(POSITION_COLUMNS, row)) for row in zip(*values)]
+
+    def to_arrow(self):
+        """pyarrow.Table，数值列直接引用NumPy缓冲区"""
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise ImportError("导出Arrow格式需要安装pyarrow: pip install pyarrow")
+        return pa.table({name: pa.array(self.columns[name].tolist() if self.columns[name].dtype == object
+                                        else self.columns[name]) for name in POSITION_COLUMNS})
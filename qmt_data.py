@@ -1,19 +1,79 @@
 from xtquant import xtdata
-import time
+import numpy as np
 from datetime import datetime, timedelta
 from logger_config import get_logger
 import symbol_util
+from quote_service import get_quote_service
+from instrument_cache import get_instrument_cache
+from bar_cache import BarSeries, get_bar_cache, to_epoch_ms
+from bar_format import format_bars, select
+from bar_store import get_bar_store, SERVED_DIVIDEND_TYPES
+from download_manager import get_download_manager
+from config import get_config
 
 log = get_logger(__name__)
 
+def _get_ticks(stock_list):
+    """优先读内存行情表，未启用时直接调用xtdata.get_full_tick"""
+    quotes = get_quote_service()
+    if quotes is not None:
+        return quotes.get_ticks(stock_list)
+    return xtdata.get_full_tick(stock_list)
+
+
 def get_last_price(stock):
-    full_tick = xtdata.get_full_tick([stock])
-    current_price = full_tick[stock]['lastPrice']
-    return current_price
+    return get_last_prices([stock])[stock]
 
 
 def get_instrument_detail(stock_code, iscomplete=False):
-    return xtdata.get_instrument_detail(stock_code, iscomplete)
+    """合约信息，读每日加载的合约信息缓存；iscomplete=True时直接查询xtdata的完整字段"""
+    if iscomplete:
+        return xtdata.get_instrument_detail(stock_code, iscomplete)
+    return get_instrument_cache().get(stock_code)
+
+
+def get_last_prices(stock_list):
+    """批量获取最新价，读内存行情表，过期的标的一次get_full_tick拉取
+
+    Returns:
+        dict: {stock_code: 最新价}，没有行情的代码不在结果中
+    """
+    if not stock_list:
+        return {}
+    quotes = get_quote_service()
+    if quotes is not None:
+        return quotes.get_last_prices(list(stock_list))
+    result = xtdata.get_full_tick(list(stock_list))
+    return {stock: data['lastPrice'] for stock, data in result.items() if data and 'lastPrice' in data}
+
+
+def get_instrument_names(stock_list):
+    """批量获取证券名称，读合约信息缓存；查不到名称的代码返回代码本身
+
+    Returns:
+        dict: {stock_code: 名称}
+    """
+    details = get_instrument_cache().get_many(stock_list, fields=['InstrumentName'])
+    return {s: details.get(s, {}).get('InstrumentName') or s for s in stock_list}
+
+
+def get_instruments(stock_list=None, field_list=None, board=None):
+    """批量获取合约信息
+
+    Args:
+        stock_list: 股票代码列表，为空时返回缓存中的全部合约
+        field_list: 需要返回的字段，为空时返回全部字段
+        board: 只返回指定板块（主板/创业板/科创板/北交所/ETF/债券）
+
+    Returns:
+        dict: {stock_code: 合约信息dict}
+    """
+    cache = get_instrument_cache()
+    if stock_list:
+        stock_list = [symbol_util.get_stock_id_xt(s) for s in stock_list]
+    else:
+        stock_list = cache.codes(board)
+    return cache.get_many(stock_list, fields=field_list or None, board=board)
 
 
 def get_full_tick(stock_list, as_json=False):
@@ -33,7 +93,7 @@ def get_full_tick(stock_list, as_json=False):
 
     log.info(f"get_full_tick: stocks={stock_list}")
 
-    result = xtdata.get_full_tick(stock_list)
+    result = _get_ticks(stock_list)
 
     output = {}
     for stock, data in result.items():
@@ -47,6 +107,78 @@ def get_full_tick(stock_list, as_json=False):
     return output
 
 
+def fetch_bars(stock_list, period, start_time, end_time, dividend_type, fill_data, download=True):
+    """从xtdata读取全部字段的K线，download=True时缺失的数据自动下载后重读
+
+    Returns:
+        dict: {stock_code: (index数组, {字段名: NumPy数组})}
+    """
+    def _read_stocks(stocks):
+        return xtdata.get_market_data_ex(
+            field_list=[],
+            stock_list=stocks,
+            period=period,
+            start_time=start_time,
+            end_time=end_time,
+            count=-1,
+            dividend_type=dividend_type,
+            fill_data=fill_data
+        )
+
+    result = _read_stocks(stock_list)
+
+    # 自动下载缺失数据
+    empty_stocks = [stock for stock, df in result.items() if df is None or df.empty]
+    if download and empty_stocks:
+        log.info(f"自动下载缺失数据: {len(empty_stocks)}只")
+        job = get_download_manager().download(empty_stocks, period, start_time, end_time,
+                                              timeout=get_config().data.download_wait_timeout)
+        if job.wait(0):
+            result.update(_read_stocks(empty_stocks))
+
+    bars = {}
+    for stock, df in result.items():
+        if df is None or df.empty:
+            bars[stock] = (np.empty(0, dtype=object), {})
+            continue
+        index = df.index.astype(str).to_numpy(dtype=object)
+        bars[stock] = (index, {name: df[name].to_numpy(copy=True) for name in df.columns})
+    return bars
+
+
+def _read_bar_store(stock_list, period, start_ms, through, dividend_type):
+    """从本地K线库读取完整覆盖 [start_ms, through] 的股票，返回 {stock_code: (index数组, {字段名: NumPy数组})}
+
+    只用于不复权数据：复权历史在除权除息当天整体变化，库要到收盘同步才更新，与当天K线拼接会出现跳变。
+    """
+    store = get_bar_store()
+    if store is None or dividend_type not in SERVED_DIVIDEND_TYPES:
+        return {}
+    bars = {}
+    for stock in stock_list:
+        if store.covers(stock, period, dividend_type, start_ms, through):
+            bars[stock] = store.read(stock, period, dividend_type, start_ms, to_epoch_ms(through, end=True))
+    return bars
+
+
+def _apply_ticks(bars, today_str, tick_data):
+    """日K数据用实时行情更新当天那一根"""
+    for stock, (index, columns) in bars.items():
+        tick = tick_data.get(stock)
+        if not len(index) or not tick or index[-1] != today_str:
+            continue
+        if 'close' in columns:
+            columns['close'][-1] = tick.get('lastPrice', columns['close'][-1])
+        if 'high' in columns:
+            columns['high'][-1] = max(columns['high'][-1], tick.get('high', 0))
+        if 'low' in columns:
+            columns['low'][-1] = min(columns['low'][-1], tick.get('low', float('inf')))
+        if 'volume' in columns:
+            columns['volume'][-1] = tick.get('volume', columns['volume'][-1])
+        if 'amount' in columns:
+            columns['amount'][-1] = tick.get('amount', columns['amount'][-1])
+
+
 def get_market_data_ex(stock_list, field_list=None, period='1d', start_time='', end_time='', count=-1, dividend_type='front', fill_data=True, as_json=False):
     """获取历史行情数据
 
@@ -64,6 +196,37 @@ def get_market_data_ex(stock_list, field_list=None, period='1d', start_time='',
     Returns:
         dict: {stock_code: DataFrame友好格式 或 对象数组格式}
     """
+    bars = get_bars(stock_list, field_list, period, start_time, end_time, count, dividend_type, fill_data)
+
+    # 转为输出格式（按列向量化转换）
+    output = {stock: format_bars(index, columns, as_json=as_json) for stock, (index, columns) in bars.items()}
+
+    log.info(f"get_market_data_ex: 返回 {len(output)} 只股票数据")
+    return output
+
+
+def iter_bars(stock_list, field_list=None, period='1d', start_time='', end_time='', count=-1, dividend_type='front', fill_data=True, chunk_size=None):
+    """按批读取历史行情，逐只产出 (stock_code, index, {字段名: NumPy数组})，参数同get_market_data_ex
+
+    每批chunk_size只股票（默认取配置）调用一次get_bars，产出完一批再读下一批，内存只保留当前批。
+    """
+    if not stock_list:
+        raise ValueError('stock_list 不能为空')
+    chunk_size = max(1, chunk_size or get_config().data.stream_chunk_size)
+    for i in range(0, len(stock_list), chunk_size):
+        bars = get_bars(stock_list[i:i + chunk_size], field_list, period, start_time, end_time, count,
+                        dividend_type, fill_data)
+        for stock in list(bars):
+            index, columns = bars.pop(stock)
+            yield stock, index, columns
+
+
+def get_bars(stock_list, field_list=None, period='1d', start_time='', end_time='', count=-1, dividend_type='front', fill_data=True):
+    """获取历史行情的列数据，参数同get_market_data_ex
+
+    Returns:
+        dict: {stock_code: (index, {字段名: NumPy数组})}，按stock_list顺序，供JSON和二进制格式输出
+    """
     if not stock_list:
         raise ValueError('stock_list 不能为空')
 
@@ -77,87 +240,54 @@ def get_market_data_ex(stock_list, field_list=None, period='1d', start_time='',
     if not end_time:
         end_time = datetime.now().strftime('%Y%m%d')
 
-    log.info(f"get_market_data_ex: stocks={stock_list}, period={period}, start={start_time}, end={end_time}, dividend={dividend_type}")
+    log.info(f"get_bars: stocks={stock_list}, period={period}, start={start_time}, end={end_time}, dividend={dividend_type}")
 
-    result = xtdata.get_market_data_ex(
-        field_list=field_list,
-        stock_list=stock_list,
-        period=period,
-        start_time=start_time,
-        end_time=end_time,
-        count=count,
-        dividend_type=dividend_type,
-        fill_data=fill_data
-    )
+    today_str = datetime.now().strftime('%Y%m%d')
+    start_ms = to_epoch_ms(start_time)
+    end_ms = to_epoch_ms(end_time, end=True)
+    today_ms = to_epoch_ms(today_str)
 
-    # 自动下载缺失数据
-    empty_stocks = [stock for stock, df in result.items() if df is None or df.empty]
-    if empty_stocks:
-        log.info(f"自动下载缺失数据: {empty_stocks}")
-        for stock in empty_stocks:
-            xtdata.download_history_data(stock, period, start_time, end_time)
-        time.sleep(1)
-        result = xtdata.get_market_data_ex(
-            field_list=field_list,
-            stock_list=stock_list,
-            period=period,
-            start_time=start_time,
-            end_time=end_time,
-            count=count,
-            dividend_type=dividend_type,
-            fill_data=fill_data
-        )
+    # 已完成的K线（截止到上一交易日）读缓存，未命中的股票一次批量读取
+    bars = {}
+    if start_ms < today_ms:
+        cache = get_bar_cache()
+        missing = []
+        for stock in stock_list:
+            entry = cache.get((stock, period, dividend_type, fill_data), start_ms)
+            if entry is None:
+                missing.append(stock)
+            else:
+                bars[stock] = entry.slice(start_ms, min(end_ms, today_ms - 1))
+        if missing:
+            yesterday_str = (datetime.now() - timedelta(days=1)).strftime('%Y%m%d')
+            fetched = _read_bar_store(missing, period, start_ms, yesterday_str, dividend_type) if fill_data else {}
+            rest = [stock for stock in missing if stock not in fetched]
+            if rest:
+                fetched.update(fetch_bars(rest, period, start_time, yesterday_str, dividend_type, fill_data))
+            for stock, (index, columns) in fetched.items():
+                if 'time' not in columns:
+                    bars[stock] = (index, columns)
+                    continue
+                entry = BarSeries(index, columns, start_ms, today_str)
+                if len(entry):
+                    cache.put((stock, period, dividend_type, fill_data), entry)
+                bars[stock] = entry.slice(start_ms, min(end_ms, today_ms - 1))
 
-    # 日K数据用实时行情更新最后一天
-    if period == '1d':
-        today_str = datetime.now().strftime('%Y%m%d')
-        tick_data = xtdata.get_full_tick(stock_list)
-        for stock, df in result.items():
-            if df is None or df.empty:
+    # 当日K线仍在变化，不缓存，每次读取；日K再用实时行情更新
+    if end_ms >= today_ms:
+        # 当日尚无K线（盘前、非交易日）是正常情况，不触发下载
+        today = fetch_bars(stock_list, period, max(start_time, today_str), end_time, dividend_type, fill_data,
+                            download=False)
+        if period == '1d':
+            _apply_ticks(today, today_str, _get_ticks(stock_list))
+        for stock, (index, columns) in today.items():
+            if not len(index):
                 continue
-            tick = tick_data.get(stock)
-            if not tick:
-                continue
-            last_idx = str(df.index[-1])
-            if last_idx == today_str:
-                row_idx = len(df) - 1
-                if 'close' in df.columns:
-                    df.at[df.index[row_idx], 'close'] = tick.get('lastPrice', df.iloc[row_idx]['close'])
-                if 'high' in df.columns:
-                    df.at[df.index[row_idx], 'high'] = max(df.iloc[row_idx]['high'], tick.get('high', 0))
-                if 'low' in df.columns:
-                    df.at[df.index[row_idx], 'low'] = min(df.iloc[row_idx]['low'], tick.get('low', float('inf')))
-                if 'volume' in df.columns:
-                    df.at[df.index[row_idx], 'volume'] = tick.get('volume', df.iloc[row_idx]['volume'])
-                if 'amount' in df.columns:
-                    df.at[df.index[row_idx], 'amount'] = tick.get('amount', df.iloc[row_idx]['amount'])
-
-    # 转为输出格式
-    output = {}
-    for stock, df in result.items():
-        if df is None or df.empty:
-            output[stock] = [] if as_json else {'columns': [], 'index': [], 'data': []}
-            continue
-        columns = list(df.columns)
-        data = df.values.tolist()
-        if 'time' in columns:
-            time_idx = columns.index('time')
-            for row in data:
-                ts_ms = row[time_idx]
-                if ts_ms and ts_ms > 0:
-                    row.append(datetime.fromtimestamp(ts_ms / 1000).strftime('%Y%m%d'))
-                else:
-                    row.append('')
-            columns.append('timeFmt')
-
-        if as_json:
-            output[stock] = [dict(zip(columns, row)) for row in data]
-        else:
-            output[stock] = {
-                'columns': columns,
-                'index': [str(i) for i in df.index],
-                'data': data
-            }
+            if stock in bars and len(bars[stock][0]):
+                past_index, past_columns = bars[stock]
+                index = np.concatenate([past_index, index])
+                columns = {name: np.concatenate([past_columns[name], col]) for name, col in columns.items()
+                           if name in past_columns}
+            bars[stock] = (index, columns)
 
-    log.info(f"get_market_data_ex: 返回 {len(output)} 只股票数据")
-    return output
\ No newline at end of file
+    return {stock: select(*bars.get(stock, ((), {})), field_list=field_list, count=count) for stock in stock_list}
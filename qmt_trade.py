@@ -1,49 +1,164 @@
 import math
-import time
+import threading
 import traceback
-import pandas as pd
+import time
+from collections import OrderedDict
+from types import SimpleNamespace
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+import numpy as np
+import qmt_data
 import symbol_util
+from account_state import AccountState
+from account_events import AccountEventHub, EVENT_TRADE
+from broker_queue import BrokerQueue, TradeQueueFullError, BrokerCallInFlightError, PRIORITY_CANCEL, PRIORITY_ORDER, PRIORITY_QUERY
+from connection_supervisor import ConnectionSupervisor, TradeConnectionError, STATE_CONNECTED
 from xtquant import xtconstant
-from xtquant.xttrader import XtQuantTrader, XtQuantTraderCallback
-from xtquant.xttype import StockAccount
-from dingtalk_helper import DingTalkBot
+from trade_session import session_manager
+from xtquant.xttrader import XtQuantTraderCallback
+from dingtalk_helper import DingTalkBot, DingTalkNotifier, PRIORITY_ERROR, PRIORITY_FILL, PRIORITY_INFO
 from logger_config import get_logger
 from config import get_config
+from order_book import OrderBook, ORDER_STATUS_MAP
+from position_table import PositionTable
+from rebalance import plan_rebalance
+from trade_journal import get_journal, KIND_ORDER, KIND_TRADE, KIND_ORDER_ERROR, KIND_CANCEL_ERROR, \
+    KIND_ORDER_RESPONSE, KIND_CANCEL_RESPONSE
 
 # 设置日志
 log = get_logger(__name__)
 config = get_config()
 dingbot = DingTalkBot(config.dingtalk.access_token, config.dingtalk.secret)
+# 交易流程中的通知都经后台线程发送，下单接口不等待钉钉
+notifier = DingTalkNotifier(dingbot, config.dingtalk.queue_size, config.dingtalk.merge_window,
+                            config.dingtalk.rate_limit)
 
-class TradeConnectionError(Exception):
-    """交易接口连接失败"""
+class OrderRejectedError(Exception):
+    """异步委托被柜台拒绝"""
     pass
 
 
-ORDER_STATUS_MAP = {
-    48: "未报",
-    49: "待报",
-    50: "已报",
-    51: "已报待撤",
-    52: "部成待撤",
-    53: "部撤",
-    54: "已撤",
-    55: "部成",
-    56: "已成",
-    57: "废单",
-    255: "未知",
+# 下单提交方式：sync 同步等待order_id；async 异步提交立即返回seq；async_wait 异步提交并等待回报
+SUBMIT_MODES = ('sync', 'async', 'async_wait')
+
+# 撤单后委托到达终态时的结果
+CANCEL_OUTCOMES = {
+    53: 'partial_cancelled',  # 部撤
+    54: 'cancelled',  # 已撤
+    56: 'filled',  # 撤单前已全部成交
+    57: 'junk',  # 废单
 }
 
 
+def order_price_args(price_type, symbol, cur_price):
+    """把接口的价格类型转换为 (xt报价类型, 委托价格)，不支持的价格类型返回None
+    price_type: 0:限价, 1:最新价, 2:最优五档即时成交剩余撤销, 3:本方最优, 5:对方最优
+    """
+    price_type_map = {
+        # 指定价格下单
+        0: (xtconstant.FIX_PRICE, cur_price),
+        # 最新价下单
+        1: (xtconstant.LATEST_PRICE, 0),
+        # 最优五档即时成交剩余撤销
+        2: (
+            xtconstant.MARKET_SH_CONVERT_5_CANCEL if symbol.endswith(
+                "SH") else xtconstant.MARKET_SZ_CONVERT_5_CANCEL,
+            0),
+        # 本方最优价格委托，买入时买一 卖出时卖一
+        3: (xtconstant.MARKET_MINE_PRICE_FIRST, 0),
+        # 对方最优价格委托，买入时卖一 卖出时买一
+        5: (xtconstant.MARKET_PEER_PRICE_FIRST, 0)
+    }
+    return price_type_map.get(price_type)
+
+
 class MyXtQuantTraderCallback(XtQuantTraderCallback):
+    def __init__(self, trader=None):
+        """
+        :param trader: 所属的MyTradeAPIWrapper，回调推送会同步到它的账户状态缓存
+        """
+        super().__init__()
+        self.trader = trader
+        # 异步下单 seq -> Future(order_id) 关联表
+        self._async_lock = threading.Lock()
+        self._async_orders = {}
+        # 回报先于登记到达时暂存 seq -> (order_id, error_msg)
+        self._async_early = OrderedDict()
+        # 撤单等待 order_id -> Future((outcome, message))
+        self._cancel_waits = {}
+
+    def track_async_order(self, seq):
+        """
+        登记异步下单请求序号
+        :param seq: order_stock_async返回的请求序号
+        :return: Future，收到on_order_stock_async_response后结果为order_id，收到on_order_error后抛出OrderRejectedError
+        """
+        future = Future()
+        with self._async_lock:
+            early = self._async_early.pop(seq, None)
+            if early is None:
+                self._async_orders[seq] = future
+        if early is not None:
+            self._set_async_result(future, *early)
+        return future
+
+    def _resolve_async_order(self, seq, order_id=None, error_msg=None):
+        with self._async_lock:
+            future = self._async_orders.pop(seq, None)
+            if future is None:
+                self._async_early[seq] = (order_id, error_msg)
+                while len(self._async_early) > 1000:
+                    self._async_early.popitem(last=False)
+                return
+        self._set_async_result(future, order_id, error_msg)
+
+    @staticmethod
+    def _set_async_result(future, order_id, error_msg):
+        if error_msg is not None:
+            future.set_exception(OrderRejectedError(error_msg))
+        else:
+            future.set_result(order_id)
+
+    def track_cancel(self, order_id):
+        """
+        登记等待撤单结果，同一委托已有等待中的撤单时共用同一个Future
+        :return: (Future, 是否新登记)，委托到达终态（见CANCEL_OUTCOMES）或收到撤单失败推送时结果为 (outcome, message)
+        """
+        with self._async_lock:
+            future = self._cancel_waits.get(order_id)
+            if future is not None:
+                return future, False
+            future = self._cancel_waits[order_id] = Future()
+        return future, True
+
+    def discard_cancel(self, order_id, future):
+        """撤单等待超时：移除登记但不设置结果，其他共用该Future的调用方按各自期限继续等待，之后的撤单重新提交"""
+        with self._async_lock:
+            if self._cancel_waits.get(order_id) is future:
+                del self._cancel_waits[order_id]
+
+    def resolve_cancel(self, order_id, outcome, message=''):
+        with self._async_lock:
+            future = self._cancel_waits.pop(order_id, None)
+        if future is not None and not future.done():
+            future.set_result((outcome, message))
+
+    def _journal(self, kind, data):
+        """把回调事件追加到交易事件日志，失败不影响回调处理"""
+        if self.trader is None or self.trader.journal is None:
+            return
+        try:
+            self.trader.journal.append(self.trader.account_id, kind, data)
+        except Exception as e:
+            log.error(f"交易事件日志记录失败 {kind}: {e}")
+
     def on_disconnected(self):
         """
         连接断开
         :return:
         """
         log.info("connection lost, 交易接口断开，即将重连")
-        # global xt_trader
-        # xt_trader = None
+        if self.trader is not None:
+            self.trader.supervisor.mark_disconnected("交易接口断开")
 
     def on_stock_order(self, order):
         """
@@ -52,6 +167,13 @@ class MyXtQuantTraderCallback(XtQuantTraderCallback):
         :return:
         """
         log.info(f"on order callback: {order.stock_code} {order.order_status}")
+        self._journal(KIND_ORDER, order)
+        if self.trader is not None:
+            self.trader.state.on_order(order)
+            self.trader.order_book.on_order(order)
+        if order.order_status in CANCEL_OUTCOMES:
+            self.resolve_cancel(order.order_id, CANCEL_OUTCOMES[order.order_status],
+                                ORDER_STATUS_MAP.get(order.order_status, ''))
         # log.info(order.stock_code, order.order_status, order.order_sysid)
 
     def on_stock_asset(self, asset):
@@ -61,6 +183,8 @@ class MyXtQuantTraderCallback(XtQuantTraderCallback):
         :return:
         """
         log.info(f"on asset callback {asset}")
+        if self.trader is not None:
+            self.trader.state.on_asset(asset)
         # log.info(asset.account_id, asset.cash, asset.total_asset)
 
     def on_stock_trade(self, trade):
@@ -70,6 +194,21 @@ class MyXtQuantTraderCallback(XtQuantTraderCallback):
         :return:
         """
         log.info(f"on trade callback {trade}")
+        self._journal(KIND_TRADE, trade)
+        if self.trader is not None:
+            self.trader.state.on_trade(trade)
+            self.trader.order_book.on_trade(trade)
+            self.trader.events.publish(EVENT_TRADE, {
+                'order_id': trade.order_id,
+                'traded_id': getattr(trade, 'traded_id', ''),
+                'symbol': trade.stock_code,
+                'side': 'buy' if trade.order_type == xtconstant.STOCK_BUY else 'sell',
+                'traded_volume': trade.traded_volume,
+                'traded_price': trade.traded_price,
+                'traded_amount': trade.traded_amount,
+                'traded_time': getattr(trade, 'traded_time', 0),
+                'strategy_name': getattr(trade, 'strategy_name', ''),
+            })
         # log.info(trade.account_id, trade.stock_code, trade.order_id)
 
     def on_stock_position(self, position):
@@ -79,6 +218,8 @@ class MyXtQuantTraderCallback(XtQuantTraderCallback):
         :return:
         """
         log.info(f"on position callback {position}")
+        if self.trader is not None:
+            self.trader.state.on_position(position)
         # log.info(position.stock_code, position.volume)
 
     def on_order_error(self, order_error):
@@ -90,6 +231,10 @@ class MyXtQuantTraderCallback(XtQuantTraderCallback):
         # log.info(f"on order_error callback {order_error}")
         log.info(
             f"order_error {order_error.account_id}, {order_error.strategy_name}, {order_error.error_id}, {order_error.error_msg}")
+        self._journal(KIND_ORDER_ERROR, order_error)
+        seq = getattr(order_error, 'seq', None)
+        if seq:
+            self._resolve_async_order(seq, error_msg=f"{order_error.error_id} {order_error.error_msg}")
 
     def on_cancel_error(self, cancel_error):
         """
@@ -98,7 +243,20 @@ class MyXtQuantTraderCallback(XtQuantTraderCallback):
         :return:
         """
         log.info(f"on cancel_error callback {cancel_error}")
+        self._journal(KIND_CANCEL_ERROR, cancel_error)
         # log.info(cancel_error.order_id, cancel_error.error_id, cancel_error.error_msg)
+        self.resolve_cancel(cancel_error.order_id, 'rejected', f"{cancel_error.error_id} {cancel_error.error_msg}")
+
+    def on_cancel_order_stock_async_response(self, response):
+        """
+        异步撤单回报推送，cancel_result非0表示撤单请求失败；成功时等待委托状态推送确认
+        :param response: XtCancelOrderResponse 对象
+        :return:
+        """
+        log.info(f"on_cancel_order_stock_async_response {response.order_id} {response.cancel_result}")
+        self._journal(KIND_CANCEL_RESPONSE, response)
+        if response.cancel_result != 0:
+            self.resolve_cancel(response.order_id, 'rejected', f"撤单失败 {response.cancel_result}")
 
     def on_order_stock_async_response(self, response):
         """
@@ -107,6 +265,11 @@ class MyXtQuantTraderCallback(XtQuantTraderCallback):
         :return:
         """
         log.info(f"on_order_stock_async_response {response}")
+        self._journal(KIND_ORDER_RESPONSE, response)
+        if response.order_id and response.order_id > 0:
+            self._resolve_async_order(response.seq, order_id=response.order_id)
+        else:
+            self._resolve_async_order(response.seq, error_msg=getattr(response, 'error_msg', '') or '异步下单失败')
         # log.info(response.account_id, response.order_id, response.seq)
 
     def on_account_status(self, status):
@@ -131,6 +294,8 @@ class MyXtQuantTraderCallback(XtQuantTraderCallback):
 
         status_text = status_map.get(status.status, f"未知状态({status.status})")
         log.info(f"on_account_status {status.account_id} {status.account_type} {status.status}({status_text})")
+        if self.trader is not None:
+            self.trader.supervisor.on_account_status(status.status)
         # log.info(status.account_id, status.account_type, status.status)
 
 
@@ -143,92 +308,108 @@ class MyTradeAPIWrapper:
         if qmtpath is None:
             qmtpath = r"D:\迅投极速策略交易系统交易终端 华鑫证券QMT实盘\userdata_mini"
         self.path = qmtpath
-        self.session_id = quant_code * 1000000000 + int(account_id)  # xt接口需要的区分不同账号的session_id，同一个账号可以多次登录
+        # 同一QMT路径的账户共享一个XtQuantTrader会话，回调按account_id分发
+        self.session = session_manager.get_session(qmtpath)
+        self.session_generation = None
 
         self.trade_api = None
         self.acc = None
-        self.connect_trade_api()
+        self.callback = None
+        # 所有柜台调用都经过该队列，在专用工作线程上按优先级串行执行
+        self.broker_queue = BrokerQueue(account_id, config.trade.broker_queue_size, config.trade.broker_call_timeout)
+        # 资金/持仓内存快照，由交易回调增量更新并定期对账
+        self.state = AccountState(account_id)
+        # 当日委托簿，由委托/成交回调更新，随账户状态一起对账同步
+        self.order_book = OrderBook(account_id)
+        # 交易事件日志，启动时回放当日事件重建委托簿
+        self.journal = get_journal()
+        self._replay_journal()
+        # 账户事件中心，资金/持仓/委托变化和成交推送给页面等订阅连接（回放的历史事件不推送）
+        self.events = AccountEventHub(account_id, config.trade.stream_buffer_size)
+        self.state.add_listener(self.events.publish)
+        self.order_book.add_listener(self.events.publish)
+        # 连接守护线程，断线后在后台重连，请求线程只检查连接状态
+        self.supervisor = ConnectionSupervisor(account_id, self.connect_trade_api, self._on_connection_change,
+                                               config.trade.reconnect_base_delay, config.trade.reconnect_max_delay)
+        try:
+            self.connect_trade_api()
+            self.supervisor.mark_connected()
+        except Exception as e:
+            msg = f"{self.account_id} 交易接口连接失败，转入后台重连: {e}"
+            log.error(msg)
+            send_msg(msg, PRIORITY_ERROR)
+            self.supervisor.mark_disconnected(str(e))
+        self.state.start_reconciler(self._query_portfolio, self._query_positions,
+                                    config.trade.state_reconcile_interval, (self._sync_orders,),
+                                    config.trade.state_reconcile_min_interval)
+        self.state.request_reconcile()
+
+    def _replay_journal(self):
+        """回放交易事件日志中当日的委托和成交事件到委托簿"""
+        if self.journal is None:
+            return
+        start_ts = time.perf_counter()
+        events = self.journal.replay_latest(self.account_id)
+        for _, kind, payload in events:
+            if kind == KIND_ORDER:
+                self.order_book.on_order(SimpleNamespace(**payload))
+            elif kind == KIND_TRADE:
+                self.order_book.on_trade(SimpleNamespace(**payload))
+        log.info(f"{self.account_id} 回放交易事件{len(events)}条，委托{len(self.order_book)}笔，"
+                 f"耗时{(time.perf_counter() - start_ts) * 1000:.1f}ms")
 
     def connect_trade_api(self):
-        """初始化或重新连接TradeAPI"""
-        global xt_trader
-        for attempt in range(3):
-            try:
-                self.session_id += 1
-                log.info(f"init qmt安装路径:{self.path} account_id={self.account_id} {self.session_id}")
-                xt_trader = XtQuantTrader(self.path, self.session_id)
-                # 开启主动请求接口的专用线程 开启后在on_stock_xxx回调函数里调用XtQuantTrader.query_xxx函数不会卡住回调线程，但是查询和推送的数据在时序上会变得不确定
-                # 详见: http://docs.thinktrader.net/vip/pages/ee0e9b/#开启主动请求接口的专用线程
-                # http://dict.thinktrader.net/nativeApi/xttrader.html
-                # xt_trader.set_relaxed_response_order_enabled(True)
-                acc = StockAccount(self.account_id,
-                                   'STOCK')  # StockAccount可以用第二个参数指定账号类型，如沪港通传'HUGANGTONG'，深港通传'SHENGANGTONG'
-                callback = MyXtQuantTraderCallback()
-                xt_trader.register_callback(callback)
-                xt_trader.start()  # 启动交易线程
-                connect_result = xt_trader.connect()
-                log.info(f"{self.account_id} connect_result={connect_result}")
-                if connect_result == 0:
-                    log.info(f"{self.account_id} connected to TradeAPI success")
-                    subscribe_result = xt_trader.subscribe(acc)
-                    if subscribe_result != 0:
-                        log.info('账号订阅失败 %d' % subscribe_result)
-                        raise TradeConnectionError('账号订阅失败 %d' % connect_result)
-                    else:
-                        log.info('账号订阅成功 %d' % subscribe_result)
-                    self.trade_api = xt_trader
-                    self.acc = acc
-                    return
-                log.info(f"{self.account_id} connected to TradeAPI on attempt {attempt}")
-            except Exception as e:
-                log.info(f"{self.account_id} attempt {attempt} unexpected error: {e}")
-            time.sleep(1)
-        msg = f"Failed to connect TradeAPI for {self.account_id} after 3 attempts"
-        log.info(msg)
-        send_msg(msg)
-        raise TradeConnectionError('链接失败 %d' % connect_result)
-
-    def trade_target_pct(self, symbol, cur_price, pct_target=0.1, price_type=0, record=1):
+        """接入所在QMT路径的共享交易会话（单次尝试），失败抛出TradeConnectionError，重试由连接守护线程负责"""
+        if self.callback is None:
+            self.callback = MyXtQuantTraderCallback(self)
+        self.trade_api, self.acc, self.session_generation = self.session.connect(
+            self.account_id, self.callback, self.session_generation)
+        log.info(f"{self.account_id} connected to TradeAPI success session_id={self.session.session_id}")
+
+    def _on_connection_change(self, state, message):
+        """连接守护线程回调：推送通知，恢复后立即对账"""
+        send_msg(message, PRIORITY_INFO if state == STATE_CONNECTED else PRIORITY_ERROR)
+        if state == STATE_CONNECTED:
+            self.state.request_reconcile()
+
+    def trade_target_pct(self, symbol, cur_price, pct_target=0.1, price_type=0, record=1, submit_mode='sync'):
         """指定仓位买入
         symbol: 股票代码
         cur_price: 当前价格
         pct_target: 仓位比例
         price_type: 0：限价
+        submit_mode: 下单提交方式，参见order_dif_type
         """
-        for _ in range(3):
-            try:
-                _portfolio = self.get_portfolio()
-                total_value = _portfolio.total_asset
-                available_cash = _portfolio.cash
-                value = total_value * pct_target
-                if value > available_cash:
-                    value = available_cash
-                result = self.trade_buy(symbol, cur_price, value, price_type, record)
-                send_msg(result)
-                return result
-            except Exception as e:
-                try:
-                    self.connect_trade_api()  # 重新连接TradeAPI
-                except TradeConnectionError as conn_err:
-                    log.error(f"交易接口重连失败: {conn_err}")
-                log.error(traceback.format_exc())
-                if _ == 2:  # 最后一次重试失败
-                    return {
-                        'success': False,
-                        'symbol': symbol,
-                        'order_num': 0,
-                        'price': cur_price,
-                        'value': 0,
-                        'order_result': None,
-                        'message': f'获取账户信息失败，重试3次后仍然失败: {str(e)}'
-                    }
-                continue
+        try:
+            _portfolio = self.get_portfolio()
+            total_value = _portfolio.total_asset
+            available_cash = _portfolio.cash
+            value = total_value * pct_target
+            if value > available_cash:
+                value = available_cash
+        except TradeQueueFullError:
+            raise
+        except Exception as e:
+            log.error(traceback.format_exc())
+            return {
+                'success': False,
+                'symbol': symbol,
+                'order_num': 0,
+                'price': cur_price,
+                'value': 0,
+                'order_result': None,
+                'message': f'获取账户信息失败: {str(e)}'
+            }
+        result = self.trade_buy(symbol, cur_price, value, price_type, record, submit_mode)
+        send_msg(result, PRIORITY_FILL)
+        return result
 
-    def trade_sell_target_pct(self, symbol, cur_price, pct_target, price_type=0):
+    def trade_sell_target_pct(self, symbol, cur_price, pct_target, price_type=0, submit_mode='sync'):
         """指定仓位卖出
         symbol: 股票代码
         cur_price: 当前价格
         pct_target: 仓位比例,持仓的仓位比例，如果全部卖出就是1，卖出半仓就是0.5
+        submit_mode: 下单提交方式，参见order_dif_type
         """
         log.info("%s sell %s %s" % (self.account_id, symbol, cur_price))
         symbol = symbol_convert(symbol)
@@ -240,8 +421,8 @@ class MyTradeAPIWrapper:
                 order_num = _p[symbol].get('can_use_volume', 0)
             order_num_sell = order_num * pct_target
             order_num_sell = int(order_num_sell / 100) * 100
-            result = self.trade_sell(symbol, cur_price, order_num_sell, price_type)
-            send_msg(result)
+            result = self.trade_sell(symbol, cur_price, order_num_sell, price_type, submit_mode)
+            send_msg(result, PRIORITY_FILL)
             return result
         else:
             return {
@@ -254,9 +435,10 @@ class MyTradeAPIWrapper:
                 'message': f'未持有该股票: {symbol}'
             }
 
-    def get_position(self, available_type=-2):
+    def get_position(self, available_type=-2, live=False):
         """获取持仓
         available_type: 1：旧持仓，可用量>0 0：新买的，不可卖出 -1：无论新旧持仓都算 -2：无论是否持仓都算
+        live: True时直接查询柜台；默认读取内存快照，快照超过 STATE_MAX_AGE 秒未对账时回退到实时查询
                 account_type	int	账号类型，参见数据字典
                 account_id	str	资金账号
                 stock_code	str	证券代码
@@ -270,130 +452,107 @@ class MyTradeAPIWrapper:
                 avg_price	float	成本价
                 direction	int	多空方向，股票不适用；参见数据字典
         """
-        for _ in range(3):
-            try:
-                _p = {}
-                positions = self.trade_api.query_stock_positions(self.acc)
-                # 处理positions可能是字典或列表的情况
-                if isinstance(positions, dict):
-                    position_items = positions.items()
-                elif isinstance(positions, list):
-                    # 如果是列表，假设每个元素都有stock_code属性
-                    position_items = [(getattr(pos, 'stock_code', str(i)), pos) for i, pos in enumerate(positions)]
-                else:
-                    log.error(f"Unexpected positions type: {type(positions)}")
-                    continue
-
-                for stock_code, position_info in position_items:
-                    # 确保stock_code是字符串类型
-                    if hasattr(position_info, 'stock_code'):
-                        stock_code = position_info.stock_code
-                    elif isinstance(stock_code, str):
-                        pass  # stock_code已经是字符串
-                    else:
-                        stock_code = str(stock_code)
-
-                    # if stock_code.startswith("SHR"):
-                    #     continue
-                    # if stock_code.startswith("13"):
-                    #     continue
-                    # if stock_code.startswith("S"):
-                    #     continue
-                    # if stock_code.startswith("5"):
-                    #     continue
-
-                    # 获取持仓信息，支持XtPosition对象和字典两种格式
-                    if hasattr(position_info, 'can_use_volume'):
-                        can_use_volume = position_info.can_use_volume
-                        volume = position_info.volume
-                        pos_data = position_info
-                    else:
-                        can_use_volume = position_info.get('can_use_volume', 0)
-                        volume = position_info.get('volume', 0)
-                        pos_data = position_info
-
-                    if available_type == 1 and can_use_volume > 0:
-                        _p[stock_code] = pos_data
-                    elif available_type == 0 and can_use_volume == 0 and volume > 0:
-                        _p[stock_code] = pos_data
-                    elif available_type == -1 and volume > 0:
-                        _p[stock_code] = pos_data
-                    elif available_type == -2:
-                        _p[stock_code] = pos_data
-                return _p
-            except Exception as e:
-                log.info(f"Error getting positions: {e}")
-                time.sleep(1)
-                try:
-                    self.connect_trade_api()  # 重新连接TradeAPI
-                except TradeConnectionError as conn_err:
-                    log.error(f"交易接口重连失败: {conn_err}")
+        positions = None
+        if not live:
+            positions = self.state.get_positions(config.trade.state_max_age)
+            if positions is None:
+                log.info(f"{self.account_id} 持仓快照已过期，回退实时查询")
+        if positions is None:
+            positions = self.state.replace_positions(self._query_positions())
+
+        _p = {}
+        for stock_code, pos_data in positions.items():
+            can_use_volume = pos_data.can_use_volume
+            volume = pos_data.volume
+            if available_type == 1 and can_use_volume > 0:
+                _p[stock_code] = pos_data
+            elif available_type == 0 and can_use_volume == 0 and volume > 0:
+                _p[stock_code] = pos_data
+            elif available_type == -1 and volume > 0:
+                _p[stock_code] = pos_data
+            elif available_type == -2:
+                _p[stock_code] = pos_data
+        return _p
+
+    def _broker_call(self, priority, method, *args):
+        """通过账户队列在工作线程上调用XtQuantTrader的method方法
+
+        连接断开时立即抛出TradeConnectionError；交易接口在执行时才解析，重连后排队中的请求会使用新的连接
+        """
+        self.supervisor.ensure_available()
+        return self.broker_queue.call(priority, lambda: getattr(self.trade_api, method)(*args))
+
+    def _query_positions(self):
+        """实时查询柜台持仓，返回XtPosition列表"""
+        positions = self._broker_call(PRIORITY_QUERY, 'query_stock_positions', self.acc)
+        # 处理positions可能是字典或列表的情况
+        if isinstance(positions, dict):
+            return list(positions.values())
+        if isinstance(positions, list):
+            return positions
+        raise TypeError(f"Unexpected positions type: {type(positions)}")
+
+    def get_position_table(self, live=False):
+        """获取列式持仓快照PositionTable
+        live: True时直接查询柜台；默认读取内存快照，快照超过 STATE_MAX_AGE 秒未对账时回退到实时查询
+        """
+        if not live:
+            table = self.state.get_position_table(config.trade.state_max_age)
+            if table is not None:
+                return table
+            log.info(f"{self.account_id} 持仓快照已过期，回退实时查询")
+        return PositionTable.from_positions(self.state.replace_positions(self._query_positions()).values())
+
+    def held_symbols(self):
+        """内存快照中的持仓代码，不查询柜台；尚未对账时返回空列表"""
+        table = self.state.get_position_table(float('inf'))
+        return table.codes() if table is not None else []
+
+    def _position_codes(self, available_type, include=None, exclude=("SHR",)):
+        """按可用类型和代码前缀筛选持仓代码，在同一份列式快照上做向量化掩码"""
+        table = self.get_position_table()
+        mask = table.available_mask(available_type)
+        if include:
+            mask &= table.prefix_mask(include)
+        if exclude:
+            mask &= ~table.prefix_mask(exclude)
+        return table.codes(mask)
 
     def get_position_arr(self, available_type=1):
-        stock_arr = []
-        positions = self.get_position(available_type)
-        return [item for item in positions if not str(item).startswith("SHR")]
-        # for symbol in positions:
-        #   stock_arr.append(symbol)
-        # return stock_arr
+        return self._position_codes(available_type)
 
     def get_position_arr_10(self, available_type=1):
-        stock_arr = self.get_position_arr(available_type)
-        return [item for item in stock_arr if not str(item).startswith(("30", "8", "4"))]
+        return self._position_codes(available_type, exclude=("SHR", "30", "8", "4"))
 
     def get_position_arr_20(self, available_type=1):
-        stock_arr = self.get_position_arr(available_type)
-        return [item for item in stock_arr if str(item).startswith("30")]
+        return self._position_codes(available_type, include=("30",))
 
     def get_position_arr_kc(self, available_type=1):
-        stock_arr = self.get_position_arr(available_type)
-        return [item for item in stock_arr if str(item).startswith(("68"))]
+        return self._position_codes(available_type, include=("68",))
 
     def get_position_arr_bj(self, available_type=1):
-        stock_arr = self.get_position_arr(available_type)
-        return [item for item in stock_arr if str(item).startswith(("8", "4"))]
+        return self._position_codes(available_type, include=("8", "4"))
 
     def get_position_df(self):
-        positions = self.get_position()
-        log.info(positions)
-        vb_list = ['account_type', 'account_id', 'stock_code', 'volume', 'can_use_volume', 'open_price', 'market_value',
-                   'frozen_volume', 'on_road_volume', 'yesterday_volume',
-                   'avg_price', 'direction']
-        positions_df = pd.DataFrame(columns=vb_list)
-        # for symbol, info in positions.items():
-        #   temp = pd.DataFrame([info], columns=vb_list)
-        #   positions_df = pd.concat([positions_df, temp], ignore_index=True)
-        # positions_df = pd.DataFrame()
-        for symbol, info in positions.items():
-            # 处理XtPosition对象和字典两种格式
-            row_data = []
-            for vb in vb_list:
-                if hasattr(info, vb):
-                    # XtPosition对象，直接访问属性
-                    row_data.append(getattr(info, vb))
-                elif isinstance(info, dict):
-                    # 字典格式，使用键访问
-                    row_data.append(info.get(vb, None))
-                else:
-                    # 其他情况，设为None
-                    row_data.append(None)
-
-            temp = pd.DataFrame([row_data], columns=vb_list, index=[0])
-            positions_df = pd.concat([positions_df, temp], ignore_index=True)
-        return positions_df
-
-    def get_portfolio(self):
-        for _ in range(2):
-            try:
-                return self.trade_api.query_stock_asset(self.acc)
-            except Exception as e:
-                log.info(f"Error get_portfolio: {e}")
-                try:
-                    self.connect_trade_api()  # 重新连接TradeAPI
-                except TradeConnectionError as conn_err:
-                    log.error(f"交易接口重连失败: {conn_err}")
+        return self.get_position_table().to_dataframe()
 
-    def trade_buy(self, symbol, cur_price, value, price_type=0, record=1):
+    def get_portfolio(self, live=False):
+        """获取资金
+        live: True时直接查询柜台；默认读取内存快照，快照超过 STATE_MAX_AGE 秒未对账时回退到实时查询
+        """
+        if not live:
+            asset = self.state.get_asset(config.trade.state_max_age)
+            if asset is not None:
+                return asset
+            log.info(f"{self.account_id} 资金快照已过期，回退实时查询")
+        asset = self._query_portfolio()
+        return self.state.replace_asset(asset) if asset is not None else None
+
+    def _query_portfolio(self):
+        """实时查询柜台资金，返回XtAsset"""
+        return self._broker_call(PRIORITY_QUERY, 'query_stock_asset', self.acc)
+
+    def trade_buy(self, symbol, cur_price, value, price_type=0, record=1, submit_mode='sync'):
         try:
             strategy_name = f"quant_{self.quant_code}"
             _portfolio = self.get_portfolio()
@@ -404,30 +563,23 @@ class MyTradeAPIWrapper:
             order_num = math.floor(value / cur_price / 100) * 100
             log.info(f"{strategy_name} buy {symbol} {order_num}")
             if order_num > 0:
-                for _ in range(3):
-                    try:
-                        return self.order_dif_type(cur_price, order_num, price_type, strategy_name, symbol)
-                    except Exception as e:
-                        msg = f"{self.account_id} order retry {_} TradeAPI Error"
-                        send_msg(msg)
-                        log.error(msg + f"e: {e}")
-                        try:
-                            self.connect_trade_api()  # 重新连接TradeAPI
-                        except TradeConnectionError as conn_err:
-                            log.error(f"交易接口重连失败: {conn_err}")
-                        if _ == 2:  # 最后一次重试失败
-                            return {
-                                'success': False,
-                                'symbol': symbol,
-                                'order_num': order_num,
-                                'price': cur_price,
-                                'error': str(e),
-                                'message': f'买入订单提交失败: {symbol} {order_num}股 @{cur_price}, 错误: {str(e)}'
-                            }
-                        continue
-                if record == 1:
-                    # self._record_trade(symbol, order_num, cur_price)
-                    pass
+                try:
+                    return self.order_dif_type(cur_price, order_num, price_type, strategy_name, symbol,
+                                               submit_mode=submit_mode)
+                except TradeQueueFullError:
+                    raise
+                except Exception as e:
+                    msg = f"{self.account_id} order TradeAPI Error"
+                    send_msg(msg, PRIORITY_ERROR)
+                    log.error(msg + f"e: {e}")
+                    return {
+                        'success': False,
+                        'symbol': symbol,
+                        'order_num': order_num,
+                        'price': cur_price,
+                        'error': str(e),
+                        'message': f'买入订单提交失败: {symbol} {order_num}股 @{cur_price}, 错误: {str(e)}'
+                    }
             else:
                 if value > available_cash:
                     log.info(f"{self.account_id} money={value} not enough")
@@ -450,6 +602,8 @@ class MyTradeAPIWrapper:
                         'message': f'指定仓位资金不足: 最低100股需要:{cur_price * 100:.2f}, 当前可用:{available_cash}'
                     }
 
+        except TradeQueueFullError:
+            raise
         except Exception as e:
             log.error(traceback.format_exc())
             return {
@@ -461,7 +615,8 @@ class MyTradeAPIWrapper:
                 'message': f'买入操作异常: {str(e)}'
             }
 
-    def order_dif_type(self, cur_price, order_num, price_type, strategy_name, symbol, order_type=xtconstant.STOCK_BUY):
+    def order_dif_type(self, cur_price, order_num, price_type, strategy_name, symbol, order_type=xtconstant.STOCK_BUY,
+                       submit_mode='sync', timeout=None):
         """
         根据不同的价格类型进行下单
 
@@ -472,41 +627,44 @@ class MyTradeAPIWrapper:
             strategy_name (str): 策略名称
             symbol (str): 证券代码，格式如 '600000.SH' 或 '000001.SZ'
             order_type: int: 订单类型，xtconstant.STOCK_BUY 或 xtconstant.STOCK_SELL
+            submit_mode (str): 提交方式
+                sync: 同步调用order_stock，等待柜台返回order_id
+                async: 调用order_stock_async，立即返回请求序号seq，委托结果通过回调推送
+                async_wait: 调用order_stock_async，等待回报最多timeout秒（默认ASYNC_ORDER_TIMEOUT）
+            timeout (float): async_wait模式的等待时间
 
         Returns:
             dict: 包含下单结果的字典
         """
         order_result = None
-        price_type_map = {
-            # 指定价格下单
-            0: (xtconstant.FIX_PRICE, cur_price),
-            # 最新价下单
-            1: (xtconstant.LATEST_PRICE, 0),
-            # 最优五档即时成交剩余撤销
-            2: (
-                xtconstant.MARKET_SH_CONVERT_5_CANCEL if symbol.endswith(
-                    "SH") else xtconstant.MARKET_SZ_CONVERT_5_CANCEL,
-                0),
-            # 本方最优价格委托，买入时买一 卖出时卖一
-            3: (xtconstant.MARKET_MINE_PRICE_FIRST, 0),
-            # 对方最优价格委托，买入时卖一 卖出时买一
-            5: (xtconstant.MARKET_PEER_PRICE_FIRST, 0)
-        }
-
-        if price_type not in price_type_map:
+        price_args = order_price_args(price_type, symbol, cur_price)
+        if price_args is None:
             return {
                 'success': False,
                 'message': f'错误：不支持的价格类型 {price_type}'
             }
 
-        order_price_type, order_price = price_type_map[price_type]
+        order_price_type, order_price = price_args
+
+        if submit_mode in ('async', 'async_wait'):
+            return self._order_async(cur_price, order_num, order_price_type, order_price, strategy_name, symbol,
+                                     order_type, wait=submit_mode == 'async_wait', timeout=timeout)
+        if submit_mode != 'sync':
+            return {
+                'success': False,
+                'message': f'错误：不支持的提交方式 {submit_mode}'
+            }
 
         # 统一的下单逻辑
         try:
-            order_result = self.trade_api.order_stock(
-                self.acc, symbol, order_type, order_num,
+            order_result = self._broker_call(
+                PRIORITY_ORDER, 'order_stock', self.acc, symbol, order_type, order_num,
                 order_price_type, order_price, strategy_name
             )
+        except TradeQueueFullError:
+            raise
+        except BrokerCallInFlightError as e:
+            return self._in_flight_result(symbol, order_num, cur_price, e)
         except Exception as e:
             return {
                 'success': False,
@@ -534,7 +692,91 @@ class MyTradeAPIWrapper:
             'message': f'{"买入" if order_type == xtconstant.STOCK_BUY else "卖出"}限价单提交成功: {symbol} {order_num}股 @{cur_price}, OrderID: {order_result}'
         }
 
-    def trade_buy_shares(self, symbol, cur_price, shares, price_type=0, record=1):
+    def _order_async(self, cur_price, order_num, order_price_type, order_price, strategy_name, symbol, order_type,
+                     wait=False, timeout=None):
+        """通过order_stock_async提交委托，按seq关联回调中的委托结果"""
+        result, future = self._submit_async(cur_price, order_num, order_price_type, order_price, strategy_name,
+                                            symbol, order_type)
+        if not wait or future is None:
+            return result
+        if timeout is None:
+            timeout = config.trade.async_order_timeout
+        return self._wait_async(result, future, order_type, timeout)
+
+    def _submit_async(self, cur_price, order_num, order_price_type, order_price, strategy_name, symbol, order_type):
+        """提交异步委托，返回 (结果字典, 委托回报Future)，提交失败时Future为None"""
+        side = "买入" if order_type == xtconstant.STOCK_BUY else "卖出"
+        try:
+            seq = self._broker_call(
+                PRIORITY_ORDER, 'order_stock_async', self.acc, symbol, order_type, order_num,
+                order_price_type, order_price, strategy_name, ''
+            )
+        except TradeQueueFullError:
+            raise
+        except BrokerCallInFlightError as e:
+            return self._in_flight_result(symbol, order_num, cur_price, e), None
+        except Exception as e:
+            return {
+                'success': False,
+                'message': f'下单时发生异常: {e}'
+            }, None
+
+        if not seq or seq < 0:
+            return {
+                'success': False,
+                'symbol': symbol,
+                'order_num': order_num,
+                'price': cur_price,
+                'message': f'{side}订单异步提交失败: {symbol} {order_num}股 @{cur_price}'
+            }, None
+
+        future = self.callback.track_async_order(seq)
+        return {
+            'success': True,
+            'symbol': symbol,
+            'order_num': order_num,
+            'price': cur_price,
+            'value': order_num * cur_price,  # 注意：这是委托价值，非成交价值
+            'seq': seq,
+            'order_id': None,
+            'message': f'{side}订单已异步提交: {symbol} {order_num}股 @{cur_price}, Seq: {seq}'
+        }, future
+
+    @staticmethod
+    def _in_flight_result(symbol, order_num, cur_price, error):
+        """柜台下单调用超时但已在执行：委托可能已提交，标记pending，由调用方查询委托确认"""
+        log.error(f"下单结果未知: {symbol} {order_num}股 @{cur_price}, {error}")
+        return {
+            'success': False,
+            'pending': True,
+            'symbol': symbol,
+            'order_num': order_num,
+            'price': cur_price,
+            'order_id': None,
+            'message': f'下单结果未知，委托可能已提交，请查询委托确认: {symbol} {order_num}股 @{cur_price}, {error}'
+        }
+
+    @staticmethod
+    def _wait_async(result, future, order_type, timeout):
+        """等待异步委托回报最多timeout秒，把order_id或拒绝原因写回结果字典"""
+        side = "买入" if order_type == xtconstant.STOCK_BUY else "卖出"
+        symbol, order_num, cur_price, seq = result['symbol'], result['order_num'], result['price'], result['seq']
+        try:
+            order_id = future.result(timeout=timeout)
+        except FutureTimeoutError:
+            result['pending'] = True
+            result['message'] = f'{side}订单已异步提交，{timeout}秒内未收到委托回报: {symbol} {order_num}股 @{cur_price}, Seq: {seq}'
+            return result
+        except OrderRejectedError as e:
+            result['success'] = False
+            result['message'] = f'{side}订单被拒绝: {symbol} {order_num}股 @{cur_price}, Seq: {seq}, 错误: {e}'
+            return result
+
+        result['order_id'] = order_id
+        result['message'] = f'{side}限价单提交成功: {symbol} {order_num}股 @{cur_price}, OrderID: {order_id}'
+        return result
+
+    def trade_buy_shares(self, symbol, cur_price, shares, price_type=0, record=1, submit_mode='sync'):
         """按固定股数买入股票"""
         try:
             strategy_name = f"quant_{self.quant_code}"
@@ -565,34 +807,30 @@ class MyTradeAPIWrapper:
             value = order_num * cur_price
 
             if order_num > 0:
-                for _ in range(3):
-                    try:
-                        order_result = self.order_dif_type(cur_price, order_num, price_type, strategy_name, symbol)
-
-                        if record == 1:
-                            # self._record_trade(symbol, order_num, cur_price)
-                            pass
-
-                        return order_result
-                    except Exception as e:
-                        msg = f"{self.account_id} order retry {_} TradeAPI Error"
-                        send_msg(msg)
-                        log.error(msg + f"e: {e}")
-                        try:
-                            self.connect_trade_api()
-                        except TradeConnectionError as conn_err:
-                            log.error(f"交易接口重连失败: {conn_err}")
-                        if _ == 2:  # 最后一次重试失败
-                            return {
-                                'success': False,
-                                'symbol': symbol,
-                                'order_num': order_num,
-                                'price': cur_price,
-                                'value': value,
-                                'order_result': None,
-                                'message': f'买入失败，重试3次后仍然失败: {str(e)}'
-                            }
-                        continue
+                try:
+                    order_result = self.order_dif_type(cur_price, order_num, price_type, strategy_name, symbol,
+                                                       submit_mode=submit_mode)
+
+                    if record == 1:
+                        # self._record_trade(symbol, order_num, cur_price)
+                        pass
+
+                    return order_result
+                except TradeQueueFullError:
+                    raise
+                except Exception as e:
+                    msg = f"{self.account_id} order TradeAPI Error"
+                    send_msg(msg, PRIORITY_ERROR)
+                    log.error(msg + f"e: {e}")
+                    return {
+                        'success': False,
+                        'symbol': symbol,
+                        'order_num': order_num,
+                        'price': cur_price,
+                        'value': value,
+                        'order_result': None,
+                        'message': f'买入失败: {str(e)}'
+                    }
             else:
                 log.info(f"{self.account_id} 股数={shares} 不足100股")
                 return {
@@ -604,6 +842,8 @@ class MyTradeAPIWrapper:
                     'order_result': None,
                     'message': f'股数不足100股: {shares}'
                 }
+        except TradeQueueFullError:
+            raise
         except Exception as e:
             log.error(traceback.format_exc())
             return {
@@ -624,11 +864,11 @@ class MyTradeAPIWrapper:
         value = self.get_portfolio().cash
         order_num = math.floor(value / 100 / 10) * 10
         if order_num > 0:
-            self.trade_api.order_stock(self.acc, "131810.SZ", xtconstant.STOCK_SELL, order_num, xtconstant.LATEST_PRICE,
-                                       0)
+            self._broker_call(PRIORITY_ORDER, 'order_stock', self.acc, "131810.SZ", xtconstant.STOCK_SELL, order_num,
+                              xtconstant.LATEST_PRICE, 0)
             # self.trade_api.order("131990.SH", -order_num, 1)
 
-    def trade_sell(self, symbol, cur_price, order_num, price_type=0):
+    def trade_sell(self, symbol, cur_price, order_num, price_type=0, submit_mode='sync'):
         """执行卖出操作，并更新持仓"""
         try:  # 不让账户相互之间有冲突，比如登录失效不影响下面的
             log.info("%s sell %s %s %s" % (self.account_id, symbol, cur_price, order_num))
@@ -643,7 +883,8 @@ class MyTradeAPIWrapper:
                 log.info("%s: do sell %s %s %s" % (self.account_id, symbol, cur_price, order_num))
                 if order_num >= 100:
                     value = order_num * cur_price
-                    order_result = self.order_dif_type(cur_price, order_num, price_type, f"quant_{self.quant_code}", symbol, xtconstant.STOCK_SELL)
+                    order_result = self.order_dif_type(cur_price, order_num, price_type, f"quant_{self.quant_code}", symbol, xtconstant.STOCK_SELL,
+                                                       submit_mode=submit_mode)
 
                     return order_result
                 else:
@@ -667,6 +908,8 @@ class MyTradeAPIWrapper:
                     'order_result': None,
                     'message': f'未持有该股票: {symbol}'
                 }
+        except TradeQueueFullError:
+            raise
         except Exception as e:
             log.error(traceback.format_exc())
             return {
@@ -679,29 +922,314 @@ class MyTradeAPIWrapper:
                 'message': f'卖出异常: {str(e)}'
             }
 
+    def trade_batch(self, operation, legs, submit_mode='async_wait', timeout=None):
+        """批量下单：一次资金/持仓快照，按快照计算所有标的的委托数量后一起提交
+
+        operation: buy 或 sell
+        legs: [{'symbol', 'price', 'position_pct' 或 'shares', 'price_type'}]
+            买入 position_pct 为总资产比例，卖出 position_pct 为可用持仓比例
+        submit_mode: sync逐笔同步提交；async/async_wait先全部异步提交，async_wait再统一等待回报
+        timeout: async_wait模式下整批的等待时间，默认ASYNC_ORDER_TIMEOUT
+
+        买入时可用资金在各标的之间依次预留，不会超额委托；卖出时同一标的多次出现也不会超过可用数量。
+        """
+        is_buy = operation == 'buy'
+        order_type = xtconstant.STOCK_BUY if is_buy else xtconstant.STOCK_SELL
+        strategy_name = f"quant_{self.quant_code}"
+        start_ts = time.perf_counter()
+
+        if is_buy:
+            _portfolio = self.get_portfolio()
+            total_value = _portfolio.total_asset
+            available_cash = _portfolio.cash
+        else:
+            _p = self.get_position()
+            available_volume = {code: pos.can_use_volume for code, pos in _p.items()}
+
+        # 按快照计算每笔委托数量
+        results = [None] * len(legs)
+        orders = []
+        for i, leg in enumerate(legs):
+            symbol = symbol_convert(leg['symbol'])
+            price = leg['price']
+            price_type = leg.get('price_type', 0)
+            shares = leg.get('shares')
+            if is_buy and price <= 0:
+                # 买入数量按价格计算，没有有效价格时无法下单
+                results[i] = {'success': False, 'symbol': symbol, 'order_num': 0, 'price': price,
+                              'message': f'价格无效: {symbol} @{price}'}
+                continue
+            if is_buy:
+                value = shares * price if shares is not None else total_value * leg['position_pct']
+                value = min(value, available_cash)
+                order_num = math.floor(value / price / 100) * 100
+                message = f'资金不足: 可用{available_cash:.2f}, 最低100股需要{price * 100:.2f}'
+            else:
+                can_use = available_volume.get(symbol, 0)
+                if shares is not None:
+                    order_num = min(int(shares), can_use)
+                else:
+                    order_num = min(int(can_use * leg['position_pct']), can_use)
+                # 清仓允许零股，否则按整手
+                if order_num < can_use:
+                    order_num = int(order_num / 100) * 100
+                message = f'未持有该股票: {symbol}' if symbol not in available_volume else f'可卖数量不足: 可用{can_use}'
+            if order_num <= 0:
+                results[i] = {'success': False, 'symbol': symbol, 'order_num': 0, 'price': price, 'message': message}
+                continue
+            if is_buy:
+                available_cash -= order_num * price
+            else:
+                available_volume[symbol] -= order_num
+            orders.append((i, symbol, price, price_type, int(order_num)))
+        plan_ms = (time.perf_counter() - start_ts) * 1000
+
+        submitted = self._submit_orders([order[1:] for order in orders], order_type, strategy_name, submit_mode,
+                                        timeout)
+        for (i, *_), result in zip(orders, submitted):
+            results[i] = result
+
+        succeeded = sum(1 for r in results if r.get('success'))
+        side = "买入" if is_buy else "卖出"
+        summary = f"{self.account_id} 批量{side} {succeeded}/{len(legs)} 笔提交成功"
+        send_msg(summary + "\n" + "\n".join(r.get('message', '') for r in results), PRIORITY_FILL)
+        return {
+            'success': succeeded > 0,
+            'operation': operation,
+            'legs': results,
+            'submitted': succeeded,
+            'plan_ms': round(plan_ms, 3),
+            'elapsed_ms': round((time.perf_counter() - start_ts) * 1000, 3),
+            'message': summary
+        }
+
+    def rebalance(self, target_weights, prices=None, price_type=0, dry_run=False, cash_buffer=0.0,
+                  submit_mode='async_wait', timeout=None):
+        """按目标权重调仓
+
+        target_weights: {symbol: 权重}，未列出的持仓视为目标权重0（清仓）
+        prices: {symbol: 委托价格}，缺少的从实时行情取最新价
+        dry_run: True时只返回计划委托和计算耗时，不下单
+        cash_buffer: 预留资金比例
+        submit_mode: 参见order_dif_type；先卖后买，同一方向的委托一起提交
+
+        资金/持仓只取一次快照，买卖数量由rebalance.plan_rebalance一次向量化计算得出。
+        买入只用当前可用资金，卖出回款尚未到账；资金不足时buy_scale<1，卖出成交后再次调用补足买入。
+        """
+        start_ts = time.perf_counter()
+        targets = {symbol_convert(s): float(w) for s, w in target_weights.items()}
+        prices = {symbol_convert(s): float(p) for s, p in (prices or {}).items()}
+        _portfolio = self.get_portfolio()
+        _p = self.get_position()
+
+        symbols = list(dict.fromkeys(list(_p) + list(targets)))
+        missing = [s for s in symbols
+                   if s not in prices and (targets.get(s, 0) > 0 or (s in _p and _p[s].can_use_volume > 0))]
+        if missing:
+            for s, tick in qmt_data.get_full_tick(missing).items():
+                if tick and tick.get('lastPrice'):
+                    prices[s] = float(tick['lastPrice'])
+
+        volume = np.fromiter((_p[s].volume if s in _p else 0 for s in symbols), dtype=np.int64, count=len(symbols))
+        can_use = np.fromiter((_p[s].can_use_volume if s in _p else 0 for s in symbols), dtype=np.int64,
+                              count=len(symbols))
+        price_arr = np.fromiter((prices.get(s, 0.0) for s in symbols), dtype=np.float64, count=len(symbols))
+        weights = np.fromiter((targets.get(s, 0.0) for s in symbols), dtype=np.float64, count=len(symbols))
+
+        compute_start = time.perf_counter()
+        plan = plan_rebalance(symbols, volume, can_use, price_arr, weights, _portfolio.total_asset, _portfolio.cash,
+                              cash_buffer=cash_buffer)
+        compute_ms = (time.perf_counter() - compute_start) * 1000
+
+        sell_idx = np.flatnonzero(plan['sell_volume'])
+        buy_idx = np.flatnonzero(plan['buy_volume'])
+        sells = [(symbols[i], float(price_arr[i]), price_type, int(plan['sell_volume'][i])) for i in sell_idx]
+        buys = [(symbols[i], float(price_arr[i]), price_type, int(plan['buy_volume'][i])) for i in buy_idx]
+        result = {
+            'success': True,
+            'dry_run': dry_run,
+            'total_asset': _portfolio.total_asset,
+            'cash': _portfolio.cash,
+            'buy_scale': round(plan['buy_scale'], 6),
+            'sell_amount': round(plan['sell_amount'], 2),
+            'buy_amount': round(plan['buy_amount'], 2),
+            'no_price': [s for s in symbols if prices.get(s, 0) <= 0],
+            'plan': [{'symbol': symbols[i], 'side': side, 'order_num': int(plan[f'{side}_volume'][i]),
+                      'price': float(price_arr[i]), 'current_volume': int(volume[i]),
+                      'target_volume': int(plan['target_volume'][i])}
+                     for side, idx in (('sell', sell_idx), ('buy', buy_idx)) for i in idx],
+            'compute_ms': round(compute_ms, 3),
+        }
+        if dry_run:
+            result['elapsed_ms'] = round((time.perf_counter() - start_ts) * 1000, 3)
+            result['message'] = f"{self.account_id} 调仓计划: 卖出{len(sells)}笔, 买入{len(buys)}笔"
+            return result
+
+        strategy_name = f"quant_{self.quant_code}"
+        # 先卖后买，同一方向的委托一起异步提交；买入数量已按可用资金计算，不依赖卖出回款
+        result['sells'] = self._submit_orders(sells, xtconstant.STOCK_SELL, strategy_name, submit_mode, timeout)
+        result['buys'] = self._submit_orders(buys, xtconstant.STOCK_BUY, strategy_name, submit_mode, timeout)
+        sold = sum(1 for r in result['sells'] if r.get('success'))
+        bought = sum(1 for r in result['buys'] if r.get('success'))
+        result['success'] = sold + bought == len(sells) + len(buys)
+        result['elapsed_ms'] = round((time.perf_counter() - start_ts) * 1000, 3)
+        result['message'] = f"{self.account_id} 调仓完成: 卖出{sold}/{len(sells)}笔, 买入{bought}/{len(buys)}笔"
+        send_msg(result['message'] + "\n" + "\n".join(r.get('message', '')
+                                                      for r in result['sells'] + result['buys']), PRIORITY_FILL)
+        return result
+
+    def _submit_orders(self, orders, order_type, strategy_name, submit_mode='async_wait', timeout=None):
+        """提交一组同方向委托，按输入顺序返回结果
+
+        orders: [(symbol, price, price_type, order_num)]
+        submit_mode: sync逐笔同步提交；async/async_wait先全部异步提交，async_wait再在同一期限内等待全部回报
+        """
+        results = [None] * len(orders)
+        pending = []
+        for i, (symbol, price, price_type, order_num) in enumerate(orders):
+            if submit_mode == 'sync':
+                results[i] = self.order_dif_type(price, order_num, price_type, strategy_name, symbol, order_type,
+                                                 submit_mode='sync')
+                continue
+            price_args = order_price_args(price_type, symbol, price)
+            if price_args is None:
+                results[i] = {'success': False, 'symbol': symbol, 'order_num': order_num, 'price': price,
+                              'message': f'错误：不支持的价格类型 {price_type}'}
+                continue
+            results[i], future = self._submit_async(price, order_num, price_args[0], price_args[1], strategy_name,
+                                                    symbol, order_type)
+            if future is not None:
+                pending.append((i, future))
+
+        # 整批共用一个等待期限
+        if submit_mode == 'async_wait' and pending:
+            if timeout is None:
+                timeout = config.trade.async_order_timeout
+            deadline = time.time() + timeout
+            for i, future in pending:
+                results[i] = self._wait_async(results[i], future, order_type, max(deadline - time.time(), 0))
+        return results
+
     def cancel_all_orders_sale(self):
-        self.cancel_all_orders(xtconstant.STOCK_SELL)
+        return self.cancel_all_orders(xtconstant.STOCK_SELL)
 
     def cancel_all_orders_buy(self):
-        self.cancel_all_orders(xtconstant.STOCK_BUY)
+        return self.cancel_all_orders(xtconstant.STOCK_BUY)
 
     def cancel_all_orders(self, sideType):
-        self.query_orders()
-        for order in self.trade_api.query_stock_orders(self.acc, cancelable_only=True):
-            order_id = order.order_id
-            status = order.order_status
-            order_type = order.order_type
-            if order_type == sideType and status in [xtconstant.ORDER_REPORTED, xtconstant.ORDER_PART_SUCC]:
-                log.info("cancel_order %s" % (order_id))
-                result = self.trade_api.cancel_order_stock(self.acc, order_id)
-                send_msg(f"撤单 {self.account_id} {order} {'成功' if result == 0 else '失败'}")
+        return self.bulk_cancel(side='buy' if sideType == xtconstant.STOCK_BUY else 'sell')
+
+    def bulk_cancel(self, side=None, symbols=None, strategy_name=None, min_age=None, price_min=None, price_max=None,
+                    timeout=None):
+        """批量撤单：按条件筛选委托簿中的可撤委托，全部异步撤单后统一等待确认
+
+        side: buy 或 sell
+        symbols: 股票代码列表
+        strategy_name: 策略名称
+        min_age: 只撤委托时间早于min_age秒之前的委托
+        price_min/price_max: 委托价格区间
+        timeout: 等待撤单确认的时间，默认ASYNC_ORDER_TIMEOUT
+
+        Returns:
+            dict: results为逐笔撤单结果，outcome取值 cancelled/partial_cancelled/filled/junk/rejected/failed/timeout
+        """
+        start_ts = time.perf_counter()
+        if timeout is None:
+            timeout = config.trade.async_order_timeout
+        symbol_set = {symbol_convert(s) for s in symbols} if symbols else None
+        now = time.time()
+        matched = [
+            record for record in self._get_order_book().query(side=side, strategy_name=strategy_name,
+                                                               cancelable_only=True)
+            if (symbol_set is None or record.symbol in symbol_set)
+               and (min_age is None or now - record.time >= min_age)
+               and (price_min is None or record.price >= price_min)
+               and (price_max is None or record.price <= price_max)
+        ]
+
+        # 先登记再撤单，避免状态推送先于登记到达
+        # 队列满后剩余委托不再提交，记为rejected，已提交的撤单照常等待确认
+        pending = []
+        results = {}
+        queue_full = False
+        for record in matched:
+            future, created = self.callback.track_cancel(record.order_id)
+            if not created:
+                # 其他批量撤单已在等待该委托的撤单结果，不重复撤单，共用结果
+                pending.append((record, future))
+                continue
+            if queue_full:
+                self.callback.resolve_cancel(record.order_id, 'rejected', '柜台请求队列已满，未提交')
+                pending.append((record, future))
+                continue
+            try:
+                seq = self._broker_call(PRIORITY_CANCEL, 'cancel_order_stock_async', self.acc, record.order_id)
+            except TradeQueueFullError as e:
+                queue_full = True
+                self.callback.resolve_cancel(record.order_id, 'rejected', str(e))
+                pending.append((record, future))
+                continue
+            except BrokerCallInFlightError:
+                pass  # 撤单请求可能已发出，等待撤单确认，超时记为timeout
+            except Exception as e:
+                self.callback.resolve_cancel(record.order_id, 'failed', f'撤单时发生异常: {e}')
+            else:
+                if seq is None or seq < 0:
+                    self.callback.resolve_cancel(record.order_id, 'failed', f'撤单请求提交失败 {seq}')
+            # 撤单前委托已到达终态
+            current = self.order_book.get(record.order_id)
+            if current is not None and current.status in CANCEL_OUTCOMES:
+                self.callback.resolve_cancel(record.order_id, CANCEL_OUTCOMES[current.status],
+                                             ORDER_STATUS_MAP.get(current.status, ''))
+            pending.append((record, future))
+
+        deadline = time.time() + timeout
+        for record, future in pending:
+            try:
+                outcome, message = future.result(timeout=max(deadline - time.time(), 0))
+            except FutureTimeoutError:
+                self.callback.discard_cancel(record.order_id, future)
+                outcome, message = 'timeout', f'{timeout}秒内未收到撤单确认'
+            results[record.order_id] = {
+                'order_id': record.order_id,
+                'symbol': record.symbol,
+                'side': record.side,
+                'price': record.price,
+                'volume': record.volume,
+                'outcome': outcome,
+                'message': message,
+            }
+
+        outcomes = [r['outcome'] for r in results.values()]
+        cancelled = sum(1 for o in outcomes if o in ('cancelled', 'partial_cancelled'))
+        wall_ms = round((time.perf_counter() - start_ts) * 1000, 3)
+        summary = f"撤单 {self.account_id} 匹配{len(matched)}笔, 撤销{cancelled}笔, 耗时{wall_ms}ms"
+        if matched:
+            send_msg(summary)
+        log.info(summary)
+        return {
+            'success': all(o not in ('rejected', 'failed', 'timeout') for o in outcomes),
+            'matched': len(matched),
+            'cancelled': cancelled,
+            'results': list(results.values()),
+            'wall_ms': wall_ms,
+            'message': summary
+        }
 
     def cancel_order(self, order_id):
         """
         撤单
         order_id: 委托单号
         """
-        result = self.trade_api.cancel_order_stock(self.acc, order_id)
+        try:
+            result = self._broker_call(PRIORITY_CANCEL, 'cancel_order_stock', self.acc, order_id)
+        except BrokerCallInFlightError as e:
+            return {
+                'success': False,
+                'pending': True,
+                'order_id': order_id,
+                'message': f'撤单结果未知，请查询委托确认: OrderID {order_id}, {e}'
+            }
         if result == 0:
             return {
                 'success': True,
@@ -715,50 +1243,55 @@ class MyTradeAPIWrapper:
                 'message': f'撤单失败: OrderID {order_id}'
             }
 
-    def query_orders(self, cancelable_only=False):
-        """
-        查询委托单
-        status: 委托状态，参见数据字典，默认查询所有状态的委托单
-        """
-        orders = self.trade_api.query_stock_orders(self.acc, cancelable_only)
-        return [
-            {
-                'order_id': order.order_id,
-                'symbol': order.stock_code,
-                'side': 'buy' if order.order_type == xtconstant.STOCK_BUY else 'sell',
-                'status': order.order_status,
-                'm_status': ORDER_STATUS_MAP.get(order.order_status),
-                'volume': order.order_volume,
-                'time': order.order_time,
-                'price': order.price,
-                'price_type': order.price_type,
-                'traded_volume': order.traded_volume,
-                'traded_price': order.traded_price,
-                'strategy_name': order.strategy_name
-            }
-            for order in orders
-        ]
+    def _sync_orders(self):
+        """查询柜台当日全部委托，增量同步到委托簿"""
+        orders = self._broker_call(PRIORITY_QUERY, 'query_stock_orders', self.acc, False)
+        changed = self.order_book.sync(orders or [])
+        if changed:
+            log.info(f"{self.account_id} 委托簿同步 {changed} 笔变化")
+
+    def _get_order_book(self):
+        """返回委托簿，超过 STATE_MAX_AGE 秒未同步时先同步一次"""
+        if not self.order_book.is_fresh(config.trade.state_max_age):
+            log.info(f"{self.account_id} 委托簿已过期，回退实时查询")
+            try:
+                self._sync_orders()
+            except TradeConnectionError:
+                if not len(self.order_book):
+                    raise
+                log.info(f"{self.account_id} 交易连接不可用，使用委托簿现有数据（事件日志回放或最近一次同步）")
+        return self.order_book
+
+    def query_orders(self, cancelable_only=False, symbol=None, side=None, status=None, strategy_name=None):
+        """
+        查询委托单（内存委托簿）
+        cancelable_only: 只返回可撤委托
+        symbol/side/status/strategy_name: 可选筛选条件，side为buy或sell
+        """
+        if symbol is not None:
+            symbol = symbol_convert(symbol)
+        records = self._get_order_book().query(symbol=symbol, side=side, status=status,
+                                               strategy_name=strategy_name, cancelable_only=cancelable_only)
+        return [record.to_dict() for record in records]
 
     def query_order(self, order_id):
-        order = self.trade_api.query_stock_order(self.acc, order_id)
-        return {
-            'order_id': order.order_id,
-            'symbol': order.stock_code,
-            'side': 'buy' if order.order_type == xtconstant.STOCK_BUY else 'sell',
-            'status': order.order_status,
-            'm_status': ORDER_STATUS_MAP.get(order.order_status),
-            'volume': order.order_volume,
-            'time': order.order_time,
-            'price': order.price,
-            'price_type': order.price_type,
-            'traded_volume': order.traded_volume,
-            'traded_price': order.traded_price,
-            'strategy_name': order.strategy_name
-        }
-
-
-def send_msg(msg):
-    dingbot.send_text(msg, at_all=False)
+        order_id = int(order_id)
+        record = self._get_order_book().get(order_id)
+        if record is None:
+            # 委托簿中还没有（刚提交的委托回调未到），查询柜台后补入
+            order = self._broker_call(PRIORITY_QUERY, 'query_stock_order', self.acc, order_id)
+            if order is None:
+                return None
+            self.order_book.on_order(order)
+            record = self.order_book.get(order_id)
+        return record.to_dict()
+
+
+def send_msg(msg, priority=PRIORITY_INFO):
+    """后台发送钉钉通知，priority: PRIORITY_ERROR / PRIORITY_FILL / PRIORITY_INFO"""
+    if not notifier.notify(msg, priority):
+        log.warning(f"钉钉通知队列已满，丢弃消息: {msg}")
+        return
     log.info(f"dingbot send msg: {msg}")
 
 
@@ -0,0 +1,420 @@
+# -*- coding: utf-8 -*-
+"""
+实时行情表
+
+通过xtdata.subscribe_whole_quote订阅持仓、自选和最近查询过的标的，推送回调把最新tick写入
+预分配的NumPy结构化数组（按标的编号索引），同时保留推送的原始tick字典。get_full_tick返回原始字典
+（与xtdata.get_full_tick字段完全一致），内部取价和行情推送读结构化数组；两者都直接读内存，
+数据超过最大陈旧时间时回退到xtdata.get_full_tick拉取。
+重新订阅需要退订并重建整个全推订阅：持仓、自选和推送连接的标的变化立即生效，
+只因最近查询的标的增减时最多每resubscribe_interval秒批量生效一次，期间新标的按拉取服务。
+
+行情推送连接（TickSubscriber）按引用计数加入订阅集合，所有连接共用同一个全推订阅；
+推送回调只把有变化的标的记入各连接的待发集合，连接发送时读取行情表中的最新值，
+消费慢的连接拿到的是最新tick而不是积压的历史tick。
+"""
+import threading
+import time
+
+import numpy as np
+from xtquant import xtdata
+
+from logger_config import get_logger
+from config import get_config
+import symbol_util
+
+log = get_logger(__name__)
+
+DEPTH = 5  # 盘口档数
+
+# 字段名与xtdata.get_full_tick返回的字典一致
+TICK_FIELDS = (
+    ('time', np.int64),
+    ('lastPrice', np.float64),
+    ('open', np.float64),
+    ('high', np.float64),
+    ('low', np.float64),
+    ('lastClose', np.float64),
+    ('amount', np.float64),
+    ('volume', np.int64),
+    ('pvolume', np.int64),
+    ('stockStatus', np.int32),
+    ('openInt', np.int64),
+    ('lastSettlementPrice', np.float64),
+    ('settlementPrice', np.float64),
+    ('transactionNum', np.int64),
+    ('pe', np.float64),
+    ('volRatio', np.float64),
+    ('speed1Min', np.float64),
+    ('speedMinutes', np.float64),
+)
+DEPTH_FIELDS = (
+    ('askPrice', np.float64),
+    ('bidPrice', np.float64),
+    ('askVol', np.int64),
+    ('bidVol', np.int64),
+)
+TICK_DTYPE = np.dtype(list(TICK_FIELDS) + [(name, dtype, (DEPTH,)) for name, dtype in DEPTH_FIELDS]
+                      + [('recv_ts', np.float64)])
+
+_SCALAR_NAMES = [name for name, _ in TICK_FIELDS]
+_DEPTH_NAMES = [name for name, _ in DEPTH_FIELDS]
+
+
+TICK_FIELD_NAMES = _SCALAR_NAMES + _DEPTH_NAMES + ['timetag']
+
+
+def _depth(values):
+    values = list(values or ())[:DEPTH]
+    return values + [0] * (DEPTH - len(values))
+
+
+class TickSubscriber:
+    """单个行情推送连接：订阅的标的、字段投影和待发送的标的集合
+
+    同一标的在发送前多次推送只记一次（合并），发送时读取行情表中的最新值。
+    """
+
+    def __init__(self, symbols, fields=None):
+        self.symbols = frozenset(symbols)
+        self.fields = list(fields) if fields else list(TICK_FIELD_NAMES)
+        self._cond = threading.Condition()
+        self._pending = set()
+        self.conflated = 0  # 发送前被新推送覆盖的tick数
+
+    def mark(self, symbols):
+        """推送回调线程调用：记录有变化的标的"""
+        with self._cond:
+            self.conflated += len(self._pending.intersection(symbols))
+            self._pending.update(symbols)
+            self._cond.notify()
+
+    def wait(self, timeout):
+        """等待并取出待发送的标的，超时返回空集合"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._pending, timeout)
+            pending, self._pending = self._pending, set()
+            return pending
+
+
+class QuoteService:
+    """订阅驱动的最新行情表"""
+
+    def __init__(self, capacity=4096, max_age=3.0, recent_ttl=600.0, refresh_interval=5.0, watchlist=(),
+                 resubscribe_interval=60.0):
+        """
+        :param capacity: 预分配的标的行数，不够时按倍数扩容
+        :param max_age: 默认最大陈旧时间（秒），超过后回退到拉取
+        :param recent_ttl: 查询过的标的保持订阅的时间（秒）
+        :param refresh_interval: 重新计算订阅集合的间隔（秒）
+        :param watchlist: 常驻订阅的自选标的
+        :param resubscribe_interval: 只因最近查询的标的变化而重新订阅的最短间隔（秒）
+        """
+        self.max_age = max_age
+        self.recent_ttl = recent_ttl
+        self.refresh_interval = refresh_interval
+        self.resubscribe_interval = resubscribe_interval
+        self._lock = threading.Lock()
+        self._ticks = np.zeros(capacity, dtype=TICK_DTYPE)
+        self._timetags = np.empty(capacity, dtype=object)
+        self._raw = np.empty(capacity, dtype=object)  # 原始tick字典，get_full_tick按原样返回
+        self._index = {}  # 标的代码 -> 行号
+        self._watchlist = set(watchlist)
+        self._recent = {}  # 标的代码 -> 最近一次查询时间
+        self._sources = []  # 返回需要订阅的标的的回调，如各账户持仓
+        self._pinned = {}  # 推送连接订阅的标的 -> 连接数
+        self._watchers = {}  # 标的代码 -> 订阅该标的的TickSubscriber集合
+        self._refresh_lock = threading.Lock()
+        self._subscribed = frozenset()
+        self._subscribe_seq = None
+        self._subscribed_ts = 0.0  # 最近一次重新订阅的时间
+        self._deferred = 0  # 因批量间隔推迟的重新订阅次数
+        self._last_push_ts = 0.0  # 最近一次收到推送的时间，用于判断订阅是否仍在推送
+        self._hits = 0
+        self._pulls = 0
+        self._pushes = 0
+        self._stopped = threading.Event()
+        self._thread = None
+
+    # ---------- 写入 ----------
+
+    def _row(self, symbol):
+        """返回标的的行号，不存在时分配新行，调用方需持有锁"""
+        row = self._index.get(symbol)
+        if row is None:
+            row = len(self._index)
+            if row >= len(self._ticks):
+                ticks = np.zeros(len(self._ticks) * 2, dtype=TICK_DTYPE)
+                ticks[:row] = self._ticks
+                timetags = np.empty(len(ticks), dtype=object)
+                timetags[:row] = self._timetags
+                raw = np.empty(len(ticks), dtype=object)
+                raw[:row] = self._raw
+                self._ticks, self._timetags, self._raw = ticks, timetags, raw
+            self._index[symbol] = row
+        return row
+
+    def _write(self, datas, now):
+        with self._lock:
+            for symbol, tick in datas.items():
+                if not tick:
+                    continue
+                row = self._row(symbol)
+                self._ticks[row] = tuple([tick.get(name) or 0 for name in _SCALAR_NAMES]
+                                         + [_depth(tick.get(name)) for name in _DEPTH_NAMES] + [now])
+                self._timetags[row] = tick.get('timetag', '')
+                self._raw[row] = tick
+
+    def _on_quote(self, datas):
+        """subscribe_whole_quote推送回调，datas为 {标的代码: tick字典}"""
+        now = time.time()
+        try:
+            self._write(datas, now)
+        except Exception as e:
+            log.error(f"行情推送写入失败: {e}")
+            return
+        with self._lock:
+            self._pushes += len(datas)
+            self._last_push_ts = now
+        if self._watchers:
+            self._notify_watchers(datas)
+
+    def _notify_watchers(self, datas):
+        changed = {}
+        with self._lock:
+            for symbol in self._watchers.keys() & datas.keys():
+                for subscriber in self._watchers[symbol]:
+                    changed.setdefault(subscriber, []).append(symbol)
+        for subscriber, symbols in changed.items():
+            subscriber.mark(symbols)
+
+    # ---------- 订阅集合 ----------
+
+    def add_source(self, source):
+        """注册订阅来源，source()返回需要订阅的标的代码列表"""
+        self._sources.append(source)
+
+    def watch(self, symbols):
+        """加入常驻订阅的自选标的"""
+        with self._lock:
+            self._watchlist.update(symbols)
+
+    def _desired(self):
+        """返回 (必须订阅的标的, 最近查询的标的)"""
+        now = time.time()
+        symbols = set()
+        for source in self._sources:
+            try:
+                symbols.update(source())
+            except Exception as e:
+                log.warning(f"获取订阅标的失败: {e}")
+        with self._lock:
+            symbols |= self._watchlist
+            symbols.update(self._pinned)
+            for symbol in [s for s, ts in self._recent.items() if now - ts > self.recent_ttl]:
+                del self._recent[symbol]
+            recent = frozenset(s for s in self._recent if s)
+        return frozenset(s for s in symbols if s), recent
+
+    def refresh_subscriptions(self):
+        """订阅集合变化时重新订阅全推行情
+
+        必须订阅的标的（持仓、自选、推送连接）有新增时立即重新订阅；其余变化（最近查询的标的增减、
+        标的退出订阅）距上次重新订阅不足resubscribe_interval秒时推迟，合并到下一次。
+        """
+        with self._refresh_lock:
+            required, recent = self._desired()
+            desired = required | recent
+            if desired == self._subscribed:
+                return
+            if required <= self._subscribed and time.time() - self._subscribed_ts < self.resubscribe_interval:
+                with self._lock:
+                    self._deferred += 1
+                return
+            if self._subscribe_seq is not None:
+                try:
+                    xtdata.unsubscribe_quote(self._subscribe_seq)
+                except Exception as e:
+                    log.warning(f"取消行情订阅失败: {e}")
+                self._subscribe_seq = None
+            if desired:
+                self._subscribe_seq = xtdata.subscribe_whole_quote(sorted(desired), callback=self._on_quote)
+            with self._lock:
+                self._subscribed = desired
+                self._subscribed_ts = time.time()
+            log.info(f"行情订阅更新: {len(desired)}只标的")
+
+    # ---------- 推送连接 ----------
+
+    def open_stream(self, symbols, fields=None):
+        """建立推送连接：标的按引用计数加入订阅集合，有新标的时立即重新订阅"""
+        subscriber = TickSubscriber(symbols, fields)
+        with self._lock:
+            added = [s for s in subscriber.symbols if s not in self._subscribed]
+            for symbol in subscriber.symbols:
+                self._pinned[symbol] = self._pinned.get(symbol, 0) + 1
+                self._watchers.setdefault(symbol, set()).add(subscriber)
+        if added:
+            self.refresh_subscriptions()
+        return subscriber
+
+    def close_stream(self, subscriber):
+        """关闭推送连接；不再被引用的标的在下一轮订阅刷新时退订，连接短暂重连时不反复订阅"""
+        with self._lock:
+            for symbol in subscriber.symbols:
+                watchers = self._watchers.get(symbol)
+                if watchers is not None:
+                    watchers.discard(subscriber)
+                    if not watchers:
+                        del self._watchers[symbol]
+                count = self._pinned.get(symbol, 0) - 1
+                if count > 0:
+                    self._pinned[symbol] = count
+                else:
+                    self._pinned.pop(symbol, None)
+
+    def start(self):
+        if self._thread is not None:
+            return
+
+        def _loop():
+            while not self._stopped.is_set():
+                try:
+                    self.refresh_subscriptions()
+                except Exception as e:
+                    log.error(f"行情订阅刷新失败: {e}")
+                self._stopped.wait(self.refresh_interval)
+
+        self._thread = threading.Thread(target=_loop, name="quote-service", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._subscribe_seq is not None:
+            xtdata.unsubscribe_quote(self._subscribe_seq)
+            self._subscribe_seq = None
+
+    # ---------- 读取 ----------
+
+    def _fresh_rows(self, symbols, max_age):
+        """返回 ({标的: 行号}, 需要拉取的标的)，调用方需持有锁
+
+        已订阅的标的只要订阅仍在推送就视为最新（全推只推送有变化的标的），未订阅的标的按各自的写入时间判断。
+        """
+        now = time.time()
+        feed_alive = now - self._last_push_ts <= max_age
+        rows, stale = {}, []
+        for symbol in symbols:
+            self._recent[symbol] = now
+            row = self._index.get(symbol)
+            if row is not None and (now - self._ticks['recv_ts'][row] <= max_age
+                                    or (feed_alive and symbol in self._subscribed)):
+                rows[symbol] = row
+            else:
+                stale.append(symbol)
+        return rows, stale
+
+    def _pull(self, symbols):
+        """拉取并写入，返回拉取到数据的标的"""
+        datas = xtdata.get_full_tick(list(symbols))
+        self._write(datas, time.time())
+        return [s for s, tick in datas.items() if tick]
+
+    def _lookup(self, symbols, max_age):
+        max_age = self.max_age if max_age is None else max_age
+        with self._lock:
+            rows, stale = self._fresh_rows(symbols, max_age)
+            self._hits += len(rows)
+            self._pulls += len(stale)
+        if stale:
+            pulled = self._pull(stale)
+            with self._lock:
+                rows.update((s, self._index[s]) for s in pulled)
+        return rows
+
+    def get_ticks(self, symbols, max_age=None, fields=None):
+        """返回 {标的代码: tick字典}；没有行情的标的不在结果中
+
+        fields: 只返回这些字段（TICK_FIELD_NAMES的子集），从结构化数组读取；
+                为空时返回原始tick字典的副本，字段与xtdata.get_full_tick完全一致
+        """
+        rows = self._lookup(symbols, max_age)
+        if fields:
+            return self._records(rows, fields)
+        with self._lock:
+            return {symbol: dict(self._raw[row]) for symbol, row in rows.items()}
+
+    def read_ticks(self, symbols, fields=None):
+        """直接读取行情表中的当前值，不判断陈旧、不拉取，供推送连接使用"""
+        with self._lock:
+            rows = {s: self._index[s] for s in symbols if s in self._index}
+        return self._records(rows, fields)
+
+    def _records(self, rows, fields=None):
+        """按行号读取为 {标的代码: tick字典}，只取fields中的字段"""
+        fields = fields or TICK_FIELD_NAMES
+        names = [name for name in fields if name in TICK_DTYPE.names]
+        with_timetag = 'timetag' in fields
+        positions = list(rows.values())
+        with self._lock:
+            records = self._ticks[positions][names].tolist() if names else [()] * len(positions)
+            timetags = self._timetags[positions].tolist() if with_timetag else None
+        result = {}
+        for i, symbol in enumerate(rows):
+            tick = dict(zip(names, records[i]))
+            for name in _DEPTH_NAMES:
+                if name in tick:
+                    tick[name] = tick[name].tolist()
+            if with_timetag:
+                tick['timetag'] = timetags[i]
+            result[symbol] = tick
+        return result
+
+    def get_last_prices(self, symbols, max_age=None):
+        """返回 {标的代码: 最新价}"""
+        rows = self._lookup(symbols, max_age)
+        with self._lock:
+            prices = self._ticks['lastPrice'][list(rows.values())].tolist() if rows else []
+        return dict(zip(rows, prices))
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            return {
+                'symbols': len(self._index),
+                'capacity': len(self._ticks),
+                'subscribed': len(self._subscribed),
+                'recent': len(self._recent),
+                'hits': self._hits,
+                'pulls': self._pulls,
+                'pushes': self._pushes,
+                'deferred_resubscribes': self._deferred,
+                'streams': len({s for watchers in self._watchers.values() for s in watchers}),
+                'pinned': len(self._pinned),
+                'last_push_age': round(now - self._last_push_ts, 3) if self._last_push_ts else None,
+            }
+
+
+_quote_service = None
+_quote_service_lock = threading.Lock()
+
+
+def get_quote_service():
+    """返回全局行情表并启动订阅线程，QUOTE_SERVICE_ENABLED=false时返回None"""
+    global _quote_service
+    data_config = get_config().data
+    if not data_config.quote_enabled:
+        return None
+    with _quote_service_lock:
+        if _quote_service is None:
+            watchlist = [symbol_util.get_stock_id_xt(s.strip()) for s in data_config.quote_watchlist.split(',') if s.strip()]
+            _quote_service = QuoteService(
+                capacity=data_config.quote_capacity,
+                max_age=data_config.quote_max_age,
+                recent_ttl=data_config.quote_recent_ttl,
+                refresh_interval=data_config.quote_refresh_interval,
+                watchlist=watchlist,
+                resubscribe_interval=data_config.quote_resubscribe_interval,
+            )
+            _quote_service.start()
+        return _quote_service
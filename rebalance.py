@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+目标权重调仓计算
+
+在一次向量化的NumPy计算中根据持仓快照和目标权重得出每只股票的买卖数量，
+考虑整手、可用数量和资金约束。本模块只做计算，不访问柜台。
+"""
+import numpy as np
+
+LOT_SIZE = 100
+
+
+def plan_rebalance(symbols, volume, can_use_volume, prices, weights, total_asset, cash,
+                   lot_size=LOT_SIZE, cash_buffer=0.0):
+    """计算调仓委托数量
+
+    Args:
+        symbols: 股票代码数组，包含当前持仓和目标持仓的并集
+        volume: 当前持仓数量
+        can_use_volume: 当前可卖数量
+        prices: 委托价格
+        weights: 目标权重，不在目标中的持仓为0（清仓）
+        total_asset: 账户总资产
+        cash: 可用资金
+        lot_size: 每手股数
+        cash_buffer: 预留资金比例，目标市值按 total_asset * (1 - cash_buffer) 计算
+
+    Returns:
+        dict: 各字段均为与symbols等长的数组
+            target_volume: 目标持仓（整手）
+            sell_volume / buy_volume: 卖出、买入数量
+            buy_scale: 可用资金不足时买入数量的缩放比例（标量），卖出回款不计入
+            sell_amount / buy_amount: 卖出回款、买入金额（标量）
+    """
+    symbols = np.asarray(symbols)
+    volume = np.asarray(volume, dtype=np.int64)
+    can_use_volume = np.asarray(can_use_volume, dtype=np.int64)
+    prices = np.asarray(prices, dtype=np.float64)
+    weights = np.asarray(weights, dtype=np.float64)
+
+    valid_price = prices > 0
+    safe_prices = np.where(valid_price, prices, 1.0)
+    target_value = weights * total_asset * (1.0 - cash_buffer)
+    target_volume = np.where(valid_price, np.floor(target_value / safe_prices / lot_size) * lot_size, volume)
+    target_volume = target_volume.astype(np.int64)
+    diff = target_volume - volume
+
+    # 卖出：不超过可卖数量；清仓时允许卖出零股，其余按整手
+    sell_volume = np.minimum(np.maximum(-diff, 0), can_use_volume)
+    liquidate = (target_volume == 0) & (sell_volume == can_use_volume)
+    sell_volume = np.where(liquidate, sell_volume, sell_volume // lot_size * lot_size)
+    sell_amount = float(np.dot(sell_volume, prices))
+
+    # 买入：整手，只用当前可用资金；卖出回款要等成交后才到账，买入紧随卖出提交，不能计入预算，
+    # 资金不足时按比例缩减，剩余部分在卖出成交后再次调仓补足
+    buy_volume = np.maximum(diff, 0) // lot_size * lot_size
+    buy_amount = float(np.dot(buy_volume, prices))
+    budget = max(cash, 0.0)
+    buy_scale = 1.0
+    if buy_amount > budget:
+        buy_scale = budget / buy_amount if buy_amount > 0 else 0.0
+        buy_volume = np.floor(buy_volume * buy_scale / lot_size).astype(np.int64) * lot_size
+        buy_amount = float(np.dot(buy_volume, prices))
+
+    return {
+        'symbols': symbols,
+        'target_volume': target_volume,
+        'sell_volume': sell_volume,
+        'buy_volume': buy_volume,
+        'buy_scale': buy_scale,
+        'sell_amount': sell_amount,
+        'buy_amount': buy_amount,
+    }
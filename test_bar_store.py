@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+bar_store.BarStore 单元测试：covers/through的记录和与模拟xtdata的增量同步（不需要QMT终端）
+
+运行: python -m pytest -q test_bar_store.py
+"""
+import sys
+import types
+
+import numpy as np
+import pytest
+
+import bar_store
+from bar_cache import to_epoch_ms
+from bar_store import BarStore
+
+SYMBOL = '000001.SZ'
+
+
+def _bars(days, close=None):
+    index = np.array(days)
+    close = np.arange(len(days), dtype=np.float64) + 10 if close is None else np.asarray(close, dtype=np.float64)
+    return index, {'time': np.array([to_epoch_ms(day) for day in days], dtype=np.int64), 'close': close,
+                   'stockName': np.array(['平安银行'] * len(days))}
+
+
+@pytest.fixture
+def xtdata_bars(monkeypatch):
+    """模拟qmt_data.fetch_bars：返回 bars 中 [start, end] 区间的K线；downloads记录_download调用"""
+    state = types.SimpleNamespace(days=[], close=None, download_ok=True, downloads=[])
+
+    def fetch_bars(symbols, period, start_time, end_time, dividend_type, fill_data, download=True):
+        index, columns = _bars(state.days, state.close)
+        keep = np.array([start_time[:8] <= day <= end_time[:8] for day in state.days], dtype=bool)
+        return {symbols[0]: (index[keep], {name: col[keep] for name, col in columns.items()})}
+
+    def download(symbols, period, start_time, end_time):
+        state.downloads.append((start_time, end_time))
+        return state.download_ok
+
+    monkeypatch.setitem(sys.modules, 'qmt_data', types.SimpleNamespace(fetch_bars=fetch_bars))
+    monkeypatch.setattr(bar_store, '_download', download)
+    return state
+
+
+def test_write_covers_and_read(tmp_path):
+    store = BarStore(str(tmp_path))
+    start_ms = to_epoch_ms('20240102')
+    index, columns = _bars(['20240102', '20240103', '20240104'])
+    store.write(SYMBOL, '1d', 'none', index, columns, start_ms, '20240104')
+
+    assert store.covers(SYMBOL, '1d', 'none', start_ms, '20240104')
+    assert store.covers(SYMBOL, '1d', 'none', to_epoch_ms('20240103'), '20240103')
+    assert not store.covers(SYMBOL, '1d', 'none', start_ms, '20240105')
+    assert not store.covers(SYMBOL, '1d', 'none', to_epoch_ms('20240101'), '20240104')
+    assert not store.covers('600000.SH', '1d', 'none', start_ms, '20240104')
+    # 字符串列不入库
+    assert store.meta(SYMBOL, '1d', 'none')['fields'] == ['time', 'close']
+
+    index, columns = store.read(SYMBOL, '1d', 'none', start_ms=to_epoch_ms('20240103'))
+    assert index.tolist() == ['20240103', '20240104']
+    assert columns['close'].tolist() == [11.0, 12.0]
+    assert list(store.series()) == [(SYMBOL, '1d', 'none')]
+
+
+def test_append_keeps_latest_through(tmp_path):
+    store = BarStore(str(tmp_path))
+    index, columns = _bars(['20240102', '20240103'])
+    store.write(SYMBOL, '1d', 'none', index[:1], {k: v[:1] for k, v in columns.items()},
+                to_epoch_ms('20240102'), '20240102')
+    store.append(SYMBOL, '1d', 'none', index[1:], {k: v[1:] for k, v in columns.items()}, '20240105')
+    store.append(SYMBOL, '1d', 'none', index[:0], {k: v[:0] for k, v in columns.items()}, '20240103')
+    meta = store.meta(SYMBOL, '1d', 'none')
+    assert meta['rows'] == 2
+    assert meta['through'] == '20240105'
+    assert store.read(SYMBOL, '1d', 'none')[0].tolist() == ['20240102', '20240103']
+
+
+def test_failed_download_only_claims_written_bars(tmp_path, xtdata_bars):
+    store = BarStore(str(tmp_path))
+    xtdata_bars.days = ['20240102', '20240103']
+    xtdata_bars.download_ok = False
+    assert store.sync(SYMBOL, '1d', 'none', '20240102', '20240105') == 2
+    assert xtdata_bars.downloads == [('20240102', '20240105')]
+    assert store.meta(SYMBOL, '1d', 'none')['through'] == '20240103'
+    assert not store.covers(SYMBOL, '1d', 'none', to_epoch_ms('20240102'), '20240105')
+
+    # 下载恢复后增量追加，through推进到请求的结束日期
+    xtdata_bars.days = ['20240102', '20240103', '20240104', '20240105']
+    xtdata_bars.download_ok = True
+    assert store.sync(SYMBOL, '1d', 'none', end_time='20240105') == 2
+    assert xtdata_bars.downloads[-1] == ('20240103', '20240105')
+    meta = store.meta(SYMBOL, '1d', 'none')
+    assert (meta['rows'], meta['through'], meta['generation']) == (4, '20240105', 1)
+    assert store.covers(SYMBOL, '1d', 'none', to_epoch_ms('20240102'), '20240105')
+    assert store.sync(SYMBOL, '1d', 'none', end_time='20240105') == 0
+
+
+def test_changed_history_rewrites(tmp_path, xtdata_bars):
+    store = BarStore(str(tmp_path))
+    xtdata_bars.days = ['20240102', '20240103']
+    store.sync(SYMBOL, '1d', 'none', '20240102', '20240103')
+    # 除权后重叠的K线价格变化：整体重写为新一代文件
+    xtdata_bars.days = ['20240102', '20240103', '20240104']
+    xtdata_bars.close = [9.0, 9.5, 9.8]
+    assert store.sync(SYMBOL, '1d', 'none', end_time='20240104') == 3
+    meta = store.meta(SYMBOL, '1d', 'none')
+    assert (meta['rows'], meta['through'], meta['generation']) == (3, '20240104', 2)
+    assert store.read(SYMBOL, '1d', 'none')[1]['close'].tolist() == [9.0, 9.5, 9.8]
+    assert sorted(p.name for p in (tmp_path / '1d' / 'none' / SYMBOL).glob('*.bin')) == \
+        ['close.2.bin', 'index.2.bin', 'time.2.bin']
+
+
+def test_sync_unknown_symbol_needs_start(tmp_path, xtdata_bars):
+    with pytest.raises(ValueError):
+        BarStore(str(tmp_path)).sync(SYMBOL, '1d', 'none', end_time='20240105')
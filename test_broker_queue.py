@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+broker_queue.BrokerQueue 单元测试（不需要柜台）
+
+运行: python -m pytest -q test_broker_queue.py
+"""
+import threading
+
+import pytest
+
+from broker_queue import BrokerQueue, BrokerCallInFlightError, TradeQueueFullError, \
+    PRIORITY_CANCEL, PRIORITY_ORDER, PRIORITY_QUERY
+
+
+def _block(queue):
+    """占住工作线程，返回 (放行事件, 占用调用的线程)"""
+    release = threading.Event()
+    started = threading.Event()
+
+    def _hold():
+        started.set()
+        release.wait(5)
+
+    def _call():
+        try:
+            queue.call(PRIORITY_QUERY, _hold)
+        except TimeoutError:
+            pass  # call_timeout较短时占用调用自身也会超时
+
+    thread = threading.Thread(target=_call)
+    thread.start()
+    assert started.wait(5)
+    return release, thread
+
+
+def test_cancel_runs_before_order_before_query():
+    queue = BrokerQueue('priority', call_timeout=5)
+    release, holder = _block(queue)
+    ran = []
+    threads = [threading.Thread(target=queue.call, args=(priority, ran.append, name))
+               for priority, name in ((PRIORITY_QUERY, 'query'), (PRIORITY_ORDER, 'order'),
+                                      (PRIORITY_CANCEL, 'cancel'))]
+    for thread in threads:
+        thread.start()
+    while queue.stats()['depth'] < 3:
+        pass
+    release.set()
+    for thread in threads + [holder]:
+        thread.join(5)
+    assert ran == ['cancel', 'order', 'query']
+
+
+def test_timeout_cancels_queued_call():
+    queue = BrokerQueue('timeout', call_timeout=0.1)
+    release, holder = _block(queue)
+    ran = []
+    with pytest.raises(TimeoutError) as exc:
+        queue.call(PRIORITY_ORDER, ran.append, 'order')
+    assert not isinstance(exc.value, BrokerCallInFlightError)
+    release.set()
+    holder.join(5)
+    # 取消的调用被工作线程跳过
+    queue.call(PRIORITY_QUERY, lambda: None)
+    assert ran == []
+
+
+def test_timeout_while_running_is_in_flight():
+    queue = BrokerQueue('in-flight', call_timeout=0.1)
+    release = threading.Event()
+    with pytest.raises(BrokerCallInFlightError):
+        queue.call(PRIORITY_ORDER, release.wait, 5)
+    release.set()
+
+
+def test_full_queue_rejects():
+    queue = BrokerQueue('full', maxsize=1, call_timeout=5)
+    release, holder = _block(queue)
+    waiter = threading.Thread(target=queue.call, args=(PRIORITY_QUERY, lambda: None))
+    waiter.start()
+    while queue.stats()['depth'] < 1:
+        pass
+    with pytest.raises(TradeQueueFullError):
+        queue.call(PRIORITY_ORDER, lambda: None)
+    release.set()
+    for thread in (holder, waiter):
+        thread.join(5)
+    assert queue.stats()['rejected'] == 1
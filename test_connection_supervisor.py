@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+connection_supervisor.ConnectionSupervisor 单元测试（不需要交易终端）
+
+运行: python -m pytest -q test_connection_supervisor.py
+"""
+import threading
+
+import pytest
+
+from connection_supervisor import ConnectionSupervisor, TradeConnectionError, STATE_CONNECTED
+
+
+def test_backoff_doubles_with_jitter_and_cap():
+    supervisor = ConnectionSupervisor('backoff', connect=lambda: None, base_delay=0.5, max_delay=4.0)
+    try:
+        for attempt, expected in enumerate([0.5, 1.0, 2.0, 4.0, 4.0, 4.0]):
+            for _ in range(50):
+                delay = supervisor.backoff_delay(attempt)
+                assert expected / 2 <= delay <= expected
+    finally:
+        supervisor.stop()
+
+
+def test_reconnects_after_failures():
+    attempts = []
+    connected = threading.Event()
+
+    def _connect():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise RuntimeError('terminal offline')
+
+    def _on_change(state, message):
+        if state == STATE_CONNECTED:
+            connected.set()
+
+    supervisor = ConnectionSupervisor('reconnect', connect=_connect, on_change=_on_change,
+                                      base_delay=0.01, max_delay=0.02)
+    try:
+        with pytest.raises(TradeConnectionError):
+            supervisor.ensure_available()
+        supervisor.mark_disconnected('test')
+        assert connected.wait(5)
+        assert len(attempts) == 3
+        assert supervisor.reconnect_count == 1
+        supervisor.ensure_available()
+    finally:
+        supervisor.stop()
+
+
+def test_account_status_gates_availability():
+    supervisor = ConnectionSupervisor('status', connect=lambda: None)
+    try:
+        supervisor.mark_connected()
+        supervisor.on_account_status(1)  # 连接中：暂不可用，但不重连
+        assert supervisor.state == STATE_CONNECTED
+        with pytest.raises(TradeConnectionError):
+            supervisor.ensure_available()
+        supervisor.on_account_status(0)
+        supervisor.ensure_available()
+    finally:
+        supervisor.stop()
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+data_codec 单元测试：长表拼接，以及编码后用order_helper.decode_columns解码的往返一致性
+
+运行: python -m pytest -q test_data_codec.py
+"""
+import numpy as np
+import pytest
+
+from data_codec import bars_to_columns, records_to_columns, encode, FORMAT_NPZ, FORMAT_ARROW, FORMAT_MSGPACK
+
+
+def _columns():
+    return bars_to_columns({
+        '000001.SZ': (np.array(['20240102', '20240103']),
+                      {'time': np.array([1, 2], dtype=np.int64), 'close': np.array([10.5, 10.6])}),
+        '600000.SH': (np.array(['20240102']),
+                      {'time': np.array([1], dtype=np.int64), 'close': np.array([7.25]),
+                       'volume': np.array([300], dtype=np.int64)}),
+    })
+
+
+def test_bars_to_columns_uses_union_of_fields():
+    columns = _columns()
+    assert list(columns) == ['symbol', 'index', 'time', 'close', 'volume']
+    assert columns['symbol'].tolist() == ['000001.SZ', '000001.SZ', '600000.SH']
+    assert columns['index'].tolist() == ['20240102', '20240103', '20240102']
+    assert columns['time'].dtype == np.int64
+    # 000001.SZ缺少volume：整数列提升为浮点并填NaN
+    assert columns['volume'].dtype == np.float64
+    assert np.isnan(columns['volume'][:2]).all() and columns['volume'][2] == 300
+
+
+def test_empty_bars():
+    columns = bars_to_columns({'000001.SZ': (np.array([]), {})})
+    assert list(columns) == ['symbol', 'index']
+    assert len(columns['symbol']) == 0
+
+
+def test_records_to_columns_keeps_list_fields_2d():
+    columns = records_to_columns({
+        '000001.SZ': {'lastPrice': 10.5, 'askPrice': [10.6, 10.7], 'stockStatus': 0},
+        '600000.SH': {'lastPrice': 7.25, 'askPrice': [7.26, 7.27], 'stockStatus': 1},
+        '300750.SZ': {},
+    })
+    assert columns['symbol'].tolist() == ['000001.SZ', '600000.SH']
+    assert columns['askPrice'].shape == (2, 2)
+    assert columns['stockStatus'].dtype.kind == 'i'
+
+
+@pytest.mark.parametrize('fmt', [FORMAT_NPZ, FORMAT_ARROW, FORMAT_MSGPACK])
+def test_round_trip(fmt):
+    pytest.importorskip('pandas')
+    if fmt == FORMAT_ARROW:
+        pytest.importorskip('pyarrow')
+    if fmt == FORMAT_MSGPACK:
+        pytest.importorskip('msgpack')
+    from order_helper import decode_columns
+
+    columns = _columns()
+    columns['askPrice'] = np.array([[1.0, 2.0], [3.0, 4.0], [5.0, 6.0]])
+    content, _ = encode(columns, fmt)
+    df = decode_columns(content, fmt)
+    assert list(df.columns) == list(columns)
+    assert df['symbol'].tolist() == columns['symbol'].tolist()
+    assert df['index'].tolist() == columns['index'].tolist()
+    assert df['time'].tolist() == [1, 2, 1]
+    np.testing.assert_array_equal(df['close'].to_numpy(), columns['close'])
+    np.testing.assert_array_equal(df['volume'].to_numpy(), columns['volume'])
+    assert [list(v) for v in df['askPrice']] == columns['askPrice'].tolist()
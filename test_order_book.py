@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+order_book.OrderBook 单元测试（用模拟的委托推送，不需要柜台）
+
+运行: python -m pytest -q test_order_book.py
+"""
+from types import SimpleNamespace
+
+import pytest
+
+xtconstant = pytest.importorskip('xtquant.xtconstant')
+
+from order_book import OrderBook  # noqa: E402
+
+
+def _order(order_id, symbol='000001.SZ', buy=True, status=50, volume=100, traded_volume=0,
+           order_time=0, strategy_name='策略1'):
+    return SimpleNamespace(order_id=order_id, stock_code=symbol,
+                           order_type=xtconstant.STOCK_BUY if buy else xtconstant.STOCK_SELL,
+                           order_status=status, order_volume=volume, order_time=order_time or order_id,
+                           price=10.0, price_type=xtconstant.FIX_PRICE, traded_volume=traded_volume,
+                           traded_price=0.0, strategy_name=strategy_name)
+
+
+def _book():
+    book = OrderBook('test')
+    book.on_order(_order(1, status=50))
+    book.on_order(_order(2, symbol='600000.SH', buy=False, status=55, traded_volume=50))
+    book.on_order(_order(3, status=56, traded_volume=100, strategy_name='策略2'))
+    book.on_order(_order(4, symbol='600000.SH', status=54))
+    return book
+
+
+def _ids(records):
+    return [r.order_id for r in records]
+
+
+def test_index_filters_are_combined():
+    book = _book()
+    assert _ids(book.query()) == [1, 2, 3, 4]
+    assert _ids(book.query(symbol='000001.SZ')) == [1, 3]
+    assert _ids(book.query(side='sell')) == [2]
+    assert _ids(book.query(symbol='600000.SH', side='buy')) == [4]
+    assert _ids(book.query(strategy_name='策略2')) == [3]
+    assert _ids(book.query(symbol='300750.SZ')) == []
+
+
+def test_status_filters():
+    book = _book()
+    assert _ids(book.query(status=56)) == [3]
+    assert _ids(book.query(status='56')) == [3]
+    assert _ids(book.query(status=[50, '54'])) == [1, 4]
+    assert _ids(book.query(cancelable_only=True)) == [1, 2]
+    assert _ids(book.query(status=[50, 56], cancelable_only=True)) == [1]
+
+
+def test_status_change_moves_index():
+    book = _book()
+    book.on_order(_order(1, status=56, traded_volume=100))
+    assert _ids(book.query(status=50)) == []
+    assert _ids(book.query(status=56)) == [1, 3]
+    # 非权威推送不会把终态改回非终态，柜台对账为准
+    book.on_order(_order(1, status=50))
+    assert book.get(1).status == 56
+    book.sync([_order(1, status=50), _order(2, status=55)])
+    assert book.get(1).status == 50
+    assert _ids(book.query()) == [1, 2]
+
+
+def test_returns_copies():
+    book = _book()
+    record = book.get(1)
+    record.status = 54
+    book.query(status=50)[0].symbol = '600000.SH'
+    assert book.get(1).status == 50
+    assert _ids(book.query(status=50, symbol='000001.SZ')) == [1]
+    assert book.get(99) is None
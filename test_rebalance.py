@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+rebalance.plan_rebalance 单元测试（纯NumPy计算，不需要柜台和行情）
+
+运行: python -m pytest -q test_rebalance.py
+"""
+import numpy as np
+
+from rebalance import plan_rebalance
+
+
+def _plan(volume, can_use_volume, prices, weights, total_asset, cash, **kwargs):
+    symbols = [f"00000{i}.SZ" for i in range(len(volume))]
+    return plan_rebalance(symbols, volume, can_use_volume, prices, weights, total_asset, cash, **kwargs)
+
+
+def test_buy_to_target_in_whole_lots():
+    plan = _plan([0], [0], [10.0], [0.5], total_asset=100000, cash=100000)
+    assert plan['target_volume'].tolist() == [5000]
+    assert plan['buy_volume'].tolist() == [5000]
+    assert plan['sell_volume'].tolist() == [0]
+    assert plan['buy_scale'] == 1.0
+    assert plan['buy_amount'] == 50000
+
+
+def test_liquidate_allows_odd_lot_sell():
+    plan = _plan([1250], [1250], [10.0], [0.0], total_asset=100000, cash=87500)
+    assert plan['sell_volume'].tolist() == [1250]
+    assert plan['sell_amount'] == 12500
+
+
+def test_partial_sell_rounds_to_lot_and_respects_can_use_volume():
+    # 目标1000股，需卖出1250股但只有800股可卖，按整手卖出800
+    plan = _plan([2250], [800], [10.0], [0.1], total_asset=100000, cash=77500)
+    assert plan['target_volume'].tolist() == [1000]
+    assert plan['sell_volume'].tolist() == [800]
+
+
+def test_sell_proceeds_not_counted_in_buy_budget():
+    # 卖出A 5000股回款50000，可用资金只有10000：买入只按可用资金缩减，不使用卖出回款
+    plan = _plan([5000, 0], [5000, 0], [10.0, 10.0], [0.0, 0.6], total_asset=60000, cash=10000)
+    assert plan['sell_volume'].tolist() == [5000, 0]
+    assert plan['sell_amount'] == 50000
+    assert plan['buy_amount'] <= 10000
+    assert plan['buy_volume'].tolist() == [0, 1000]
+    assert plan['buy_scale'] < 1.0
+
+
+def test_missing_price_keeps_current_volume():
+    plan = _plan([300, 0], [300, 0], [0.0, 10.0], [0.0, 0.5], total_asset=20000, cash=20000)
+    assert plan['target_volume'].tolist() == [300, 1000]
+    assert plan['sell_volume'].tolist() == [0, 0]
+    assert plan['buy_volume'].tolist() == [0, 1000]
+
+
+def test_cash_buffer_and_negative_cash():
+    plan = _plan([0], [0], [10.0], [1.0], total_asset=100000, cash=100000, cash_buffer=0.1)
+    assert plan['target_volume'].tolist() == [9000]
+    plan = _plan([0], [0], [10.0], [1.0], total_asset=100000, cash=-500)
+    assert plan['buy_volume'].tolist() == [0]
+    assert plan['buy_scale'] == 0.0
+    assert isinstance(plan['buy_volume'], np.ndarray)
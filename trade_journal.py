@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+交易事件日志
+
+委托、成交、撤单、错误等回调事件按账户分配递增序号，追加写入SQLite（WAL模式）。
+回调线程只把事件放入队列，写线程把一个时间窗口内的事件合并为一次事务提交。
+启动时按账户回放当日事件，重建内存委托簿。
+"""
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from logger_config import get_logger
+from config import get_config
+
+log = get_logger(__name__)
+
+KIND_ORDER = 'order'
+KIND_TRADE = 'trade'
+KIND_ORDER_ERROR = 'order_error'
+KIND_CANCEL_ERROR = 'cancel_error'
+KIND_ORDER_RESPONSE = 'order_response'
+KIND_CANCEL_RESPONSE = 'cancel_response'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    account_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    ts REAL NOT NULL,
+    trade_date TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    order_id INTEGER,
+    payload TEXT NOT NULL,
+    PRIMARY KEY (account_id, seq)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_events_date ON events (trade_date, account_id, seq);
+"""
+
+
+def _to_payload(obj):
+    """xt回调对象转为可JSON序列化的字典"""
+    if isinstance(obj, dict):
+        data = obj
+    else:
+        data = {k: v for k, v in vars(obj).items() if not k.startswith('_')}
+    return {k: v for k, v in data.items() if isinstance(v, (int, float, str, bool)) or v is None}
+
+
+class TradeJournal:
+    """追加写入的交易事件日志"""
+
+    def __init__(self, path, flush_interval=0.05, max_batch=1000):
+        """
+        :param path: SQLite数据库文件路径
+        :param flush_interval: 合并提交的时间窗口（秒）
+        :param max_batch: 单次事务最多写入的事件数
+        """
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        conn = self._connect()
+        conn.executescript(_SCHEMA)
+        self._seq = dict(conn.execute("SELECT account_id, MAX(seq) FROM events GROUP BY account_id").fetchall())
+        conn.close()
+
+        self._seq_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._appended = 0
+        self._written = 0
+        self._failed = 0
+        self._commits = 0
+        self._last_commit_ms = 0.0
+        self._stopped = threading.Event()
+        self._writer = threading.Thread(target=self._run, name="trade-journal", daemon=True)
+        self._writer.start()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def append(self, account_id, kind, obj):
+        """记录一个事件，返回该账户的事件序号；只入队，不等待落盘"""
+        payload = _to_payload(obj)
+        account_id = str(account_id)
+        with self._seq_lock:
+            seq = self._seq.get(account_id, 0) + 1
+            self._seq[account_id] = seq
+            self._appended += 1
+            # 入队在锁内完成，保证同一账户的事件按序号顺序写入
+            now = time.time()
+            self._queue.put((account_id, seq, now, time.strftime('%Y%m%d', time.localtime(now)), kind,
+                             payload.get('order_id'), json.dumps(payload, ensure_ascii=False)))
+        return seq
+
+    def _run(self):
+        conn = self._connect()
+        while not (self._stopped.is_set() and self._queue.empty()):
+            try:
+                batch = [self._queue.get(timeout=0.5)]
+            except queue.Empty:
+                continue
+            # 在时间窗口内继续收集，合并为一次提交
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            start_ts = time.perf_counter()
+            try:
+                with conn:
+                    conn.executemany("INSERT OR IGNORE INTO events VALUES (?, ?, ?, ?, ?, ?, ?)", batch)
+                self._written += len(batch)
+                self._commits += 1
+                self._last_commit_ms = (time.perf_counter() - start_ts) * 1000
+            except sqlite3.Error as e:
+                self._failed += len(batch)
+                log.error(f"交易事件日志写入失败({len(batch)}条): {e}")
+        conn.close()
+
+    def replay(self, account_id, trade_date=None):
+        """按序号返回账户某个交易日（默认当日）的事件 [(seq, kind, payload)]"""
+        trade_date = trade_date or time.strftime('%Y%m%d')
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT seq, kind, payload FROM events WHERE trade_date = ? AND account_id = ? ORDER BY seq",
+                (trade_date, str(account_id))).fetchall()
+        finally:
+            conn.close()
+        return [(seq, kind, json.loads(payload)) for seq, kind, payload in rows]
+
+    def replay_latest(self, account_id, trade_date=None):
+        """返回重建委托簿所需的事件：每笔委托最后一次委托事件和全部成交事件，按序号排列 [(seq, kind, payload)]
+
+        委托推送携带累计成交量和最新状态，中间状态不需要重放。
+        """
+        trade_date = trade_date or time.strftime('%Y%m%d')
+        account_id = str(account_id)
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT seq, kind, payload FROM events WHERE trade_date = ? AND account_id = ? AND "
+                "(kind = ? OR seq IN (SELECT MAX(seq) FROM events WHERE trade_date = ? AND account_id = ? "
+                "AND kind = ? GROUP BY order_id)) ORDER BY seq",
+                (trade_date, account_id, KIND_TRADE, trade_date, account_id, KIND_ORDER)).fetchall()
+        finally:
+            conn.close()
+        return [(seq, kind, json.loads(payload)) for seq, kind, payload in rows]
+
+    def flush(self, timeout=5.0):
+        """等待已记录的事件写完"""
+        deadline = time.time() + timeout
+        while self._written + self._failed < self._appended and time.time() < deadline:
+            time.sleep(0.01)
+
+    def close(self):
+        self._stopped.set()
+        self._writer.join(timeout=5.0)
+
+    def stats(self):
+        return {
+            'path': self.path,
+            'pending': self._queue.qsize(),
+            'written': self._written,
+            'failed': self._failed,
+            'commits': self._commits,
+            'last_commit_ms': round(self._last_commit_ms, 3),
+        }
+
+
+_journal = None
+_journal_lock = threading.Lock()
+
+
+def get_journal():
+    """返回全局交易事件日志，JOURNAL_PATH为空时不记录，返回None"""
+    global _journal
+    path = get_config().trade.journal_path
+    if not path:
+        return None
+    with _journal_lock:
+        if _journal is None:
+            _journal = TradeJournal(path, get_config().trade.journal_flush_interval)
+        return _journal
@@ -1,7 +1,16 @@
-from flask import Blueprint, jsonify, request, session, redirect, url_for
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from flask import Blueprint, Response, jsonify, request, session, redirect, url_for
 import qmt_data
+from account_events import RESYNC, EVENT_ASSET, EVENT_POSITION, EVENT_POSITION_REMOVED, EVENT_ORDER
+from position_table import PositionTable
+from data_codec import sse_message
 from logger_config import get_logger
 from config import get_config
+from qmt_trade import SUBMIT_MODES, notifier
+from broker_queue import TradeQueueFullError
+from connection_supervisor import TradeConnectionError
+from trade_journal import get_journal
 from functools import wraps
 from authentication import login_or_signature_required, api_signature_required
 
@@ -12,6 +21,12 @@ def handle_exceptions(f):
     def decorated_function(*args, **kwargs):
         try:
             return f(*args, **kwargs)
+        except TradeQueueFullError as e:
+            log.warning(f"接口繁忙 [{f.__name__}]: {str(e)}")
+            return jsonify({'error': f'接口繁忙: {f.__name__}', 'message': str(e)}), 429
+        except TradeConnectionError as e:
+            log.warning(f"交易连接不可用 [{f.__name__}]: {str(e)}")
+            return jsonify({'error': f'交易连接不可用: {f.__name__}', 'message': str(e)}), 503
         except Exception as e:
             log.error(f"接口异常 [{f.__name__}]: {str(e)}", exc_info=True)
             return jsonify({'error': f'接口异常: {f.__name__}', 'message': str(e)}), 500
@@ -39,6 +54,10 @@ log = get_logger(__name__)
 # 交易器实例将通过init_trade_routes函数注入
 traders = []
 
+# 多账户并发下单线程池
+fanout_executor = ThreadPoolExecutor(max_workers=get_config().trade.fanout_max_workers,
+                                     thread_name_prefix='fanout')
+
 
 def init_trade_routes(traders_list):
     """初始化交易路由，注入交易器实例"""
@@ -47,6 +66,66 @@ def init_trade_routes(traders_list):
     log.info(f"交易路由初始化完成，共{len(traders)}个交易器")
 
 
+def select_accounts(trader_index=None):
+    """返回 [(交易器索引, 交易器)]，trader_index为None时选择全部账户"""
+    if trader_index is None:
+        return list(enumerate(traders))
+    return [(trader_index, traders[trader_index])]
+
+
+def fan_out(accounts, action, label):
+    """并发地在多个账户上执行action(trader)，按账户顺序收集结果
+
+    每个账户的结果带有submit_ts（开始下单的时间戳）和elapsed_ms，
+    超过FANOUT_TIMEOUT仍未返回的账户标记为timeout（该账户的委托可能仍在进行），
+    柜台调用队列已满的账户标记为rejected。
+
+    Returns:
+        tuple: (results, submit_spread_ms) 第一个到最后一个账户开始下单的时间差
+    """
+    timeout = get_config().trade.fanout_timeout
+
+    def _run(i, trader):
+        submit_ts = time.time()
+        log.info(f"交易器{i}开始{label}")
+        result = action(trader)
+        log.info(f"交易器{i}{label}完成: {result}")
+        return result, submit_ts, time.time()
+
+    dispatch_ts = time.time()
+    futures = [(i, fanout_executor.submit(_run, i, trader)) for i, trader in accounts]
+    results = []
+    submit_times = []
+    for i, future in futures:
+        try:
+            result, submit_ts, done_ts = future.result(timeout=max(dispatch_ts + timeout - time.time(), 0))
+            submit_times.append(submit_ts)
+            results.append({'trader_index': i, 'result': result, 'status': 'success',
+                            'submit_ts': submit_ts, 'elapsed_ms': round((done_ts - submit_ts) * 1000, 3)})
+        except TradeQueueFullError as e:
+            error_msg = f"交易器{i}{label}被拒绝: {str(e)}"
+            log.warning(error_msg)
+            results.append({'trader_index': i, 'error': error_msg, 'status': 'rejected'})
+        except FutureTimeoutError:
+            error_msg = f"交易器{i}{label}超时({timeout}秒)"
+            log.error(error_msg)
+            results.append({'trader_index': i, 'error': error_msg, 'status': 'timeout'})
+        except Exception as e:
+            error_msg = f"交易器{i}{label}失败: {str(e)}"
+            log.error(error_msg, exc_info=True)
+            results.append({'trader_index': i, 'error': error_msg, 'status': 'failed'})
+
+    submit_spread_ms = round((max(submit_times) - min(submit_times)) * 1000, 3) if submit_times else 0
+    return results, submit_spread_ms
+
+
+def fan_out_status(results):
+    """所有账户都因队列已满被拒绝时返回429，否则200"""
+    if results and all(r['status'] == 'rejected' for r in results):
+        return 429
+    return 200
+
+
 @trade_bp.route('/accounts')
 @login_or_signature_required
 @handle_exceptions
@@ -59,7 +138,8 @@ def get_accounts():
         accounts.append({
             'index': i,
             'account_id': trader.account_id,
-            'nick_name': trader.nick_name or f"账户{i + 1}"
+            'nick_name': trader.nick_name or f"账户{i + 1}",
+            'connection': trader.supervisor.status()
         })
 
     return jsonify({'accounts': accounts})
@@ -79,31 +159,32 @@ def get_portfolio(trader_index):
     portfolio = trader.get_portfolio()
 
     if portfolio:
-        # 处理XtAsset对象或字典格式
-        if hasattr(portfolio, 'total_asset'):
-            portfolio_data = {
-                'total_asset': portfolio.total_asset,  # 总资产
-                'cash': portfolio.cash,  # 可用金额
-                'frozen_cash': portfolio.frozen_cash,  # 冻结金额
-                'market_value': portfolio.market_value,  # 总市值
-                'profit': getattr(portfolio, 'profit', 0),  # 盈亏
-                'profit_ratio': getattr(portfolio, 'profit_ratio', 0)  # 盈亏比例
-            }
-        else:
-            portfolio_data = {
-                'total_asset': portfolio.get('total_asset', 0),
-                'cash': portfolio.get('cash', 0),
-                'frozen_cash': portfolio.get('frozen_cash', 0),
-                'market_value': portfolio.get('market_value', 0),
-                'profit': portfolio.get('profit', 0),
-                'profit_ratio': portfolio.get('profit_ratio', 0)
-            }
-
-        return jsonify({'portfolio': portfolio_data})
+        return jsonify({'portfolio': portfolio_data(portfolio)})
     else:
         return jsonify({'error': '无法获取资产信息'}), 500
 
 
+def portfolio_data(portfolio):
+    """资金转为接口返回格式，兼容XtAsset/AssetSnapshot对象和字典"""
+    if hasattr(portfolio, 'total_asset'):
+        return {
+            'total_asset': portfolio.total_asset,  # 总资产
+            'cash': portfolio.cash,  # 可用金额
+            'frozen_cash': portfolio.frozen_cash,  # 冻结金额
+            'market_value': portfolio.market_value,  # 总市值
+            'profit': getattr(portfolio, 'profit', 0),  # 盈亏
+            'profit_ratio': getattr(portfolio, 'profit_ratio', 0)  # 盈亏比例
+        }
+    return {
+        'total_asset': portfolio.get('total_asset', 0),
+        'cash': portfolio.get('cash', 0),
+        'frozen_cash': portfolio.get('frozen_cash', 0),
+        'market_value': portfolio.get('market_value', 0),
+        'profit': portfolio.get('profit', 0),
+        'profit_ratio': portfolio.get('profit_ratio', 0)
+    }
+
+
 @trade_bp.route('/positions/<int:trader_index>')
 @login_or_signature_required
 @handle_exceptions
@@ -115,106 +196,167 @@ def get_positions(trader_index):
         return jsonify({'error': '无效的交易器索引'}), 400
 
     trader = traders[trader_index]
-    positions = trader.get_position()
-    position_list = []
-
-    for symbol, pos in positions.items():
-        # 处理XtPosition对象或字典格式
-        if hasattr(pos, 'volume'):
-            # XtPosition对象格式
-            volume = getattr(pos, 'volume', 0)
-            can_use_volume = getattr(pos, 'can_use_volume', 0)
-            frozen_volume = getattr(pos, 'frozen_volume', 0)
-            market_value = getattr(pos, 'market_value', 0)
-            avg_price = getattr(pos, 'avg_price', 0)
-            open_price = getattr(pos, 'open_price', 0)
-            log.info(
-                f"持仓信息 - 股票代码: {symbol}, 持仓数量: {volume}, 可用数量: {can_use_volume}, 冻结数量: {frozen_volume}, 市值: {market_value}, 成本价: {avg_price}, 开仓价: {open_price}")
-
-            # 打印pos对象的所有属性（调试用）
-            # log.debug(f"pos对象类型: {type(pos)}")
-            # log.debug(f"pos对象所有属性: {[attr for attr in dir(pos) if not attr.startswith('_')]}")
-            # pos对象所有属性: ['account_id', 'account_type', 'avg_price', 'can_use_volume', 'direction', 'float_profit', 'frozen_volume', 'instrument_name', 'last_price', 'm_dAvgPrice', 'm_dFloatProfit', 'm_dMarketValue', 'm_dOpenPrice', 'm_nAccountType', 'm_nCanUseVolume', 'm_nDirection', 'm_nFrozenVolume', 'm_nOnRoadVolume', 'm_nVolume', 'm_nYesterdayVolume', 'm_strAccountID', 'm_strStockCode', 'market_value', 'on_road_volume', 'open_date', 'open_price', 'position_profit', 'profit_rate', 'secu_account', 'stock_code', 'volume', 'yesterday_volume']
-            # for attr in dir(pos):
-            #     if not attr.startswith('_'):
-            #         try:
-            #             value = getattr(pos, attr)
-            #             if not callable(value):
-            #                 log.debug(f"pos.{attr} = {value} (类型: {type(value)})")
-            #         except Exception as e:
-            #             log.debug(f"获取pos.{attr}失败: {e}")
-            # 如果market_value为0，尝试用volume * avg_price计算
-            if market_value == 0 and volume > 0 and avg_price > 0:
-                market_value = volume * avg_price
-
-            # 计算盈亏和盈亏比例
-            try:
-                current_price = qmt_data.get_last_price(symbol)  # 获取实时价格
-            except:
-                current_price = avg_price
-            try:
-                symbol_name = qmt_data.get_instrument_detail(symbol)['InstrumentName']
-            except:
-                symbol_name = symbol
-
-            cost_value = volume * avg_price if avg_price > 0 else 0
-            current_value = volume * current_price if current_price > 0 else market_value
-            profit = current_value - cost_value if cost_value > 0 else 0
-            profit_ratio = (profit / cost_value * 100) if cost_value > 0 else 0
-
-            position_data = {
-                'symbol': symbol,
-                'name': symbol_name,  # 暂时使用股票代码作为名称
-                'volume': volume,  # 当前持股
-                'can_use_volume': can_use_volume,  # 可用股数
-                'frozen_volume': frozen_volume,  # 冻结数量
-                'market_value': market_value,  # 市值
-                'avg_price': avg_price,  # 成本价
-                'open_price': open_price,  # 开仓价
-                'current_price': current_price,  # 最新价
-                'profit': profit,  # 盈亏
-                'profit_ratio': profit_ratio  # 盈亏比例
-            }
-        else:
-            # 字典格式
-            volume = pos.get('volume', 0)
-            can_use_volume = pos.get('can_use_volume', 0)
-            frozen_volume = pos.get('frozen_volume', 0)
-            market_value = pos.get('market_value', 0)
-            avg_price = pos.get('avg_price', 0)
-            open_price = pos.get('open_price', 0)
-
-            # 如果market_value为0，尝试用volume * avg_price计算
-            if market_value == 0 and volume > 0 and avg_price > 0:
-                market_value = volume * avg_price
-
-            # 计算盈亏和盈亏比例
-            current_price = avg_price  # 暂时使用成本价作为当前价
-            cost_value = volume * avg_price if avg_price > 0 else 0
-            current_value = volume * current_price if current_price > 0 else market_value
-            profit = current_value - cost_value if cost_value > 0 else 0
-            profit_ratio = (profit / cost_value * 100) if cost_value > 0 else 0
-
-            position_data = {
-                'symbol': symbol,
-                'name': symbol,
-                'volume': volume,
-                'can_use_volume': can_use_volume,
-                'frozen_volume': frozen_volume,
-                'market_value': market_value,
-                'avg_price': avg_price,
-                'open_price': open_price,
-                'current_price': current_price,  # 最新价
-                'profit': profit,  # 盈亏
-                'profit_ratio': profit_ratio  # 盈亏比例
-            }
-
-        position_list.append(position_data)
+    position_list = position_rows(trader.get_position_table())
 
     log.info(f"交易器{trader_index}持仓信息获取成功，共{len(position_list)}只股票")
     return jsonify({'positions': position_list})
 
 
+def position_rows(table):
+    """列式持仓快照转为接口返回的持仓列表，附带名称和按最新价的估值"""
+    codes = table.codes()
+
+    # 整个持仓列表只调用一次get_full_tick，名称走缓存
+    try:
+        last_prices = qmt_data.get_last_prices(codes)
+    except Exception as e:
+        log.warning(f"批量获取最新价失败，按成本价估值: {e}")
+        last_prices = {}
+    names = qmt_data.get_instrument_names(codes)
+    valuation = table.valuation(last_prices)
+
+    columns = {
+        'symbol': codes,
+        'name': [names[code] for code in codes],
+        'volume': table['volume'].tolist(),  # 当前持股
+        'can_use_volume': table['can_use_volume'].tolist(),  # 可用股数
+        'frozen_volume': table['frozen_volume'].tolist(),  # 冻结数量
+        'market_value': valuation['market_value'].tolist(),  # 市值
+        'avg_price': table['avg_price'].tolist(),  # 成本价
+        'open_price': table['open_price'].tolist(),  # 开仓价
+        'current_price': valuation['current_price'].tolist(),  # 最新价
+        'profit': valuation['profit'].tolist(),  # 盈亏
+        'profit_ratio': valuation['profit_ratio'].tolist(),  # 盈亏比例
+    }
+    keys = list(columns)
+    return [dict(zip(keys, row)) for row in zip(*columns.values())]
+
+
+@trade_bp.route('/stream/<int:trader_index>')
+@login_or_signature_required
+@handle_exceptions
+def stream_account(trader_index):
+    """账户事件推送（Server-Sent Events）
+
+    连接后先推送snapshot（账户连接状态、资金、持仓、当日委托，格式同对应查询接口），
+    之后推送增量：asset（资金）、position（单只持仓）、position_removed（持仓消失）、order（委托变化）、
+    trade（成交回报）。连接消费过慢、缓冲溢出时重发snapshot；无事件时定期发送心跳注释。
+    """
+    if trader_index >= len(traders) or trader_index < 0:
+        return jsonify({'error': '无效的交易器索引'}), 400
+
+    trader = traders[trader_index]
+    subscriber = trader.events.subscribe()
+    try:
+        snapshot = account_snapshot(trader_index)
+    except Exception:
+        trader.events.unsubscribe(subscriber)
+        raise
+    heartbeat = get_config().trade.stream_heartbeat
+    log.info(f"交易器{trader_index}事件推送连接建立")
+
+    def generate():
+        try:
+            yield sse_message('snapshot', snapshot)
+            while True:
+                events = subscriber.get(heartbeat)
+                if events is RESYNC:
+                    log.info(f"交易器{trader_index}事件推送缓冲溢出，重发快照")
+                    yield sse_message('snapshot', account_snapshot(trader_index))
+                elif not events:
+                    yield ': keepalive\n\n'
+                else:
+                    for event, data in stream_payloads(events):
+                        yield sse_message(event.kind, data, event.seq)
+        except Exception as e:
+            log.error(f"交易器{trader_index}事件推送中断: {e}", exc_info=True)
+            yield sse_message('error', {'message': str(e)})
+        finally:
+            trader.events.unsubscribe(subscriber)
+            log.info(f"交易器{trader_index}事件推送连接关闭")
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+def account_snapshot(trader_index):
+    """账户完整快照：连接状态、资金、持仓和当日委托"""
+    trader = traders[trader_index]
+    portfolio = trader.get_portfolio()
+    return {
+        'trader_index': trader_index,
+        'account_id': trader.account_id,
+        'connection': trader.supervisor.status(),
+        'portfolio': portfolio_data(portfolio) if portfolio else None,
+        'positions': position_rows(trader.get_position_table()),
+        'orders': trader.query_orders(),
+    }
+
+
+def stream_payloads(events):
+    """一批事件转为推送数据，返回 [(事件, 数据)]
+
+    同一批中同一对象的多次变化只推送最后一次（资金、单只持仓、单笔委托），成交逐笔推送；
+    本批的持仓变化合并为一次取价和估值。
+    """
+    latest = []
+    seen = set()
+    for event in reversed(events):
+        if event.kind == EVENT_ASSET:
+            key = EVENT_ASSET
+        elif event.kind == EVENT_POSITION:
+            key = (EVENT_POSITION, event.data.stock_code)
+        elif event.kind == EVENT_POSITION_REMOVED:
+            key = (EVENT_POSITION, event.data)
+        elif event.kind == EVENT_ORDER:
+            key = (EVENT_ORDER, event.data['order_id'])
+        else:
+            key = None
+        if key is not None:
+            if key in seen:
+                continue
+            seen.add(key)
+        latest.append(event)
+    latest.reverse()
+
+    positions = [event.data for event in latest if event.kind == EVENT_POSITION]
+    rows = {row['symbol']: row for row in position_rows(PositionTable.from_positions(positions))} if positions else {}
+    payloads = []
+    for event in latest:
+        if event.kind == EVENT_ASSET:
+            payloads.append((event, portfolio_data(event.data)))
+        elif event.kind == EVENT_POSITION:
+            payloads.append((event, rows[event.data.stock_code]))
+        elif event.kind == EVENT_POSITION_REMOVED:
+            payloads.append((event, {'symbol': event.data}))
+        else:
+            payloads.append((event, event.data))
+    return payloads
+
+
+@trade_bp.route('/stats/queue')
+@login_or_signature_required
+@handle_exceptions
+def queue_stats():
+    """各账户柜台调用队列的深度、排队时间和处理时间，以及交易事件日志写入情况"""
+    stats = []
+    for i, trader in enumerate(traders):
+        item = trader.broker_queue.stats()
+        item['trader_index'] = i
+        item['events'] = trader.events.stats()
+        stats.append(item)
+    journal = get_journal()
+    return jsonify({'queues': stats, 'journal': journal.stats() if journal is not None else None})
+
+
+@trade_bp.route('/stats/notify')
+@login_or_signature_required
+@handle_exceptions
+def notify_stats():
+    """钉钉通知的发送、合并、丢弃、重试计数和各优先级待发送数量"""
+    return jsonify({'notifier': notifier.stats()})
+
+
 @trade_bp.route('/sell', methods=['POST'])
 @login_required
 @handle_exceptions
@@ -233,19 +375,9 @@ def sell_stock():
 
     log.info(f"开始卖出: symbol={symbol}, price={price}, shares={shares}")
 
-    results = []
-    for i, trader in enumerate(traders):
-        try:
-            log.info(f"交易器{i}开始卖出")
-            result = trader.trade_sell(symbol, price, shares)  # 使用正确的方法名
-            results.append({'trader_index': i, 'result': result, 'status': 'success'})
-            log.info(f"交易器{i}卖出完成: {result}")
-        except Exception as e:
-            error_msg = f"交易器{i}卖出失败: {str(e)}"
-            log.error(error_msg, exc_info=True)
-            results.append({'trader_index': i, 'error': error_msg, 'status': 'failed'})
+    results, spread_ms = fan_out(select_accounts(), lambda trader: trader.trade_sell(symbol, price, shares), '卖出')
 
-    return jsonify({'message': '卖出执行完成', 'results': results})
+    return jsonify({'message': '卖出执行完成', 'results': results, 'submit_spread_ms': spread_ms}), fan_out_status(results)
 
 
 @trade_bp.route('/trade', methods=['POST'])
@@ -273,20 +405,13 @@ def trade():
     log.info(f"开始执行交易: symbol={symbol}, trade_price={trade_price}, position_pct={position_pct}")
 
     # 执行交易
-    results = []
-    for i, trader in enumerate(traders):
-        try:
-            log.info(f"交易器{i}开始执行交易")
-            result = trader.trade_target_pct(symbol, trade_price, position_pct, pricetype)
-            results.append({"trader_index": i, "result": result, "status": "success"})
-            log.info(f"交易器{i}交易完成: {result}")
-        except Exception as e:
-            error_msg = f"交易器{i}交易失败: {str(e)}"
-            log.error(error_msg, exc_info=True)
-            results.append({"trader_index": i, "error": error_msg, "status": "failed"})
+    results, spread_ms = fan_out(
+        select_accounts(),
+        lambda trader: trader.trade_target_pct(symbol, trade_price, position_pct, pricetype),
+        '交易')
 
     log.info(f"所有交易器执行完成，结果: {results}")
-    return jsonify({"message": "交易执行完成", "results": results})
+    return jsonify({"message": "交易执行完成", "results": results, "submit_spread_ms": spread_ms}), fan_out_status(results)
 
 
 @trade_bp.route('/outer/trade/<operation>', methods=['POST'])
@@ -309,6 +434,7 @@ def outer_trade(operation):
     price_type = data.get('price_type', 0)
     position_pct = data.get('position_pct')
     strategy_name = data.get('strategy_name', '外部策略')
+    submit_mode = data.get('submit_mode', 'sync')
 
     # 参数验证
     if not symbol or trade_price is None or position_pct is None:
@@ -320,33 +446,192 @@ def outer_trade(operation):
         log.error(f"无效的交易器索引: {trader_index}")
         return jsonify({"error": f"无效的交易器索引: {trader_index}"}), 400
 
+    if submit_mode not in SUBMIT_MODES:
+        return jsonify({"error": f"submit_mode 必须是 {', '.join(SUBMIT_MODES)} 之一"}), 400
+
     log.info(
         f"第三方开始执行{operation}交易: symbol={symbol}, trade_price={trade_price}, position_pct={position_pct}, strategy_name={strategy_name}")
 
-    accounts = [traders[trader_index]] if trader_index is not None else traders
+    def _trade(trader):
+        if operation == 'buy':
+            return trader.trade_target_pct(symbol, trade_price, position_pct, price_type, submit_mode=submit_mode)
+        return trader.trade_sell_target_pct(symbol, trade_price, position_pct, price_type, submit_mode=submit_mode)
+
     # 执行交易
-    results = []
-    for i, trader in enumerate(accounts):
-        try:
-            log.info(f"第三方调用-交易器{i}开始执行{operation}交易")
-            if operation == 'buy':
-                result = trader.trade_target_pct(symbol, trade_price, position_pct, price_type)
-            else:  # sell
-                result = trader.trade_sell_target_pct(symbol, trade_price, position_pct, price_type)
-            results.append({"trader_index": i, "result": result, "status": "success"})
-            log.info(f"第三方调用-交易器{i}{operation}交易完成: {result}")
-        except Exception as e:
-            error_msg = f"第三方调用-交易器{i}{operation}交易失败: {str(e)}"
-            log.error(error_msg, exc_info=True)
-            results.append({"trader_index": i, "error": error_msg, "status": "failed"})
+    results, spread_ms = fan_out(select_accounts(trader_index), _trade, f"第三方调用-{operation}交易")
 
     log.info(f"第三方调用-所有交易器{operation}执行完成，结果: {results}")
     return jsonify({
         "message": f"第三方{operation}交易执行完成",
         "operation": operation,
         "strategy_name": strategy_name,
-        "results": results
-    })
+        "results": results,
+        "submit_spread_ms": spread_ms
+    }), fan_out_status(results)
+
+
+def parse_order_status(value):
+    """解析委托状态筛选条件：单个状态码或状态码列表，允许数字字符串
+
+    返回 (状态码列表或None, error)
+    """
+    if value is None:
+        return None, None
+    values = value if isinstance(value, list) else [value]
+    statuses = []
+    for item in values:
+        if isinstance(item, bool):
+            return None, f"无效的委托状态: {value}"
+        try:
+            statuses.append(int(item))
+        except (TypeError, ValueError):
+            return None, f"无效的委托状态: {value}"
+    return statuses, None
+
+
+def parse_batch_legs(data):
+    """解析批量交易的委托列表，兼容旧版单标的请求体
+
+    返回 (legs, error)，legs中每项为 {'symbol', 'price', 'position_pct'或'shares', 'price_type'}
+    """
+    raw_legs = data.get('legs')
+    if raw_legs is None:
+        # 旧版请求体: {"symbol", "trade_price", "position_pct"}
+        raw_legs = [data]
+    if not isinstance(raw_legs, list) or not raw_legs:
+        return None, "legs 必须是非空列表"
+
+    default_price_type = data.get('price_type', 0)
+    legs = []
+    for i, raw in enumerate(raw_legs):
+        if not isinstance(raw, dict):
+            return None, f"第{i + 1}笔委托格式错误"
+        symbol = raw.get('symbol')
+        price = raw.get('price', raw.get('trade_price'))
+        position_pct = raw.get('position_pct')
+        shares = raw.get('shares')
+        if not symbol or price is None or (position_pct is None and shares is None):
+            return None, f"第{i + 1}笔委托缺少必要参数: symbol, price, position_pct 或 shares"
+        try:
+            leg = {'symbol': symbol, 'price': float(price),
+                   'price_type': int(raw.get('price_type', default_price_type))}
+            if shares is not None:
+                leg['shares'] = int(shares)
+            else:
+                leg['position_pct'] = float(position_pct)
+        except (TypeError, ValueError):
+            return None, f"第{i + 1}笔委托参数格式错误: {raw}"
+        if leg['price_type'] == 0 and leg['price'] <= 0:
+            return None, f"第{i + 1}笔限价委托价格必须大于0: {price}"
+        if 'shares' in leg and leg['shares'] <= 0:
+            return None, f"第{i + 1}笔委托shares必须大于0: {shares}"
+        if 'position_pct' in leg and not 0 < leg['position_pct'] <= 1:
+            return None, f"第{i + 1}笔委托position_pct必须在(0, 1]之间: {position_pct}"
+        legs.append(leg)
+    return legs, None
+
+
+@trade_bp.route('/outer/trade/batch/<operation>', methods=['POST'])
+@api_signature_required
+@handle_exceptions
+def outer_trade_batch(operation):
+    """第三方调用的批量交易接口（使用HMAC签名验证）
+
+    每个账户只取一次资金/持仓快照，按快照计算所有标的的委托数量后一起提交，返回逐笔结果
+    """
+    if operation not in ['buy', 'sell']:
+        return jsonify({"error": "操作类型必须是 buy 或 sell"}), 400
+
+    data = request.get_json()
+    if not data:
+        log.error("第三方批量交易请求数据为空")
+        return jsonify({"error": "请求数据不能为空"}), 400
+
+    trader_index = data.get('trader_index')
+    strategy_name = data.get('strategy_name', '外部策略')
+    submit_mode = data.get('submit_mode', 'async_wait')
+
+    legs, error = parse_batch_legs(data)
+    if error:
+        log.error(f"第三方批量{operation}交易参数错误: {error}")
+        return jsonify({"error": error}), 400
+
+    if trader_index is not None and (trader_index >= len(traders) or trader_index < 0):
+        log.error(f"无效的交易器索引: {trader_index}")
+        return jsonify({"error": f"无效的交易器索引: {trader_index}"}), 400
+
+    if submit_mode not in SUBMIT_MODES:
+        return jsonify({"error": f"submit_mode 必须是 {', '.join(SUBMIT_MODES)} 之一"}), 400
+
+    log.info(f"第三方开始执行批量{operation}交易: {len(legs)}笔, strategy_name={strategy_name}")
+
+    results, spread_ms = fan_out(select_accounts(trader_index),
+                                 lambda trader: trader.trade_batch(operation, legs, submit_mode),
+                                 f"第三方调用-批量{operation}交易")
+
+    return jsonify({
+        "message": f"第三方批量{operation}交易执行完成",
+        "operation": operation,
+        "strategy_name": strategy_name,
+        "legs": len(legs),
+        "results": results,
+        "submit_spread_ms": spread_ms
+    }), fan_out_status(results)
+
+
+@trade_bp.route('/rebalance', methods=['POST'])
+@api_signature_required
+@handle_exceptions
+def rebalance():
+    """按目标权重调仓接口
+
+    请求体: {"targets": {symbol: 权重}, "prices": {symbol: 价格}, "price_type": 0, "dry_run": false,
+             "cash_buffer": 0, "trader_index": null, "submit_mode": "async_wait"}
+    未在targets中的持仓会被清仓；dry_run为true时只返回计划委托和计算耗时。
+    """
+    data = request.get_json()
+    if not data:
+        return jsonify({"error": "请求数据不能为空"}), 400
+
+    targets = data.get('targets')
+    prices = data.get('prices') or {}
+    price_type = data.get('price_type', 0)
+    dry_run = bool(data.get('dry_run', False))
+    cash_buffer = data.get('cash_buffer', 0.0)
+    trader_index = data.get('trader_index')
+    submit_mode = data.get('submit_mode', 'async_wait')
+
+    if not isinstance(targets, dict) or not isinstance(prices, dict):
+        return jsonify({"error": "targets 和 prices 必须是 {symbol: 数值} 格式"}), 400
+    try:
+        weights = [float(w) for w in targets.values()]
+        cash_buffer = float(cash_buffer)
+    except (TypeError, ValueError):
+        return jsonify({"error": "目标权重和 cash_buffer 必须是数值"}), 400
+    if any(w < 0 for w in weights) or sum(weights) > 1 + 1e-6:
+        return jsonify({"error": "目标权重必须非负且合计不超过1"}), 400
+    if not 0 <= cash_buffer < 1:
+        return jsonify({"error": "cash_buffer 必须在 [0, 1) 之间"}), 400
+
+    if trader_index is not None and (trader_index >= len(traders) or trader_index < 0):
+        log.error(f"无效的交易器索引: {trader_index}")
+        return jsonify({"error": f"无效的交易器索引: {trader_index}"}), 400
+
+    if submit_mode not in SUBMIT_MODES:
+        return jsonify({"error": f"submit_mode 必须是 {', '.join(SUBMIT_MODES)} 之一"}), 400
+
+    log.info(f"开始调仓: {len(targets)}只标的, dry_run={dry_run}")
+    results, spread_ms = fan_out(
+        select_accounts(trader_index),
+        lambda trader: trader.rebalance(targets, prices, price_type, dry_run, cash_buffer, submit_mode),
+        '调仓计划' if dry_run else '调仓')
+
+    return jsonify({
+        "message": "调仓计划已生成" if dry_run else "调仓执行完成",
+        "dry_run": dry_run,
+        "results": results,
+        "submit_spread_ms": spread_ms
+    }), fan_out_status(results)
 
 
 @trade_bp.route('/trade/allin', methods=['POST'])
@@ -366,16 +651,10 @@ def trade_allin():
         log.error(f"无效的交易器索引: {trader_index}")
         return jsonify({"error": f"无效的交易器索引: {trader_index}"}), 400
 
-    results = []
-    accounts = [traders[trader_index]] if trader_index is not None else traders
-    for i, trader in enumerate(accounts):
-        try:
-            result = trader.trade_allin(symbol, cur_price)
-            results.append({'trader_index': i, 'result': result, 'status': 'success'})
-        except Exception as e:
-            results.append({'trader_index': i, 'error': str(e), 'status': 'failed'})
+    results, spread_ms = fan_out(select_accounts(trader_index),
+                                 lambda trader: trader.trade_allin(symbol, cur_price), '全仓买入')
 
-    return jsonify({'message': '全仓买入完成', 'results': results})
+    return jsonify({'message': '全仓买入完成', 'results': results, 'submit_spread_ms': spread_ms}), fan_out_status(results)
 
 
 @trade_bp.route('/trade/nhg', methods=['POST'])
@@ -384,22 +663,15 @@ def trade_allin():
 def nhg():
     """逆回购接口"""
 
-    results = []
     data = request.get_json()
     trader_index = data.get('trader_index')
     if trader_index is not None and (trader_index >= len(traders) or trader_index < 0):
         log.error(f"无效的交易器索引: {trader_index}")
         return jsonify({"error": f"无效的交易器索引: {trader_index}"}), 400
 
-    accounts = [traders[trader_index]] if trader_index is not None else traders
-    for i, trader in enumerate(accounts):
-        try:
-            trader.nhg()
-            results.append({'trader_index': i, 'status': 'success'})
-        except Exception as e:
-            results.append({'trader_index': i, 'error': str(e), 'status': 'failed'})
+    results, spread_ms = fan_out(select_accounts(trader_index), lambda trader: trader.nhg(), '逆回购')
 
-    return jsonify({'message': '逆回购完成', 'results': results})
+    return jsonify({'message': '逆回购完成', 'results': results, 'submit_spread_ms': spread_ms}), fan_out_status(results)
 
 
 @trade_bp.route('/cancel_orders/sale', methods=['POST'])
@@ -407,22 +679,16 @@ def nhg():
 @handle_exceptions
 def cancel_all_orders_sale():
     """取消所有卖单接口"""
-    results = []
     data = request.get_json()
     trader_index = data.get('trader_index')
     if trader_index is not None and (trader_index >= len(traders) or trader_index < 0):
         log.error(f"无效的交易器索引: {trader_index}")
         return jsonify({"error": f"无效的交易器索引: {trader_index}"}), 400
 
-    accounts = [traders[trader_index]] if trader_index is not None else traders
-    for i, trader in enumerate(accounts):
-        try:
-            trader.cancel_all_orders_sale()
-            results.append({'trader_index': i, 'status': 'success'})
-        except Exception as e:
-            results.append({'trader_index': i, 'error': str(e), 'status': 'failed'})
+    results, spread_ms = fan_out(select_accounts(trader_index),
+                                 lambda trader: trader.cancel_all_orders_sale(), '取消所有卖单')
 
-    return jsonify({'message': '取消所有卖单完成', 'results': results})
+    return jsonify({'message': '取消所有卖单完成', 'results': results, 'submit_spread_ms': spread_ms}), fan_out_status(results)
 
 
 @trade_bp.route('/cancel_orders/buy', methods=['POST'])
@@ -430,22 +696,57 @@ def cancel_all_orders_sale():
 @handle_exceptions
 def cancel_all_orders_buy():
     """取消所有买单接口"""
-    results = []
     data = request.get_json()
     trader_index = data.get('trader_index')
     if trader_index is not None and (trader_index >= len(traders) or trader_index < 0):
         log.error(f"无效的交易器索引: {trader_index}")
         return jsonify({"error": f"无效的交易器索引: {trader_index}"}), 400
 
-    accounts = [traders[trader_index]] if trader_index is not None else traders
-    for i, trader in enumerate(accounts):
-        try:
-            trader.cancel_all_orders_buy()
-            results.append({'trader_index': i, 'status': 'success'})
-        except Exception as e:
-            results.append({'trader_index': i, 'error': str(e), 'status': 'failed'})
+    results, spread_ms = fan_out(select_accounts(trader_index),
+                                 lambda trader: trader.cancel_all_orders_buy(), '取消所有买单')
+
+    return jsonify({'message': '取消所有买单完成', 'results': results, 'submit_spread_ms': spread_ms}), fan_out_status(results)
+
+
+@trade_bp.route('/cancel_orders/bulk', methods=['POST'])
+@api_signature_required
+@handle_exceptions
+def cancel_orders_bulk():
+    """按条件批量撤单接口
+
+    请求体: {"trader_index", "side": "buy"/"sell", "symbols": [...], "strategy_name",
+             "min_age": 秒, "price_min", "price_max", "timeout": 秒}，条件均可选
+    """
+    data = request.get_json() or {}
+    trader_index = data.get('trader_index')
+    side = data.get('side')
+    symbols = data.get('symbols')
+    if trader_index is not None and (trader_index >= len(traders) or trader_index < 0):
+        log.error(f"无效的交易器索引: {trader_index}")
+        return jsonify({"error": f"无效的交易器索引: {trader_index}"}), 400
+    if side not in (None, 'buy', 'sell'):
+        return jsonify({"error": "side 必须是 buy 或 sell"}), 400
+    if symbols is not None and not isinstance(symbols, list):
+        return jsonify({"error": "symbols 必须是列表"}), 400
+    try:
+        numeric = {key: None if data.get(key) is None else float(data[key])
+                   for key in ('min_age', 'price_min', 'price_max', 'timeout')}
+    except (TypeError, ValueError):
+        return jsonify({"error": "min_age, price_min, price_max, timeout 必须是数值"}), 400
+
+    start_ts = time.time()
+    results, spread_ms = fan_out(
+        select_accounts(trader_index),
+        lambda trader: trader.bulk_cancel(side, symbols, data.get('strategy_name'), numeric['min_age'],
+                                          numeric['price_min'], numeric['price_max'], numeric['timeout']),
+        '批量撤单')
 
-    return jsonify({'message': '取消所有买单完成', 'results': results})
+    return jsonify({
+        'message': '批量撤单完成',
+        'results': results,
+        'submit_spread_ms': spread_ms,
+        'wall_ms': round((time.time() - start_ts) * 1000, 3)
+    }), fan_out_status(results)
 
 
 @trade_bp.route('/cancel_order', methods=['POST'])
@@ -477,21 +778,31 @@ def order():
         return jsonify({"error": f"无效的交易器索引: {trader_index}"}), 400
 
     trader = traders[trader_index]
-    return jsonify(trader.query_order(order_id))
+    result = trader.query_order(order_id)
+    if result is None:
+        return jsonify({"error": f"委托不存在: {order_id}"}), 404
+    return jsonify(result)
 
 
 @trade_bp.route('/orders', methods=['POST'])
 @api_signature_required
 @handle_exceptions
 def orders():
-    """所有订单查询"""
+    """所有订单查询，可按 symbol/side/status/strategy_name 筛选"""
 
     data = request.get_json()
     trader_index = data.get('trader_index')
     cancelable_only = data.get('cancelable_only', False)
+    side = data.get('side')
     if trader_index is None or trader_index >= len(traders) or trader_index < 0:
         log.error(f"无效的交易器索引: {trader_index}")
         return jsonify({"error": f"无效的交易器索引: {trader_index}"}), 400
+    if side not in (None, 'buy', 'sell'):
+        return jsonify({"error": "side 必须是 buy 或 sell"}), 400
+    status, error = parse_order_status(data.get('status'))
+    if error:
+        return jsonify({"error": error}), 400
 
     trader = traders[trader_index]
-    return jsonify(trader.query_orders(cancelable_only))
+    return jsonify(trader.query_orders(cancelable_only, symbol=data.get('symbol'), side=side,
+                                       status=status, strategy_name=data.get('strategy_name')))
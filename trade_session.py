@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+交易会话管理
+
+同一个QMT userdata路径只保留一个已启动的XtQuantTrader，多个账户在该会话上订阅，
+会话回调按account_id分发到各账户自己的MyXtQuantTraderCallback。
+重连时旧会话先停止再重建，避免线程和内存在一周的交易中不断累积。
+"""
+import itertools
+import os
+import threading
+import time
+
+from xtquant.xttrader import XtQuantTrader, XtQuantTraderCallback
+from xtquant.xttype import StockAccount
+from connection_supervisor import TradeConnectionError
+from logger_config import get_logger
+
+log = get_logger(__name__)
+
+# xt接口要求同一终端上的会话号互不相同，用启动时间作为起点递增
+_session_ids = itertools.count(int(time.time()) % 100000000)
+
+
+class SessionCallback(XtQuantTraderCallback):
+    """会话级回调，按account_id分发到各账户回调"""
+
+    def __init__(self, session, generation):
+        super().__init__()
+        self.session = session
+        self.generation = generation
+
+    def _stale(self):
+        # 已被替换的旧会话停止时仍可能推送回调，丢弃以免影响新会话
+        return self.generation < self.session.generation
+
+    def _dispatch(self, name, data):
+        if self._stale():
+            return
+        callback = self.session.get_callback(getattr(data, 'account_id', None))
+        if callback is None:
+            log.info(f"{name} 未找到账户回调: {getattr(data, 'account_id', None)}")
+            return
+        getattr(callback, name)(data)
+
+    def on_disconnected(self):
+        if self._stale():
+            return
+        self.session.connected = False
+        for callback in self.session.all_callbacks():
+            callback.on_disconnected()
+
+    def on_account_status(self, status):
+        self._dispatch('on_account_status', status)
+
+    def on_stock_order(self, order):
+        self._dispatch('on_stock_order', order)
+
+    def on_stock_asset(self, asset):
+        self._dispatch('on_stock_asset', asset)
+
+    def on_stock_trade(self, trade):
+        self._dispatch('on_stock_trade', trade)
+
+    def on_stock_position(self, position):
+        self._dispatch('on_stock_position', position)
+
+    def on_order_error(self, order_error):
+        self._dispatch('on_order_error', order_error)
+
+    def on_cancel_error(self, cancel_error):
+        self._dispatch('on_cancel_error', cancel_error)
+
+    def on_order_stock_async_response(self, response):
+        self._dispatch('on_order_stock_async_response', response)
+
+    def on_cancel_order_stock_async_response(self, response):
+        self._dispatch('on_cancel_order_stock_async_response', response)
+
+
+class TradeSession:
+    """单个QMT路径上的共享XtQuantTrader会话"""
+
+    def __init__(self, path):
+        self.path = path
+        self.trader = None
+        self.session_id = None
+        self.generation = 0  # 每重建一次会话加1
+        self.connected = False
+        self._accounts = {}  # account_id -> StockAccount
+        self._callbacks = {}  # account_id -> 账户回调
+        self._subscribed = set()  # 当前会话上已订阅的account_id
+        self._lock = threading.RLock()
+
+    def get_callback(self, account_id):
+        return self._callbacks.get(str(account_id))
+
+    def all_callbacks(self):
+        return list(self._callbacks.values())
+
+    def connect(self, account_id, callback, generation=None):
+        """把账户接入会话，返回 (XtQuantTrader, StockAccount, generation)
+
+        generation: 账户上次接入的会话代数。会话已断开且仍是该代时重建会话（停止旧会话、
+        重新连接并订阅所有账户）；会话已被其他账户重建时直接复用。
+        失败抛出TradeConnectionError。
+        """
+        account_id = str(account_id)
+        with self._lock:
+            self._callbacks[account_id] = callback
+            if account_id not in self._accounts:
+                # StockAccount可以用第二个参数指定账号类型，如沪港通传'HUGANGTONG'，深港通传'SHENGANGTONG'
+                self._accounts[account_id] = StockAccount(account_id, 'STOCK')
+            if self.trader is None or not self.connected:
+                self._rebuild()
+            elif generation == self.generation and account_id in self._subscribed:
+                # 会话正常但账户仍报告断开（如账号状态异常），只重新订阅该账户
+                self.trader.unsubscribe(self._accounts[account_id])
+                self._subscribed.discard(account_id)
+            if account_id not in self._subscribed:
+                self._subscribe(account_id)
+            return self.trader, self._accounts[account_id], self.generation
+
+    def _rebuild(self):
+        self.close()
+        session_id = next(_session_ids)
+        log.info(f"init qmt安装路径:{self.path} session_id={session_id} accounts={list(self._accounts)}")
+        trader = XtQuantTrader(self.path, session_id)
+        # 开启主动请求接口的专用线程 开启后在on_stock_xxx回调函数里调用XtQuantTrader.query_xxx函数不会卡住回调线程，但是查询和推送的数据在时序上会变得不确定
+        # 详见: http://docs.thinktrader.net/vip/pages/ee0e9b/#开启主动请求接口的专用线程
+        # http://dict.thinktrader.net/nativeApi/xttrader.html
+        # trader.set_relaxed_response_order_enabled(True)
+        trader.register_callback(SessionCallback(self, self.generation + 1))
+        trader.start()  # 启动交易线程
+        connect_result = trader.connect()
+        log.info(f"{self.path} connect_result={connect_result}")
+        if connect_result != 0:
+            self._stop_trader(trader)
+            raise TradeConnectionError('链接失败 %d' % connect_result)
+        self.trader = trader
+        self.session_id = session_id
+        self.generation += 1
+        self.connected = True
+        self._subscribed = set()
+        # 重建后把其他已登记的账户一并订阅，它们的守护线程重连时直接复用本会话
+        for account_id in self._accounts:
+            try:
+                self._subscribe(account_id)
+            except TradeConnectionError as e:
+                log.info(str(e))
+
+    def _subscribe(self, account_id):
+        subscribe_result = self.trader.subscribe(self._accounts[account_id])
+        if subscribe_result != 0:
+            log.info('账号订阅失败 %s %d' % (account_id, subscribe_result))
+            raise TradeConnectionError('账号订阅失败 %d' % subscribe_result)
+        log.info('账号订阅成功 %s %d' % (account_id, subscribe_result))
+        self._subscribed.add(account_id)
+
+    def close(self):
+        """停止当前会话，释放其线程"""
+        with self._lock:
+            if self.trader is not None:
+                log.info(f"停止交易会话 {self.path} session_id={self.session_id}")
+                self._stop_trader(self.trader)
+            self.trader = None
+            self.connected = False
+            self._subscribed = set()
+
+    @staticmethod
+    def _stop_trader(trader):
+        try:
+            trader.stop()
+        except Exception as e:
+            log.info(f"停止交易会话失败: {e}")
+
+
+class TradeSessionManager:
+    """按QMT路径管理共享会话"""
+
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def get_session(self, path):
+        key = os.path.normcase(os.path.abspath(path))
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = self._sessions[key] = TradeSession(path)
+            return session
+
+    def close_all(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+        for session in sessions:
+            session.close()
+
+
+session_manager = TradeSessionManager()